@@ -0,0 +1,272 @@
+"""
+Offline batch mode for large evaluation sweeps.
+
+Instead of one synchronous request per (task, model) call, every pending
+request of a run is written in the provider's batch format and submitted to
+its batch API: OpenAI and Groq take a JSONL file of /v1/chat/completions
+requests, Anthropic takes a Message Batch. Submitted batches are polled with
+backoff and their results are ingested into the same eval results store as
+run_evals.py, with mode "batch".
+
+Every request has a custom_id derived from its task, provider and model, and
+every batch is recorded in the results store as soon as the provider accepts
+it. Re-running the same command with the same --run-id therefore resumes a
+sweep after a crash or a --no-wait submission: answered requests are skipped,
+batches still running are polled instead of resubmitted, and only requests
+that were never sent (or whose batch failed or expired) are submitted again.
+Requests the provider answered with an error are final unless --retry-errors
+is given.
+
+    python batch_evals.py --tasks requests.jsonl --run-id nightly-0601
+    python batch_evals.py --tasks requests.jsonl --run-id nightly-0601 --no-wait   # submit and exit
+    python batch_evals.py --tasks requests.jsonl --run-id nightly-0601             # collect / resume
+
+Ollama has no batch API; its models are skipped here and run with run_evals.py.
+benchmarks/batch_server.py is a local stand-in for all three batch APIs.
+"""
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+
+from eval_results import ResultsStore, RESULTS_PATH, summarize
+from run_evals import load_tasks, TASKS_PATH
+from utils import configure_logging
+from settings import get_info
+from utils.retry import resilient_call
+
+log = logging.getLogger(__name__)
+
+BATCH_PROVIDERS = ("openai", "anthropic", "groq")
+MAX_BATCH_REQUESTS = 10000      # requests per submitted batch; smaller batches finish and ingest sooner
+COMPLETION_WINDOW = "24h"
+MAX_TOKENS = 4096               # Anthropic requires max_tokens; same as llm_call_claude
+POLL_INITIAL = 10.0             # first wait between status checks, seconds
+POLL_MAX = 300.0                # wait ceiling between status checks, seconds
+POLL_BACKOFF = 1.5              # growth factor between status checks
+
+OPENAI_FINISHED = ("completed", "failed", "expired", "cancelled")
+
+def custom_id(task_id, provider, model):
+    """Stable id for one (task, model) request; fits Anthropic's [A-Za-z0-9_-]{1,64}."""
+    digest = hashlib.sha1(f"{task_id}\0{provider}\0{model}".encode("utf-8")).hexdigest()
+    return f"req-{digest[:32]}"
+
+def chat_request(request_id, model, prompt, system, temperature, context=None):
+    """One line of an OpenAI or Groq batch input file; context goes ahead of the prompt as in gpt_messages."""
+    from llms.llms import gpt_messages
+    return {
+        "custom_id": request_id, "method": "POST", "url": "/v1/chat/completions",
+        "body": {"model": model, "temperature": temperature, "messages": gpt_messages(prompt, system, context)},
+    }
+
+def anthropic_request(request_id, model, prompt, system, temperature, context=None):
+    """One request of an Anthropic message batch, with claude_request's cache breakpoints."""
+    from llms.llms import claude_request
+    system, messages = claude_request(prompt, system, context)
+    return {
+        "custom_id": request_id,
+        "params": {"model": model, "max_tokens": MAX_TOKENS, "system": system, "temperature": temperature,
+                   "messages": messages},
+    }
+
+def batch_client(provider):
+    from llms.clients import get_openai_client, get_anthropic_client, get_groq_client
+    return {"openai": get_openai_client, "anthropic": get_anthropic_client, "groq": get_groq_client}[provider]()
+
+def submit_batch(provider, requests, metadata=None):
+    """Send one batch of requests to the provider and return its batch id."""
+    client = batch_client(provider)
+    if provider == "anthropic":
+        return resilient_call(provider, client.messages.batches.create, requests=requests).id
+    data = "".join(json.dumps(request) + "\n" for request in requests).encode("utf-8")
+    input_file = resilient_call(provider, client.files.create, file=("batch.jsonl", data), purpose="batch")
+    return resilient_call(provider, client.batches.create, input_file_id=input_file.id,
+                          endpoint="/v1/chat/completions", completion_window=COMPLETION_WINDOW, metadata=metadata).id
+
+def check_batch(provider, batch_id):
+    """(provider status, finished, batch object) of a submitted batch."""
+    client = batch_client(provider)
+    if provider == "anthropic":
+        batch = resilient_call(provider, client.messages.batches.retrieve, batch_id)
+        return batch.processing_status, batch.processing_status == "ended", batch
+    batch = resilient_call(provider, client.batches.retrieve, batch_id)
+    return batch.status, batch.status in OPENAI_FINISHED, batch
+
+def _file_lines(provider, client, file_id):
+    if not file_id:
+        return []
+    text = resilient_call(provider, lambda: client.files.content(file_id).read()).decode("utf-8")
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def batch_outcomes(provider, batch):
+    """{custom_id: {"ok", "response" or "error", token counts}} for every request the batch reports on."""
+    client = batch_client(provider)
+    outcomes = {}
+    if provider == "anthropic":
+        if not batch.results_url:
+            return outcomes
+        for entry in resilient_call(provider, lambda: list(client.messages.batches.results(batch.id))):
+            result = entry.result
+            if result.type == "succeeded":
+                message = result.message
+                outcomes[entry.custom_id] = {
+                    "ok": 1, "response": "".join(block.text for block in message.content if block.type == "text"),
+                    "prompt_tokens": message.usage.input_tokens, "completion_tokens": message.usage.output_tokens,
+                }
+            else:
+                outcomes[entry.custom_id] = {"ok": 0, "error": f"{result.type}: {getattr(result, 'error', '')}"}
+        return outcomes
+    for line in _file_lines(provider, client, batch.output_file_id) + _file_lines(provider, client, batch.error_file_id):
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            error = line.get("error") or body.get("error") or body
+            outcomes[line["custom_id"]] = {"ok": 0, "error": json.dumps(error, default=str)[:1000]}
+        else:
+            usage = body.get("usage") or {}
+            outcomes[line["custom_id"]] = {
+                "ok": 1, "response": body["choices"][0]["message"]["content"],
+                "prompt_tokens": usage.get("prompt_tokens"), "completion_tokens": usage.get("completion_tokens"),
+            }
+    return outcomes
+
+class BatchRunner:
+    """Submits a run's (task, model) requests as provider batches and ingests the results."""
+
+    def __init__(self, models, store, max_batch_requests=MAX_BATCH_REQUESTS, retry_errors=False):
+        self.models = [m for m in models if m["provider"] in BATCH_PROVIDERS]
+        self.skipped = [m for m in models if m["provider"] not in BATCH_PROVIDERS]
+        self.store = store
+        self.max_batch_requests = max_batch_requests
+        self.retry_errors = retry_errors
+
+    def plan(self, run_id, tasks):
+        """{provider: [(custom_id, task, model), ...]} of requests neither answered nor waiting in a batch."""
+        done = self.store.completed_tasks(run_id, include_failed=not self.retry_errors)
+        waiting = {request_id for batch in self.store.batches(run_id, pending_only=True) for request_id in batch["requests"]}
+        plan = {}
+        for task in tasks:
+            for m in self.models:
+                provider, model = m["provider"], m["model"]
+                request_id = custom_id(task["task_id"], provider, model)
+                if (task["task_id"], provider, model) in done or request_id in waiting:
+                    continue
+                waiting.add(request_id)  # a task id repeated in the file is sent once
+                plan.setdefault(provider, []).append((request_id, task, model))
+        return plan
+
+    def submit(self, run_id, tasks):
+        """Submit every planned request, MAX_BATCH_REQUESTS per batch; returns the new batch ids."""
+        from llms.llms import system_message, temp
+        batch_ids = []
+        for provider, requests in self.plan(run_id, tasks).items():
+            build = anthropic_request if provider == "anthropic" else chat_request
+            for start in range(0, len(requests), self.max_batch_requests):
+                chunk = requests[start:start + self.max_batch_requests]
+                lines = [build(request_id, model, task["prompt"], task.get("system") or system_message, temp,
+                               context=task.get("context"))
+                         for request_id, task, model in chunk]
+                batch_id = submit_batch(provider, lines, metadata={"galen_run": run_id})
+                self.store.record_batch(run_id, provider, batch_id, {
+                    request_id: [task["task_id"], task["task_type"], model] for request_id, task, model in chunk})
+                log.info("Submitted %s batch %s with %d requests", provider, batch_id, len(chunk))
+                batch_ids.append(batch_id)
+        return batch_ids
+
+    def ingest(self, run_id, batch, status, handle):
+        """Record the results of a finished batch; returns how many requests got no result."""
+        outcomes = batch_outcomes(batch["provider"], handle)
+        turnaround = time.time() - batch["submitted_at"]
+        results = []
+        for request_id, (task_id, task_type, model) in batch["requests"].items():
+            outcome = outcomes.get(request_id)
+            if outcome is None:
+                continue  # never processed; submitted again on the next run
+            results.append({
+                "run_id": run_id, "task_id": task_id, "task_type": task_type, "provider": batch["provider"],
+                "model": model, "mode": "batch", "started_at": batch["submitted_at"], "cache_hit": 0,
+                "batch_id": batch["batch_id"], "custom_id": request_id, "turnaround_s": turnaround, **outcome,
+            })
+        missing = len(batch["requests"]) - len(results)
+        self.store.ingest_batch(batch["batch_id"], results, status="ingested" if results else "failed")
+        log.info("Batch %s %s: %d results, %d missing", batch["batch_id"], status, len(results), missing)
+        return missing
+
+    def poll(self, run_id, wait=True, timeout=None, poll_initial=POLL_INITIAL):
+        """
+        Check every pending batch of the run once, ingesting finished ones. With
+        wait, keep checking with backoff until none is pending or timeout seconds
+        have passed. Returns the batches still pending.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = poll_initial
+        while True:
+            pending = []
+            for batch in self.store.batches(run_id, pending_only=True):
+                status, finished, handle = check_batch(batch["provider"], batch["batch_id"])
+                if finished:
+                    self.ingest(run_id, batch, status, handle)
+                    continue
+                if status != batch["status"]:
+                    self.store.set_batch_status(batch["batch_id"], status)
+                pending.append(batch)
+            if not pending or not wait:
+                return pending
+            sleep = interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return pending
+                sleep = min(sleep, remaining)
+            time.sleep(sleep)
+            interval = min(interval * POLL_BACKOFF, POLL_MAX)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an eval task file through the providers' batch APIs.")
+    parser.add_argument("--tasks", default=TASKS_PATH, help="JSONL task file")
+    parser.add_argument("--models", nargs="*", help="only run these model names")
+    parser.add_argument("--limit", type=int, help="only run the first N tasks")
+    parser.add_argument("--run-id", help="name of the run; run again with the same id to resume or collect it")
+    parser.add_argument("--results", default=RESULTS_PATH, help="results store path")
+    parser.add_argument("--no-wait", action="store_true", help="submit (and ingest anything finished), then exit")
+    parser.add_argument("--timeout", type=float, help="stop polling after this many seconds")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INITIAL, help="first wait between status checks")
+    parser.add_argument("--max-batch-requests", type=int, default=MAX_BATCH_REQUESTS, help="requests per batch")
+    parser.add_argument("--retry-errors", action="store_true", help="resubmit requests that came back with an error")
+    args = parser.parse_args(argv)
+
+    info = get_info()
+    models = info.get("eval_models", [])
+    if args.models:
+        models = [m for m in models if m["model"] in args.models]
+    store = ResultsStore(args.results)
+    runner = BatchRunner(models, store, args.max_batch_requests, args.retry_errors)
+    for m in runner.skipped:
+        print(f"Skipping {m['model']}: {m['provider']} has no batch API, run it with run_evals.py")
+    if not runner.models:
+        print("No batch-capable models configured under eval_models in config/info.json")
+        store.close()
+        return 1
+
+    run_id = args.run_id or time.strftime("batch-%Y%m%d-%H%M%S")
+    tasks = load_tasks(args.tasks)[:args.limit]
+    batch_ids = runner.submit(run_id, tasks)
+    print(f"Run {run_id}: submitted {len(batch_ids)} new batches")
+    pending = runner.poll(run_id, wait=not args.no_wait, timeout=args.timeout, poll_initial=args.poll_interval)
+    if pending:
+        print(f"{len(pending)} batches still running; collect them with --run-id {run_id}")
+    else:
+        unanswered = sum(len(requests) for requests in runner.plan(run_id, tasks).values())
+        if unanswered:
+            print(f"{unanswered} requests have no result; run again with --run-id {run_id} to resubmit them")
+        for row in summarize(store.fetch(run_id=run_id)):
+            print(json.dumps(row, default=str))
+    store.close()
+    return 0
+
+if __name__ == "__main__":
+    configure_logging()
+    sys.exit(main())
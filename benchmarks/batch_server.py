@@ -0,0 +1,304 @@
+"""
+Local stand-in for the OpenAI, Groq and Anthropic batch APIs.
+
+Serves just enough of the Files and Batches endpoints (at /v1 for OpenAI and
+/openai/v1 for Groq) and of Anthropic's Message Batches for batch_evals.py to
+run end to end through the real SDKs without network. A batch finishes
+`delay` seconds after it is submitted. Answers are the deterministic stub
+answers from benchmarks.stub_llms. A prompt containing FAIL_MARKER gets a
+per-request error, so the error path can be exercised too.
+
+    python -m benchmarks.batch_server --port 8765 --delay 5
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 ANTHROPIC_BASE_URL=http://127.0.0.1:8765 \\
+        GROQ_BASE_URL=http://127.0.0.1:8765 python batch_evals.py --poll-interval 1
+
+In-process, local_batch_server() starts it on a free port and points the
+shared provider clients at it for the duration of a with block.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from email import policy
+from email.parser import BytesParser
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.stub_llms import text_for
+
+log = logging.getLogger(__name__)
+
+DELAY_S = 2.0                   # seconds from submission until a batch is finished
+FAIL_MARKER = "[[fail]]"        # prompts containing this get a per-request error
+ANTHROPIC_ID = re.compile(r"^[a-zA-Z0-9_-]{1,64}$")
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat().replace("+00:00", "Z")
+
+def _new_id(prefix):
+    return f"{prefix}{uuid.uuid4().hex[:24]}"
+
+def _answer(prompt, model):
+    """(ok, text or error message, prompt tokens, completion tokens) for one request."""
+    if FAIL_MARKER in prompt:
+        return False, f"stub failure for model {model}", 0, 0
+    text = text_for(prompt)
+    return True, text, len(prompt.split()), len(text.split())
+
+class BatchState:
+    """Uploaded files and submitted batches, finished lazily when they are first read after their deadline."""
+
+    def __init__(self, delay=DELAY_S):
+        self.delay = delay
+        self.files = {}
+        self.batches = {}
+        self.message_batches = {}
+        self.lock = threading.Lock()
+
+    def add_file(self, filename, data, purpose):
+        file_id = _new_id("file-")
+        self.files[file_id] = {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                               "filename": filename, "purpose": purpose, "data": data}
+        return {k: v for k, v in self.files[file_id].items() if k != "data"}
+
+    def create_batch(self, body):
+        source = self.files.get(body.get("input_file_id"))
+        if source is None:
+            raise KeyError("input file not found")
+        lines = [json.loads(line) for line in source["data"].decode("utf-8").splitlines() if line.strip()]
+        ids = [line["custom_id"] for line in lines]
+        if len(set(ids)) != len(ids):
+            raise ValueError("custom_id values must be unique within a batch")
+        now = time.time()
+        batch = {
+            "id": _new_id("batch_"), "object": "batch", "endpoint": body.get("endpoint"),
+            "input_file_id": source["id"], "completion_window": body.get("completion_window"),
+            "status": "validating", "created_at": int(now), "in_progress_at": int(now),
+            "expires_at": int(now + 86400), "metadata": body.get("metadata"),
+            "output_file_id": None, "error_file_id": None, "errors": None,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+            "_lines": lines, "_ready_at": now + self.delay,
+        }
+        self.batches[batch["id"]] = batch
+        return batch
+
+    def _finish_batch(self, batch):
+        outputs, errors = [], []
+        for line in batch.pop("_lines"):
+            model = line["body"].get("model")
+            prompt = next((m["content"] for m in reversed(line["body"]["messages"]) if m["role"] == "user"), "")
+            ok, text, prompt_tokens, completion_tokens = _answer(prompt, model)
+            if ok:
+                outputs.append({"id": _new_id("batch_req_"), "custom_id": line["custom_id"], "error": None, "response": {
+                    "status_code": 200, "request_id": _new_id("req_"), "body": {
+                        "id": _new_id("chatcmpl-"), "object": "chat.completion", "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                     "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens}}}})
+            else:
+                errors.append({"id": _new_id("batch_req_"), "custom_id": line["custom_id"], "response": None,
+                               "error": {"code": "stub_error", "message": text}})
+        for records, key in ((outputs, "output_file_id"), (errors, "error_file_id")):
+            if records:
+                data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+                batch[key] = self.add_file(f"{batch['id']}_{key}.jsonl", data, "batch_output")["id"]
+        batch.update(status="completed", finalizing_at=int(time.time()), completed_at=int(time.time()),
+                     request_counts={"total": len(outputs) + len(errors), "completed": len(outputs),
+                                     "failed": len(errors)})
+
+    def get_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        if batch["status"] in ("validating", "in_progress"):
+            if time.time() >= batch["_ready_at"]:
+                self._finish_batch(batch)
+            else:
+                batch["status"] = "in_progress"
+        return {k: v for k, v in batch.items() if not k.startswith("_")}
+
+    def cancel_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        if batch["status"] in ("validating", "in_progress"):
+            batch.pop("_lines", None)
+            batch.update(status="cancelled", cancelled_at=int(time.time()))
+        return self.get_batch(batch_id)
+
+    def create_message_batch(self, body, base_url):
+        requests = body.get("requests") or []
+        ids = [request.get("custom_id", "") for request in requests]
+        if len(set(ids)) != len(ids) or not all(ANTHROPIC_ID.match(i) for i in ids):
+            raise ValueError("custom_id values must be unique and match ^[a-zA-Z0-9_-]{1,64}$")
+        now = time.time()
+        batch_id = _new_id("msgbatch_")
+        batch = {
+            "id": batch_id, "type": "message_batch", "processing_status": "in_progress",
+            "request_counts": {"processing": len(requests), "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": _iso(now), "expires_at": _iso(now + 86400), "ended_at": None,
+            "cancel_initiated_at": None, "archived_at": None, "results_url": None,
+            "_requests": requests, "_ready_at": now + self.delay,
+            "_results_url": f"{base_url}/v1/messages/batches/{batch_id}/results",
+        }
+        self.message_batches[batch_id] = batch
+        return self.get_message_batch(batch_id)
+
+    def _finish_message_batch(self, batch):
+        results, succeeded = [], 0
+        for request in batch.pop("_requests"):
+            params = request["params"]
+            prompt = next((m["content"] for m in reversed(params["messages"]) if m["role"] == "user"), "")
+            if isinstance(prompt, list):
+                prompt = " ".join(block.get("text", "") for block in prompt)
+            ok, text, prompt_tokens, completion_tokens = _answer(prompt, params.get("model"))
+            if ok:
+                succeeded += 1
+                result = {"type": "succeeded", "message": {
+                    "id": _new_id("msg_"), "type": "message", "role": "assistant", "model": params.get("model"),
+                    "content": [{"type": "text", "text": text}], "stop_reason": "end_turn", "stop_sequence": None,
+                    "usage": {"input_tokens": prompt_tokens, "output_tokens": completion_tokens}}}
+            else:
+                result = {"type": "errored", "error": {"type": "error", "error": {"type": "api_error", "message": text}}}
+            results.append({"custom_id": request["custom_id"], "result": result})
+        batch["_results"] = "".join(json.dumps(record) + "\n" for record in results).encode("utf-8")
+        batch.update(processing_status="ended", ended_at=_iso(time.time()), results_url=batch["_results_url"],
+                     request_counts={"processing": 0, "succeeded": succeeded, "errored": len(results) - succeeded,
+                                     "canceled": 0, "expired": 0})
+
+    def get_message_batch(self, batch_id):
+        batch = self.message_batches[batch_id]
+        if batch["processing_status"] == "in_progress" and time.time() >= batch["_ready_at"]:
+            self._finish_message_batch(batch)
+        return {k: v for k, v in batch.items() if not k.startswith("_")}
+
+class BatchHandler(BaseHTTPRequestHandler):
+    """Routes the batch endpoints of the three SDKs to the server's BatchState."""
+
+    def log_message(self, format, *args):
+        log.debug("%s " + format, self.address_string(), *args)
+
+    def _send(self, status, payload=None, body=None, content_type="application/json"):
+        body = body if body is not None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, {"type": "error", "error": {"type": "invalid_request_error", "message": message}})
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _path(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        return path[len("/openai"):] if path.startswith("/openai/") else path  # Groq's prefix
+
+    def do_GET(self):
+        state, path = self.server.state, self._path()
+        with state.lock:
+            try:
+                if m := re.fullmatch(r"/v1/files/([^/]+)/content", path):
+                    return self._send(200, body=state.files[m.group(1)]["data"], content_type="application/octet-stream")
+                if m := re.fullmatch(r"/v1/batches/([^/]+)", path):
+                    return self._send(200, state.get_batch(m.group(1)))
+                if m := re.fullmatch(r"/v1/messages/batches/([^/]+)/results", path):
+                    batch = state.message_batches[m.group(1)]
+                    if "_results" not in batch:
+                        return self._error(400, "batch has not ended")
+                    return self._send(200, body=batch["_results"], content_type="application/binary")
+                if m := re.fullmatch(r"/v1/messages/batches/([^/]+)", path):
+                    return self._send(200, state.get_message_batch(m.group(1)))
+            except KeyError:
+                return self._error(404, f"not found: {path}")
+        self._error(404, f"unknown endpoint: GET {path}")
+
+    def do_POST(self):
+        state, path, body = self.server.state, self._path(), self._body()
+        with state.lock:
+            try:
+                if path == "/v1/files":
+                    message = BytesParser(policy=policy.HTTP).parsebytes(
+                        f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body)
+                    fields, upload = {}, None
+                    for part in message.iter_parts():
+                        name = part.get_param("name", header="content-disposition")
+                        if part.get_filename() is not None:
+                            upload = (part.get_filename(), part.get_payload(decode=True))
+                        else:
+                            fields[name] = part.get_payload(decode=True).decode("utf-8")
+                    if upload is None:
+                        return self._error(400, "no file in upload")
+                    return self._send(200, state.add_file(upload[0], upload[1], fields.get("purpose")))
+                if path == "/v1/batches":
+                    return self._send(200, state.get_batch(state.create_batch(json.loads(body))["id"]))
+                if m := re.fullmatch(r"/v1/batches/([^/]+)/cancel", path):
+                    return self._send(200, state.cancel_batch(m.group(1)))
+                if path == "/v1/messages/batches":
+                    base_url = f"http://{self.headers.get('Host') or '%s:%d' % self.server.server_address[:2]}"
+                    return self._send(200, state.create_message_batch(json.loads(body), base_url))
+            except KeyError as e:
+                return self._error(404, f"not found: {e}")
+            except ValueError as e:
+                return self._error(400, str(e))
+        self._error(404, f"unknown endpoint: POST {path}")
+
+def serve(port=0, delay=DELAY_S, host="127.0.0.1"):
+    """Start the server on a daemon thread; returns the server (its port is server.server_address[1])."""
+    server = ThreadingHTTPServer((host, port), BatchHandler)
+    server.state = BatchState(delay)
+    threading.Thread(target=server.serve_forever, name="batch-server", daemon=True).start()
+    return server
+
+@contextmanager
+def local_batch_server(delay=DELAY_S):
+    """Run the server and point the shared OpenAI, Anthropic and Groq clients at it inside the block."""
+    from llms.clients import reset_clients
+    server = serve(delay=delay)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    settings = {"OPENAI_BASE_URL": f"{url}/v1", "ANTHROPIC_BASE_URL": url, "GROQ_BASE_URL": url,
+                "OPENAI_API_KEY": "local", "ANTHROPIC_API_KEY": "local", "GROQ_API_KEY": "local"}
+    saved = {name: os.environ.get(name) for name in settings}
+    os.environ.update(settings)
+    reset_clients(close=False)
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        reset_clients(close=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the provider batch APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=DELAY_S, help="seconds until a submitted batch finishes")
+    args = parser.parse_args(argv)
+    server = serve(args.port, args.delay, args.host)
+    url = f"http://{args.host}:{server.server_address[1]}"
+    print(f"Batch server on {url}; point the SDKs at it with:\n"
+          f"  OPENAI_BASE_URL={url}/v1 ANTHROPIC_BASE_URL={url} GROQ_BASE_URL={url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
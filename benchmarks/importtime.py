@@ -0,0 +1,69 @@
+"""
+Cold import time of Galen's entry points, measured with python -X importtime.
+
+Each module is imported in a fresh interpreter. The reported time is the
+cumulative import time of the module itself (interpreter startup excluded),
+and the heaviest top-level modules it pulls in are listed, so a new eager
+import of pandas, matplotlib or a provider SDK shows up by name.
+
+    python -m benchmarks.importtime
+    python -m benchmarks.importtime front_end --top 15
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What `streamlit run front_end.py` and the command-line scripts import before doing any work
+ENTRY_POINTS = ("front_end", "process_openai", "run_sql", "run_evals", "index_advisor",
+                "get_table_schema", "llms.assistants")
+TOP = 8
+
+def import_profile(module, cwd=None):
+    """
+    (total seconds, [(name, cumulative seconds), ...]) for importing module in a
+    fresh interpreter; the list holds the top-level modules (no dotted names)
+    imported along the way, heaviest first.
+    """
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=cwd or REPO_ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    total, imports = None, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # the header line
+        name, cumulative = fields[2], int(fields[1]) / 1e6
+        if not name.startswith("  "):
+            # A depth-one line closes a subtree: the module's own, or interpreter startup (site, .pth files)
+            if name.strip() == module:
+                total = cumulative
+                break
+            imports = []
+        elif "." not in name:
+            imports.append((name.strip(), cumulative))
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return total, imports
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold import time of Galen's entry points.")
+    parser.add_argument("modules", nargs="*", default=list(ENTRY_POINTS), help="modules to import")
+    parser.add_argument("--top", type=int, default=TOP, help="heaviest imports to list per module")
+    args = parser.parse_args(argv)
+
+    for module in args.modules:
+        import_profile(module)  # write the .pyc files so they are not timed
+        total, imports = import_profile(module)
+        print(f"{module}: {total * 1000:.0f} ms")
+        for name, cumulative in imports[:args.top]:
+            print(f"    {cumulative * 1000:8.1f} ms  {name}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
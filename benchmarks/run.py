@@ -0,0 +1,303 @@
+"""
+Offline end-to-end benchmarks for every pipeline stage.
+
+Builds (or reuses) synthetic databases in a scratch directory, stubs every LLM
+provider with deterministic answers and a configurable latency, and times:
+
+    startup     cold import of each entry point in a fresh interpreter (-X importtime)
+    schema      get_table_schema introspection and the schema catalog
+    connection  attaching the databases, fresh and from the pool
+    query       run_sql on SQLite alone, through main() with logging, and from the cache
+    dispatch    util.execute_function_call and a full process_openai.main question
+    llm         every llms.py call path against the stubs
+    chart       frame summary, spec choice, local rendering and the Code Interpreter path
+
+Results go to a JSON report; --compare prints the benchmarks whose median got
+slower than in an earlier report.
+
+    python -m benchmarks.run --rows 1M --repeats 5
+    python -m benchmarks.run --compare bench/reports/<earlier>.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+from contextlib import redirect_stdout
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from utils import percentile
+from benchmarks.synthetic_db import generate, parse_count
+from benchmarks.stub_llms import stubbed_llms, TTFT_S, TOKEN_S
+from benchmarks.importtime import import_profile, ENTRY_POINTS
+
+WORK_DIR = "bench"
+REPEATS = 5
+REGRESSION_RATIO = 1.2      # a median this much slower than the baseline is reported
+NOISE_FLOOR_S = 0.001       # slowdowns smaller than this are timer noise, not regressions
+STAGES = ("startup", "schema", "connection", "query", "dispatch", "llm", "chart")
+QUESTION = "Extract dependency data for gene EP300, group them by OncotreeLineage and calculate averages."
+
+BENCH_QUERIES = {
+    "gene_rows": "SELECT * FROM DepMap WHERE gene_name = 'EP300'",
+    "gene_by_lineage": ("SELECT OncotreeLineage, AVG(dependency) AS avg_dependency, COUNT(*) AS models "
+                        "FROM DepMap WHERE gene_name = 'EP300' GROUP BY OncotreeLineage"),
+    "lineage_scan": "SELECT OncotreeLineage, COUNT(*) AS n, AVG(dependency) AS avg_dependency FROM DepMap GROUP BY OncotreeLineage",
+    "protein_partners": ("SELECT protein2, combined_score FROM protein_links WHERE protein1 = '9606.ENSP00000000001' "
+                         "ORDER BY CAST(combined_score AS INTEGER) DESC LIMIT 50"),
+}
+BACKEND_QUERIES = ("gene_by_lineage", "lineage_scan")  # also timed on each execution backend that answers them
+
+def git_commit():
+    """(commit hash, working tree has changes) of the repository, or (None, None) outside git."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def prepare_workdir(work_dir, rows, protein_rows, seed):
+    """Synthetic db/ and a copy of config/ under work_dir, regenerated only when the scale changes."""
+    db_dir = os.path.join(work_dir, "db")
+    marker = os.path.join(db_dir, "synthetic.json")
+    params = {"rows": rows, "protein_rows": protein_rows, "seed": seed}
+    current = None
+    if os.path.exists(marker):
+        with open(marker, encoding="utf-8") as file:
+            current = json.load(file)
+    if current != params:
+        print(f"Generating synthetic databases ({rows:,} DepMap rows) in {db_dir}")
+        generate(db_dir, rows, protein_rows, seed=seed)
+        with open(marker, "w", encoding="utf-8") as file:
+            json.dump(params, file)
+    for directory in ("config", "cache", "logs"):
+        os.makedirs(os.path.join(work_dir, directory), exist_ok=True)
+    shutil.copy(os.path.join(REPO_ROOT, "config", "info.json"), os.path.join(work_dir, "config", "info.json"))
+
+class Bench:
+    """Collects timings as {benchmark name: [seconds, ...]}."""
+
+    def __init__(self, repeats=REPEATS, verbose=False):
+        self.repeats = repeats
+        self.verbose = verbose
+        self.samples = {}
+
+    def time(self, name, fn, repeats=None, setup=None):
+        """Run fn repeats times (setup before each, untimed) and record the wall times."""
+        samples = self.samples.setdefault(name, [])
+        for _ in range(repeats or self.repeats):
+            if setup is not None:
+                setup()
+            output = io.StringIO()
+            start = time.perf_counter()
+            if self.verbose:
+                fn()
+            else:
+                with redirect_stdout(output):
+                    fn()
+            samples.append(time.perf_counter() - start)
+        print(f"  {name}: median {percentile(samples, 50) * 1000:.2f} ms")
+
+    def record(self, name, seconds):
+        """Add a timing measured elsewhere, such as in a subprocess."""
+        self.samples.setdefault(name, []).append(seconds)
+
+    def summary(self):
+        return {name: {
+            "n": len(samples),
+            "min_s": min(samples),
+            "mean_s": sum(samples) / len(samples),
+            "p50_s": percentile(samples, 50),
+            "p95_s": percentile(samples, 95),
+            "max_s": max(samples),
+        } for name, samples in self.samples.items() if samples}
+
+def bench_startup(bench):
+    for module in ENTRY_POINTS:
+        import_profile(module, cwd=os.getcwd())  # write the .pyc files so they are not timed
+        for _ in range(bench.repeats):
+            total, imports = import_profile(module, cwd=os.getcwd())
+            bench.record(f"startup.{module}", total)
+        samples = bench.samples[f"startup.{module}"]
+        heaviest = ", ".join(f"{name} {seconds * 1000:.0f}" for name, seconds in imports[:3])
+        print(f"  startup.{module}: median {percentile(samples, 50) * 1000:.2f} ms ({heaviest})")
+
+def bench_schema(bench):
+    from db_connection import find_db_files
+    from get_table_schema import combine_schemas
+    from schema_catalog import SchemaCatalog, get_catalog
+    db_files = find_db_files()
+    bench.time("schema.introspect", lambda: combine_schemas(db_files))
+    scratch_schema = os.path.join("cache", "bench_schema.json")
+    bench.time("schema.catalog_cold", lambda: SchemaCatalog(schema_file=scratch_schema).refresh())
+    get_catalog().refresh()
+    bench.time("schema.catalog_warm", lambda: get_catalog().schema_and_tables())
+
+def bench_connection(bench):
+    from db_connection import connect_sqlite, pooled_connection
+
+    def fresh():
+        conn, _ = connect_sqlite()
+        conn.close()
+
+    def pooled():
+        with pooled_connection() as conn:
+            conn.execute("SELECT 1").fetchone()
+
+    bench.time("connection.attach", fresh)
+    pooled()
+    bench.time("connection.pooled", pooled)
+
+def bench_query(bench):
+    import run_sql
+    from query_cache import get_query_cache
+    from query_log import get_query_log
+    for name, sql_query in BENCH_QUERIES.items():
+        bench.time(f"query.sqlite.{name}",
+                   lambda: run_sql.execute_query(sql_query, use_cache=False, use_backends=False))
+        bench.time(f"query.main.{name}", lambda: run_sql.main(sql_query), setup=get_query_cache().clear)
+        bench.time(f"query.cached.{name}", lambda: run_sql.main(sql_query))
+    for name in BACKEND_QUERIES:
+        sql_query = BENCH_QUERIES[name]
+        for backend in run_sql.get_backends():
+            if getattr(backend, "warm", None) and backend.warm(sql_query):
+                bench.time(f"query.backend.{backend.name}.{name}",
+                           lambda: backend.execute(sql_query))
+    # Entries are written in the background; wait so the next stage does not pay for it
+    get_query_log().flush()
+
+def bench_dispatch(bench):
+    import util
+    import process_openai
+    from llms.clients import get_openai_client
+    from custom_functions import custom_functions
+    response = get_openai_client().chat.completions.create(
+        model="stub", messages=[{"role": "user", "content": QUESTION}], tools=custom_functions)
+    bench.time("dispatch.execute_function_call", lambda: util.execute_function_call(response))
+    bench.time("dispatch.build_sql_prompt", lambda: process_openai.build_sql_prompt(QUESTION))
+    bench.time("dispatch.process_openai", lambda: process_openai.main(QUESTION, make_chart=False))
+    bench.time("dispatch.process_openai_streamed",
+               lambda: process_openai.main(QUESTION, on_delta=lambda text: None, make_chart=False))
+
+def bench_llm(bench):
+    from llms import llms
+    calls = {
+        "gpt": lambda: llms.llm_call_gpt(QUESTION, "stub"),
+        "gpt_json": lambda: llms.llm_call_gpt_json(QUESTION, "stub"),
+        "gpt_assistant": lambda: llms.llm_call_gpt_assistant(QUESTION, "Answer briefly.", "stub"),
+        "claude": lambda: llms.llm_call_claude(QUESTION, "stub"),
+        "groq": lambda: llms.llm_call_groq(QUESTION),
+        "ollama": lambda: llms.llm_call_ollama(QUESTION),
+        "ollama_json": lambda: llms.llm_call_ollama_json(QUESTION),
+        "stream_gpt": lambda: "".join(llms.llm_stream_gpt(QUESTION, "stub")),
+        "stream_claude": lambda: "".join(llms.llm_stream_claude(QUESTION, "stub")),
+        "stream_groq": lambda: "".join(llms.llm_stream_groq(QUESTION)),
+        "stream_ollama": lambda: "".join(llms.llm_stream_ollama(QUESTION)),
+    }
+    for name, call in calls.items():
+        bench.time(f"llm.{name}", call)
+
+def bench_chart(bench):
+    import run_sql
+    import run_visualise
+    from frame_summary import summarize_frame
+    from chart_renderer import choose_spec, render_png
+    df = run_sql.execute_query(BENCH_QUERIES["gene_by_lineage"], use_cache=False)
+    spec = choose_spec(df)
+    bench.time("chart.summarize_frame", lambda: summarize_frame(df))
+    bench.time("chart.choose_spec", lambda: choose_spec(df))
+    bench.time("chart.render_png", lambda: render_png(df, spec))
+    bench.time("chart.code_interpreter", lambda: run_visualise.visualize(df))
+
+STAGE_FUNCTIONS = {
+    "startup": bench_startup, "schema": bench_schema, "connection": bench_connection, "query": bench_query,
+    "dispatch": bench_dispatch, "llm": bench_llm, "chart": bench_chart,
+}
+
+def compare(report, baseline, ratio=REGRESSION_RATIO):
+    """Benchmarks whose median is more than ratio times the baseline's, as (name, before, after)."""
+    slower = []
+    for name, stats in report["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if (before and before["p50_s"] and stats["p50_s"] > before["p50_s"] * ratio
+                and stats["p50_s"] - before["p50_s"] > NOISE_FLOOR_S):
+            slower.append((name, before["p50_s"], stats["p50_s"]))
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline pipeline benchmarks.")
+    parser.add_argument("--rows", default="100k", help="DepMap rows in the synthetic db, e.g. 10k, 1M, 50M")
+    parser.add_argument("--protein-rows", help="protein_links rows (default: same as --rows)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="timed runs per benchmark")
+    parser.add_argument("--ttft", type=float, default=TTFT_S, help="stub time to first token, seconds")
+    parser.add_argument("--token-latency", type=float, default=TOKEN_S, help="stub time per token, seconds")
+    parser.add_argument("--stages", nargs="*", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--workdir", default=WORK_DIR, help="scratch directory for dbs, logs and caches")
+    parser.add_argument("--out", help="report path (default: <workdir>/reports/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier report to check for regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_RATIO, help="slowdown ratio to report")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    args = parser.parse_args(argv)
+
+    rows = parse_count(args.rows)
+    protein_rows = parse_count(args.protein_rows) if args.protein_rows else None
+    work_dir = os.path.abspath(args.workdir)
+    prepare_workdir(work_dir, rows, protein_rows, args.seed)
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+    # The pipeline resolves db/, config/, logs/ and cache/ against the working directory
+    os.chdir(work_dir)
+
+    commit, dirty = git_commit()
+    bench = Bench(repeats=args.repeats, verbose=args.verbose)
+    started = time.time()
+    with stubbed_llms(ttft_s=args.ttft, token_s=args.token_latency):
+        for stage in args.stages:
+            print(f"{stage}:")
+            STAGE_FUNCTIONS[stage](bench)
+
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "started_at": started,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"rows": rows, "protein_rows": protein_rows if protein_rows is not None else rows,
+                     "seed": args.seed, "repeats": args.repeats, "ttft_s": args.ttft,
+                     "token_s": args.token_latency, "stages": args.stages},
+        "results": bench.summary(),
+    }
+    out = out or os.path.join(work_dir, "reports",
+                                   f"{time.strftime('%Y%m%d-%H%M%S')}-{(commit or 'nogit')[:8]}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=4)
+    print(f"Report written to {out}")
+
+    if baseline is not None:
+        if baseline.get("settings", {}).get("rows") != rows:
+            print(f"Note: the baseline was run at {baseline.get('settings', {}).get('rows')} rows")
+        slower = compare(report, baseline, args.threshold)
+        for name, before, after in slower:
+            print(f"SLOWER {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms (x{after / before:.2f})")
+        if slower:
+            return 1
+        print(f"No benchmark more than {args.threshold:g}x slower than {baseline.get('commit')}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,432 @@
+"""
+Deterministic stand-ins for the provider clients, with configurable latency.
+
+The stubs answer every call path in llms/llms.py, process_openai and
+run_visualise: chat completions (plain, JSON, tool calls, streaming), the
+Assistants API (assistants, threads, messages, runs, files), Anthropic
+messages and streams, Groq and the Ollama HTTP API. Answers depend only on the
+prompt, so repeated benchmark runs do identical work. Latency is modelled as a
+time to first token plus a fixed time per generated token. Prompt caching is
+modelled in the token counts only: a request whose prefix (OpenAI: everything
+before the last message; Anthropic: everything up to the last cache_control
+breakpoint) was seen before reports those tokens as cached.
+
+    with stubbed_llms(ttft_s=0.2, token_s=0.005):
+        process_openai.main("Average EP300 dependency by lineage", make_chart=False)
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import itertools
+import threading
+from types import SimpleNamespace
+from contextlib import contextmanager
+
+from benchmarks.synthetic_db import KNOWN_GENES
+
+TTFT_S = 0.05               # default time to first token
+TOKEN_S = 0.002             # default time per generated token
+COMPLETION_TOKENS = 60      # words in a plain text answer
+CHUNK_TOKENS = 4            # words per streamed chunk
+DEFAULT_GENE = "EP300"
+
+def _tokens(text):
+    return len(str(text).split())
+
+def _digest(text):
+    return hashlib.sha1(str(text).encode("utf-8")).hexdigest()[:8]
+
+def text_for(prompt, completion_tokens=COMPLETION_TOKENS):
+    """Plain answer: the same words for the same prompt."""
+    words = [f"w{_digest(f'{prompt}{i}')}" for i in range(completion_tokens - 1)]
+    return " ".join([f"stub-{_digest(prompt)}"] + words)
+
+def sql_for(prompt):
+    """SQL for an extract_SQL tool call: lineage averages for the first gene symbol in the question."""
+    genes = [w for w in re.findall(r"\b[A-Z][A-Z0-9]+\b", str(prompt)) if w in KNOWN_GENES or re.match(r"GENE\d+$", w)]
+    gene = genes[0] if genes else DEFAULT_GENE
+    return ("SELECT OncotreeLineage, AVG(dependency) AS avg_dependency, COUNT(*) AS models "
+            f"FROM DepMap WHERE gene_name = '{gene}' GROUP BY OncotreeLineage ORDER BY avg_dependency")
+
+def json_for(prompt):
+    """JSON answer; for a chart spec prompt, a bar chart of the first numeric column by the first other one."""
+    columns = re.findall(r"^- (\S+) \((\w+)", str(prompt), re.MULTILINE)
+    numeric = [name for name, dtype in columns if dtype.startswith(("int", "float"))]
+    other = [name for name, dtype in columns if name not in numeric]
+    if numeric and other:
+        return json.dumps({"chart_type": "bar", "x": other[0], "y": numeric[0], "group": None,
+                           "aggregation": "mean", "sort": "desc", "limit": None, "title": f"{numeric[0]} by {other[0]}"})
+    return json.dumps({"answer": text_for(prompt, 8)})
+
+class Latency:
+    """Sleeps standing in for the provider's generation time."""
+
+    def __init__(self, ttft_s=TTFT_S, token_s=TOKEN_S):
+        self.ttft_s = ttft_s
+        self.token_s = token_s
+
+    def whole(self, text):
+        time.sleep(self.ttft_s + self.token_s * _tokens(text))
+
+    def chunks(self, text):
+        """Yield text in CHUNK_TOKENS-word pieces, sleeping as a stream would."""
+        words = str(text).split(" ")
+        time.sleep(self.ttft_s)
+        for i in range(0, len(words), CHUNK_TOKENS):
+            piece = " ".join(words[i:i + CHUNK_TOKENS])
+            time.sleep(self.token_s * len(words[i:i + CHUNK_TOKENS]))
+            yield piece if i == 0 else " " + piece
+
+def _text(content):
+    """Text of a message content: a string or a list of content blocks."""
+    if isinstance(content, list):
+        return "\n\n".join(block.get("text", "") for block in content)
+    return str(content or "")
+
+def _prompt(messages):
+    users = [m.get("content", "") for m in messages if m.get("role") == "user"]
+    return _text(users[-1]) if users else ""
+
+class PrefixCache:
+    """Prompt prefixes a stub client has been sent."""
+
+    def __init__(self):
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def check(self, prefix):
+        """True if prefix was sent before; remembers it either way."""
+        key = _digest(json.dumps(prefix, sort_keys=True, default=str))
+        with self._lock:
+            seen = key in self._seen
+            self._seen.add(key)
+        return seen
+
+class StubChatCompletions:
+    """OpenAI/Groq chat.completions: text, JSON, tool calls and streams."""
+
+    def __init__(self, latency, calls, usage_in="usage", prefixes=None):
+        self.latency = latency
+        self.calls = calls
+        self.usage_in = usage_in        # "usage" (OpenAI) or "x_groq" (Groq) for streamed usage
+        self.prefixes = prefixes or PrefixCache()
+
+    def create(self, model=None, messages=(), tools=None, tool_choice=None, stream=False,
+               response_format=None, **kwargs):
+        self.calls["chat"] += 1
+        prompt = _prompt(messages)
+        prefix = list(messages[:-1])
+        cached = sum(_tokens(_text(m.get("content"))) for m in prefix) if self.prefixes.check([model, tools, prefix]) else 0
+        usage = SimpleNamespace(prompt_tokens=sum(_tokens(_text(m.get("content"))) for m in messages),
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=cached))
+        if tools:
+            names = [t["function"]["name"] for t in tools]
+            name = tool_choice["function"]["name"] if isinstance(tool_choice, dict) else (
+                "extract_SQL" if "extract_SQL" in names else names[0])
+            arguments = json.dumps({"query": sql_for(prompt)} if name == "extract_SQL" else {})
+            usage.completion_tokens = _tokens(arguments)
+            if stream:
+                return self._stream_tool_call(name, arguments, usage)
+            self.latency.whole(arguments)
+            call = SimpleNamespace(id=f"call_{_digest(prompt)}", type="function",
+                                   function=SimpleNamespace(name=name, arguments=arguments))
+            message = SimpleNamespace(role="assistant", content=None, tool_calls=[call])
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+        json_mode = (response_format or {}).get("type") == "json_object"
+        content = json_for(prompt) if json_mode else text_for(prompt)
+        usage.completion_tokens = _tokens(content)
+        if stream:
+            return self._stream_text(content, usage)
+        self.latency.whole(content)
+        message = SimpleNamespace(role="assistant", content=content, tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    def _chunk(self, content=None, tool_calls=None):
+        delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None, x_groq=None)
+
+    def _final(self, usage):
+        if self.usage_in == "x_groq":
+            return SimpleNamespace(choices=[], usage=None, x_groq=SimpleNamespace(usage=usage))
+        return SimpleNamespace(choices=[], usage=usage, x_groq=None)
+
+    def _stream_text(self, content, usage):
+        for piece in self.latency.chunks(content):
+            yield self._chunk(content=piece)
+        yield self._final(usage)
+
+    def _stream_tool_call(self, name, arguments, usage):
+        for i, piece in enumerate(self.latency.chunks(arguments)):
+            function = SimpleNamespace(name=name if i == 0 else None, arguments=piece)
+            call = SimpleNamespace(index=0, id="call_stub" if i == 0 else None, function=function)
+            yield self._chunk(tool_calls=[call])
+        yield self._final(usage)
+
+class _Listing(list):
+    """A list that also has .data, like the SDK's paginated responses."""
+
+    @property
+    def data(self):
+        return self
+
+class StubAssistants:
+    """client.beta: assistants, threads, messages and runs, completing every run at once."""
+
+    def __init__(self, latency, calls, files):
+        self.latency = latency
+        self.calls = calls
+        self.files = files
+        self._ids = itertools.count(1)
+        self._assistants = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+        self.assistants = SimpleNamespace(list=self._list_assistants, create=self._create_assistant,
+                                          delete=self._delete_assistant)
+        self.threads = SimpleNamespace(create=self._create_thread, delete=self._delete_thread)
+        self.threads.messages = SimpleNamespace(create=self._create_message, list=self._list_messages)
+        self.threads.runs = SimpleNamespace(create=self._create_run, retrieve=self._retrieve_run, list=self._list_runs,
+                                            cancel=self._cancel_run, stream=self._stream_run)
+
+    def _new_id(self, prefix):
+        with self._lock:
+            return f"{prefix}_{next(self._ids)}"
+
+    def _list_assistants(self, limit=100, order="desc"):
+        return _Listing(self._assistants.values())
+
+    def _create_assistant(self, name=None, instructions=None, tools=None, model=None, metadata=None):
+        assistant = SimpleNamespace(id=self._new_id("asst"), name=name, instructions=instructions,
+                                    tools=tools or [], model=model, metadata=metadata or {})
+        self._assistants[assistant.id] = assistant
+        return assistant
+
+    def _delete_assistant(self, assistant_id):
+        self._assistants.pop(assistant_id, None)
+
+    def _create_thread(self):
+        thread = SimpleNamespace(id=self._new_id("thread"))
+        self._threads[thread.id] = []
+        return thread
+
+    def _delete_thread(self, thread_id):
+        self._threads.pop(thread_id, None)
+
+    def _create_message(self, thread_id, role, content, attachments=None):
+        message = SimpleNamespace(id=self._new_id("msg"), role=role, attachments=[],
+                                  content=[SimpleNamespace(text=SimpleNamespace(value=content))])
+        self._threads[thread_id].append(message)
+        return message
+
+    def _list_messages(self, thread_id, order="desc"):
+        messages = list(self._threads.get(thread_id, []))
+        return _Listing(messages if order == "asc" else messages[::-1])
+
+    def _complete(self, thread_id, assistant_id):
+        """Answer the thread's last message; assistants with code_interpreter reply with a chart."""
+        self.calls["runs"] += 1
+        prompt = self._threads[thread_id][-1].content[0].text.value
+        assistant = self._assistants.get(assistant_id)
+        if assistant is not None and any(t.get("type") == "code_interpreter" for t in assistant.tools):
+            self.latency.whole(text_for(prompt))
+            file_id = self.files.add(_chart_png(), "chart.png")
+            content = [SimpleNamespace(image_file=SimpleNamespace(file_id=file_id))]
+        else:
+            answer = text_for(prompt)
+            self.latency.whole(answer)
+            content = [SimpleNamespace(text=SimpleNamespace(value=answer))]
+        self._threads[thread_id].append(
+            SimpleNamespace(id=self._new_id("msg"), role="assistant", attachments=[], content=content))
+        return SimpleNamespace(id=self._new_id("run"), object="thread.run", status="completed", thread_id=thread_id)
+
+    def _list_runs(self, thread_id, limit=20, order="desc"):
+        return _Listing([])  # every run completes as it is created, so none is ever active
+
+    def _create_run(self, thread_id, assistant_id, **kwargs):
+        return self._complete(thread_id, assistant_id)
+
+    def _retrieve_run(self, thread_id=None, run_id=None):
+        return SimpleNamespace(id=run_id, object="thread.run", status="completed", thread_id=thread_id)
+
+    def _cancel_run(self, run_id, thread_id=None):
+        return SimpleNamespace(id=run_id, object="thread.run", status="cancelled", thread_id=thread_id)
+
+    @contextmanager
+    def _stream_run(self, thread_id, assistant_id, **kwargs):
+        run = self._complete(thread_id, assistant_id)
+        yield _RunStream(run)
+
+class _RunStream:
+    def __init__(self, run):
+        self._run = run
+
+    def __iter__(self):
+        yield SimpleNamespace(event="thread.run.completed", data=self._run)
+
+    def get_final_run(self):
+        return self._run
+
+class StubFiles:
+    """client.files: uploads and generated files kept in memory."""
+
+    def __init__(self):
+        self._files = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, data, name):
+        with self._lock:
+            file_id = f"file-{next(self._ids)}"
+            self._files[file_id] = (name, data)
+        return file_id
+
+    def create(self, file, purpose=None):
+        name, data = file if isinstance(file, tuple) else (getattr(file, "name", "upload"), file.read())
+        return SimpleNamespace(id=self.add(data, name), filename=name, purpose=purpose)
+
+    def content(self, file_id):
+        return SimpleNamespace(read=lambda: self._files[file_id][1])
+
+    def delete(self, file_id):
+        self._files.pop(file_id, None)
+
+_png = None
+
+def _chart_png():
+    global _png
+    if _png is None:
+        from matplotlib.figure import Figure
+        from chart_renderer import figure_to_png
+        fig = Figure(figsize=(2, 2))
+        fig.subplots().bar(["a", "b"], [1, 2])
+        _png = figure_to_png(fig, dpi=50)
+    return _png
+
+class StubOpenAI:
+    def __init__(self, latency, calls):
+        self.chat = SimpleNamespace(completions=StubChatCompletions(latency, calls))
+        self.files = StubFiles()
+        self.beta = StubAssistants(latency, calls, self.files)
+
+    def close(self):
+        pass
+
+class StubGroq:
+    def __init__(self, latency, calls):
+        self.chat = SimpleNamespace(completions=StubChatCompletions(latency, calls, usage_in="x_groq"))
+
+    def close(self):
+        pass
+
+class StubAnthropicMessages:
+    def __init__(self, latency, calls):
+        self.latency = latency
+        self.calls = calls
+        self.prefixes = PrefixCache()
+
+    def _answer(self, model, messages, system):
+        prompt = _prompt(messages)
+        text = text_for(prompt)
+        blocks = system if isinstance(system, list) else [{"type": "text", "text": system or ""}]
+        for m in messages:
+            content = m.get("content")
+            blocks = blocks + (content if isinstance(content, list) else [{"type": "text", "text": str(content)}])
+        marked = [i for i, block in enumerate(blocks) if block.get("cache_control")]
+        prefix = blocks[:marked[-1] + 1] if marked else []
+        prefix_tokens = sum(_tokens(block.get("text", "")) for block in prefix)
+        seen = bool(prefix) and self.prefixes.check([model, prefix])
+        usage = SimpleNamespace(input_tokens=sum(_tokens(block.get("text", "")) for block in blocks) - prefix_tokens,
+                                cache_read_input_tokens=prefix_tokens if seen else 0,
+                                cache_creation_input_tokens=0 if seen else prefix_tokens,
+                                output_tokens=_tokens(text))
+        return text, usage
+
+    def create(self, model=None, messages=(), system=None, max_tokens=None, **kwargs):
+        self.calls["anthropic"] += 1
+        text, usage = self._answer(model, messages, system)
+        self.latency.whole(text)
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=text)], usage=usage)
+
+    @contextmanager
+    def stream(self, model=None, messages=(), system=None, max_tokens=None, **kwargs):
+        self.calls["anthropic"] += 1
+        text, usage = self._answer(model, messages, system)
+        yield SimpleNamespace(text_stream=self.latency.chunks(text),
+                              get_final_message=lambda: SimpleNamespace(usage=usage))
+
+class StubAnthropic:
+    def __init__(self, latency, calls):
+        self.messages = StubAnthropicMessages(latency, calls)
+
+    def close(self):
+        pass
+
+class _OllamaResponse:
+    def __init__(self, lines):
+        self._lines = lines
+
+    def iter_lines(self):
+        return iter(self._lines())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class StubOllamaSession:
+    """requests.Session posting to /api/generate, streamed or not."""
+
+    def __init__(self, latency, calls):
+        self.latency = latency
+        self.calls = calls
+
+    def post(self, url, **kwargs):
+        self.calls["ollama"] += 1
+        payload = kwargs.get("json") or {}
+        text = text_for(payload.get("prompt", ""))
+        done = {"done": True, "prompt_eval_count": _tokens(payload.get("prompt", "")), "eval_count": _tokens(text)}
+        encode = json.dumps
+
+        def lines():
+            if payload.get("stream", True):
+                for piece in self.latency.chunks(text):
+                    yield encode({"response": piece, "done": False}).encode("utf-8")
+            else:
+                self.latency.whole(text)
+                yield encode({"response": text, "done": False}).encode("utf-8")
+            yield encode(done).encode("utf-8")
+        return _OllamaResponse(lines)
+
+    def close(self):
+        pass
+
+def install_stubs(ttft_s=TTFT_S, token_s=TOKEN_S):
+    """
+    Register stub clients for every provider in llms.clients. Returns a
+    dict of call counters (chat, runs, anthropic, ollama).
+    """
+    from llms.clients import register_client
+    latency = Latency(ttft_s, token_s)
+    calls = {"chat": 0, "runs": 0, "anthropic": 0, "ollama": 0}
+    register_client("openai", StubOpenAI(latency, calls))
+    register_client("anthropic", StubAnthropic(latency, calls))
+    register_client("groq", StubGroq(latency, calls))
+    register_client("ollama", StubOllamaSession(latency, calls))
+    return calls
+
+@contextmanager
+def stubbed_llms(ttft_s=TTFT_S, token_s=TOKEN_S):
+    """Stub every provider and turn off the LLM response cache for the duration."""
+    from llms.clients import reset_clients
+    previous = os.environ.get("GALEN_LLM_CACHE")
+    os.environ["GALEN_LLM_CACHE"] = "off"
+    try:
+        yield install_stubs(ttft_s, token_s)
+    finally:
+        reset_clients(close=False)
+        if previous is None:
+            os.environ.pop("GALEN_LLM_CACHE", None)
+        else:
+            os.environ["GALEN_LLM_CACHE"] = previous
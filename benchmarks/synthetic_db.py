@@ -0,0 +1,224 @@
+"""
+Synthetic DepMap.db and ProteinNetwork.db with the same tables and columns as
+the real ones, at any scale from a few thousand to tens of millions of rows.
+
+DepMap is laid out like the real long-format table: one row per (gene, model),
+genes in blocks of N_MODELS rows, with the model metadata repeated on every row
+and the mutation columns mostly NULL. protein_links pairs STRING-style protein
+ids with sparse evidence channels. Everything is drawn from a seeded generator,
+so the same scale and seed always produce the same files.
+
+    python -m benchmarks.synthetic_db --rows 1M --out bench/db
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+
+import numpy as np
+
+N_MODELS = 1800             # cell line models per gene block
+N_PROTEINS = 19000          # distinct protein ids in protein_links
+MUTATION_RATE = 0.05        # share of DepMap rows with a mutation record
+CHUNK_ROWS = 100000         # rows generated and inserted per batch
+
+DEPMAP_COLUMNS = [
+    "gene_name", "ModelID", "PatientID", "CellLineName", "StrippedCellLineName", "DepmapModelType",
+    "OncotreeLineage", "OncotreePrimaryDisease", "OncotreeSubtype", "OncotreeCode", "LegacyMolecularSubtype",
+    "PatientMolecularSubtype", "RRID", "Age", "AgeCategory", "Sex", "PatientRace", "PrimaryOrMetastasis",
+    "SampleCollectionSite", "SourceType", "SourceDetail", "TreatmentStatus", "TreatmentDetails", "GrowthPattern",
+    "OnboardedMedia", "FormulationID", "EngineeredModel", "TissueOrigin", "CCLEName", "CatalogNumber",
+    "PlateCoating", "ModelDerivationMaterial", "PublicComments", "WTSIMasterCellID", "SangerModelID", "COSMICID",
+    "LegacySubSubtype", "dependency", "expression", "copy_number", "Chrom", "DNAChange", "ProteinChange",
+    "VariantType", "VariantInfo", "EnsemblGeneID", "HgncName", "GcContent", "VepImpact", "VepBiotype", "Sift",
+    "Polyphen", "GnomadeAF", "GnomadgAF", "OncogeneHighImpact", "TumorSuppressorHighImpact",
+]
+PROTEIN_COLUMNS = [
+    "protein1", "protein2", "neighborhood", "neighborhood_transferred", "fusion", "cooccurence", "homology",
+    "coexpression", "coexpression_transferred", "experiments", "experiments_transferred", "database",
+    "database_transferred", "textmining", "textmining_transferred", "combined_score",
+]
+MODEL_COLUMNS = DEPMAP_COLUMNS[1:DEPMAP_COLUMNS.index("dependency")]
+MUTATION_COLUMNS = DEPMAP_COLUMNS[DEPMAP_COLUMNS.index("Chrom"):]
+
+# Genes the example questions ask about come first, so they exist at every scale
+KNOWN_GENES = [
+    "EP300", "TP53", "KRAS", "BRCA1", "BRCA2", "MYC", "EGFR", "PIK3CA", "PTEN", "BRAF",
+    "CREBBP", "SMARCA4", "ARID1A", "CDKN2A", "RB1", "NRAS", "ERBB2", "ATM", "KMT2D", "APC",
+]
+LINEAGES = [
+    "Lung", "Breast", "Skin", "CNS/Brain", "Bowel", "Lymphoid", "Myeloid", "Ovary/Fallopian Tube", "Pancreas",
+    "Kidney", "Esophagus/Stomach", "Head and Neck", "Bone", "Soft Tissue", "Liver", "Uterus", "Bladder/Urinary Tract",
+    "Peripheral Nervous System", "Prostate", "Thyroid", "Biliary Tract", "Cervix", "Pleura", "Eye",
+]
+CHOICES = {
+    "DepmapModelType": ["LUAD", "BRCA", "SKCM", "GBM", "COAD", "DLBCL", "AML", "HGSOC", "PAAD", "CCRCC"],
+    "AgeCategory": ["Adult", "Pediatric", "Fetal", "Unknown"],
+    "Sex": ["Male", "Female", "Unknown"],
+    "PatientRace": ["caucasian", "asian", "black_or_african_american", "unknown"],
+    "PrimaryOrMetastasis": ["Primary", "Metastatic", "Unknown"],
+    "SourceType": ["Commercial", "Academic lab", "Other"],
+    "TreatmentStatus": ["Unknown", "Pre-treatment", "Post-treatment"],
+    "GrowthPattern": ["Adherent", "Suspension", "Mixed", "Organoid"],
+    "EngineeredModel": [None, "Engineered"],
+    "TissueOrigin": ["Normal", "Tumor", None],
+    "PlateCoating": [None, "Collagen", "Laminin"],
+    "ModelDerivationMaterial": ["Tumor", "PDX", "Ascites", None],
+    "Chrom": [f"chr{c}" for c in list(range(1, 23)) + ["X"]],
+    "VariantType": ["SNV", "DEL", "INS", "DNP"],
+    "VariantInfo": ["MISSENSE", "NONSENSE", "SILENT", "FRAME_SHIFT_DEL", "SPLICE_SITE"],
+    "VepImpact": ["HIGH", "MODERATE", "LOW", "MODIFIER"],
+    "VepBiotype": ["protein_coding", "lncRNA"],
+    "Sift": ["deleterious", "tolerated", None],
+    "Polyphen": ["probably_damaging", "possibly_damaging", "benign", None],
+    "OncogeneHighImpact": ["True", "False"],
+    "TumorSuppressorHighImpact": ["True", "False"],
+}
+EVIDENCE_DENSITY = {        # share of protein_links rows with a non-zero score in each channel
+    "neighborhood": 0.05, "neighborhood_transferred": 0.05, "fusion": 0.01, "cooccurence": 0.03,
+    "homology": 0.02, "coexpression": 0.3, "coexpression_transferred": 0.3, "experiments": 0.15,
+    "experiments_transferred": 0.2, "database": 0.05, "database_transferred": 0.02, "textmining": 0.4,
+    "textmining_transferred": 0.3,
+}
+
+def parse_count(text):
+    """'50M', '10k', '1e6' or '250000' -> int."""
+    text = str(text).strip().lower().replace("_", "")
+    scale = {"k": 1e3, "m": 1e6, "b": 1e9}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale != 1 else text) * scale)
+
+def gene_names(n_genes):
+    return np.array(KNOWN_GENES[:n_genes] + [f"GENE{i}" for i in range(len(KNOWN_GENES), n_genes)], dtype=object)
+
+def model_table(rng, n_models=N_MODELS):
+    """Per-model metadata, one object array of length n_models per model column."""
+    index = np.arange(n_models)
+    lineage = rng.integers(0, len(LINEAGES), n_models)
+    models = {
+        "ModelID": np.array([f"ACH-{i:06d}" for i in index], dtype=object),
+        "PatientID": np.array([f"PT-{i // 2:06d}" for i in index], dtype=object),
+        "CellLineName": np.array([f"CL-{i}" for i in index], dtype=object),
+        "StrippedCellLineName": np.array([f"CL{i}" for i in index], dtype=object),
+        "OncotreeLineage": np.array(LINEAGES, dtype=object)[lineage],
+        "OncotreePrimaryDisease": np.array([f"{LINEAGES[l]} Carcinoma {i % 3}" for i, l in zip(index, lineage)],
+                                           dtype=object),
+        "OncotreeSubtype": np.array([f"{LINEAGES[l]} Subtype {i % 5}" for i, l in zip(index, lineage)], dtype=object),
+        "OncotreeCode": np.array([f"OT{l:02d}{i % 5}" for i, l in zip(index, lineage)], dtype=object),
+        "RRID": np.array([f"CVCL_{i:04X}" for i in index], dtype=object),
+        "Age": rng.integers(1, 90, n_models).astype(str).astype(object),
+        "CCLEName": np.array([f"CL{i}_{LINEAGES[l].upper().replace(' ', '_')}" for i, l in zip(index, lineage)],
+                             dtype=object),
+        "WTSIMasterCellID": rng.integers(1000, 9999, n_models).astype(str).astype(object),
+        "SangerModelID": np.array([f"SIDM{i:05d}" for i in index], dtype=object),
+        "COSMICID": rng.integers(600000, 1300000, n_models).astype(str).astype(object),
+    }
+    for column in MODEL_COLUMNS:
+        if column in models:
+            continue
+        if column in CHOICES:
+            models[column] = np.array(CHOICES[column], dtype=object)[rng.integers(0, len(CHOICES[column]), n_models)]
+        else:
+            # Free-text metadata: a handful of values per column, some missing
+            values = np.array([f"{column} {k}" for k in range(8)] + [None, None], dtype=object)
+            models[column] = values[rng.integers(0, len(values), n_models)]
+    return models
+
+def _choice(rng, column, n):
+    values = np.array(CHOICES[column], dtype=object)
+    return values[rng.integers(0, len(values), n)]
+
+def depmap_chunk(rng, start, n, models, genes):
+    """Columns for DepMap rows start .. start + n, as a dict of object arrays."""
+    row = np.arange(start, start + n)
+    gene, model = row // len(models["ModelID"]) % len(genes), row % len(models["ModelID"])
+    columns = {"gene_name": genes[gene]}
+    for column in MODEL_COLUMNS:
+        columns[column] = models[column][model]
+    # Essential genes (every 50th) have strongly negative dependency scores
+    essential = gene % 50 == 0
+    columns["dependency"] = np.round(rng.normal(-0.15, 0.3, n) - 1.2 * essential, 6).astype(object)
+    columns["expression"] = np.round(np.maximum(rng.normal(3.0, 2.0, n), 0), 6).astype(object)
+    columns["copy_number"] = np.round(rng.normal(1.0, 0.25, n), 6).astype(object)
+
+    mutated = rng.random(n) < MUTATION_RATE
+    m = int(mutated.sum())
+    mutation = {
+        "DNAChange": np.array([f"c.{p}A>G" for p in rng.integers(1, 5000, m)], dtype=object),
+        "ProteinChange": np.array([f"p.K{p}E" for p in rng.integers(1, 1500, m)], dtype=object),
+        "EnsemblGeneID": np.array([f"ENSG{g:011d}" for g in gene[mutated]], dtype=object),
+        "HgncName": genes[gene[mutated]],
+        "GcContent": np.round(rng.uniform(0.3, 0.7, m), 4).astype(object),
+        "GnomadeAF": np.round(rng.exponential(1e-4, m), 8).astype(object),
+        "GnomadgAF": np.round(rng.exponential(1e-4, m), 8).astype(object),
+    }
+    for column in MUTATION_COLUMNS:
+        values = np.full(n, None, dtype=object)
+        values[mutated] = mutation[column] if column in mutation else _choice(rng, column, m)
+        columns[column] = values
+    return columns
+
+def protein_chunk(rng, start, n, ids):
+    """Columns for protein_links rows start .. start + n, drawing from the protein ids."""
+    row = np.arange(start, start + n)
+    columns = {"protein1": ids[row // 200 % N_PROTEINS], "protein2": ids[rng.integers(0, N_PROTEINS, n)]}
+    for column, density in EVIDENCE_DENSITY.items():
+        scores = rng.integers(50, 1000, n)
+        columns[column] = np.where(rng.random(n) < density, scores, 0).astype(object)
+    columns["combined_score"] = rng.integers(150, 1000, n).astype(object)
+    return columns
+
+def _write_table(db_file, table, column_names, rows, make_chunk):
+    """Create db_file with one table and fill it chunk by chunk."""
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        columns_sql = ", ".join(f'"{c}" VARCHAR' for c in column_names)
+        conn.execute(f'CREATE TABLE "{table}" ({columns_sql})')
+        insert = f'INSERT INTO "{table}" VALUES ({", ".join("?" * len(column_names))})'
+        for start in range(0, rows, CHUNK_ROWS):
+            chunk = make_chunk(start, min(CHUNK_ROWS, rows - start))
+            conn.executemany(insert, zip(*(chunk[c] for c in column_names)))
+        conn.commit()
+    finally:
+        conn.close()
+
+def generate(directory, rows, protein_rows=None, seed=0):
+    """
+    Write DepMap.db (rows rows) and ProteinNetwork.db (protein_rows rows, default
+    rows) into directory. Returns the two file paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    models = model_table(rng)
+    genes = gene_names(max(len(KNOWN_GENES), -(-rows // N_MODELS)))
+    protein_ids = np.array([f"9606.ENSP{i:011d}" for i in range(N_PROTEINS)], dtype=object)
+    depmap = os.path.join(directory, "DepMap.db")
+    proteins = os.path.join(directory, "ProteinNetwork.db")
+    _write_table(depmap, "DepMap", DEPMAP_COLUMNS, rows,
+                 lambda start, n: depmap_chunk(rng, start, n, models, genes))
+    _write_table(proteins, "protein_links", PROTEIN_COLUMNS, rows if protein_rows is None else protein_rows,
+                 lambda start, n: protein_chunk(rng, start, n, protein_ids))
+    return depmap, proteins
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic DepMap and ProteinNetwork databases.")
+    parser.add_argument("--rows", default="100k", help="DepMap rows, e.g. 10k, 1M, 50M")
+    parser.add_argument("--protein-rows", help="protein_links rows (default: same as --rows)")
+    parser.add_argument("--out", default=os.path.join("bench", "db"), help="directory for the .db files")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rows = parse_count(args.rows)
+    protein_rows = parse_count(args.protein_rows) if args.protein_rows else None
+    start = time.perf_counter()
+    for db_file in generate(args.out, rows, protein_rows, seed=args.seed):
+        print(f"{db_file}: {os.path.getsize(db_file) / 1e6:.1f} MB")
+    print(f"Generated in {time.perf_counter() - start:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
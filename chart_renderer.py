@@ -0,0 +1,180 @@
+"""
+Local, deterministic chart rendering from a compact chart spec.
+
+The LLM only picks the spec (chart type, x/y/group columns, aggregation); the
+chart itself is drawn here from the in-memory DataFrame with matplotlib's Agg
+canvas, so no data leaves the process and no Code Interpreter run is needed.
+
+A spec looks like:
+    {"chart_type": "bar", "x": "OncotreeLineage", "y": "avg_dependency",
+     "group": null, "aggregation": "none", "sort": "desc", "limit": 30, "title": "..."}
+"""
+import io
+import json
+import logging
+
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from frame_summary import summarize_frame
+from utils import traced, current_span
+
+log = logging.getLogger(__name__)
+
+CHART_TYPES = ("bar", "barh", "line", "scatter", "hist", "box", "pie")
+AGGREGATIONS = ("none", "mean", "sum", "count", "median", "min", "max")
+MAX_CATEGORIES = 50          # bars/slices beyond this are cut after sorting
+SPEC_TOKEN_BUDGET = 800      # prompt tokens for the table summary the spec is chosen from
+
+SPEC_INSTRUCTIONS = (
+    "You choose how to chart a table. Reply with a JSON object with keys: "
+    f"chart_type (one of {', '.join(CHART_TYPES)}), x (column or null), y (column or null), "
+    f"group (column or null), aggregation (one of {', '.join(AGGREGATIONS)}), "
+    "sort (asc, desc or null), limit (integer or null) and title. Only use the listed columns."
+)
+
+def _is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def default_spec(df):
+    """Pick a reasonable chart from the column types alone."""
+    numeric = [c for c in df.columns if _is_numeric(df[c])]
+    categorical = [c for c in df.columns if c not in numeric]
+    if categorical and numeric:
+        x, y = categorical[0], numeric[0]
+        aggregation = "mean" if df[x].duplicated().any() else "none"
+        return {"chart_type": "bar", "x": x, "y": y, "aggregation": aggregation, "sort": "desc", "title": f"{y} by {x}"}
+    if len(numeric) >= 2:
+        return {"chart_type": "scatter", "x": numeric[0], "y": numeric[1], "title": f"{numeric[1]} vs {numeric[0]}"}
+    if numeric:
+        return {"chart_type": "hist", "y": numeric[0], "title": f"Distribution of {numeric[0]}"}
+    if categorical:
+        return {"chart_type": "bar", "x": categorical[0], "aggregation": "count", "sort": "desc",
+                "title": f"Count by {categorical[0]}"}
+    raise ValueError("Nothing to chart: the table has no columns")
+
+def validate_spec(spec, df):
+    """Check a spec against the DataFrame and fill in defaults. Raises ValueError."""
+    spec = dict(spec)
+    spec.setdefault("aggregation", "none")
+    spec["aggregation"] = (spec["aggregation"] or "none").lower()
+    chart_type = (spec.get("chart_type") or "").lower()
+    if chart_type not in CHART_TYPES:
+        raise ValueError(f"Unknown chart_type {spec.get('chart_type')!r}")
+    spec["chart_type"] = chart_type
+    if spec["aggregation"] not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {spec['aggregation']!r}")
+    for key in ("x", "y", "group"):
+        if spec.get(key) is not None and spec[key] not in df.columns:
+            raise ValueError(f"Column {spec[key]!r} for {key} is not in the data")
+    if chart_type in ("hist", "box"):
+        if spec.get("y") is None:
+            raise ValueError(f"{chart_type} needs a y column")
+    elif spec.get("x") is None:
+        raise ValueError(f"{chart_type} needs an x column")
+    if spec.get("y") is None and spec["aggregation"] != "count" and chart_type not in ("hist", "box"):
+        raise ValueError("y is required unless aggregation is count")
+    if spec.get("sort") not in (None, "asc", "desc"):
+        spec["sort"] = None
+    return spec
+
+@traced("chart.choose_spec")
+def choose_spec(df, request=None, model=None):
+    """
+    Ask the LLM for a chart spec for this DataFrame and the user's request,
+    falling back to default_spec if the call fails or the spec is invalid.
+    """
+    try:
+        from llms.llms import llm_call_gpt_json
+        if model is None:
+            from model_router import route
+            model = route("visualization", providers=("openai",))["model"]
+        summary = summarize_frame(df, token_budget=SPEC_TOKEN_BUDGET)
+        prompt = f"Table:\n{summary}\n\nRequest: {request or 'the clearest chart of this data'}"
+        spec = json.loads(llm_call_gpt_json(prompt, model, system_p=SPEC_INSTRUCTIONS))
+        return validate_spec(spec, df)
+    except Exception as e:
+        log.warning("Chart spec selection failed, using default: %s", e)
+        current_span().set(fallback=type(e).__name__)
+        return validate_spec(default_spec(df), df)
+
+def _prepare(df, spec):
+    """Apply the spec's aggregation, sort and limit."""
+    x, y, group, aggregation = spec.get("x"), spec.get("y"), spec.get("group"), spec["aggregation"]
+    data = df
+    if aggregation != "none" and x is not None:
+        keys = [x] + ([group] if group else [])
+        if aggregation == "count":
+            y = y or "count"
+            data = df.groupby(keys, observed=True, dropna=False).size().rename(y).reset_index()
+        else:
+            data = df.groupby(keys, observed=True, dropna=False)[y].agg(aggregation).reset_index()
+    if spec.get("sort") and y is not None and spec["chart_type"] in ("bar", "barh", "pie"):
+        data = data.sort_values(y, ascending=spec["sort"] == "asc")
+    limit = spec.get("limit") or (MAX_CATEGORIES if spec["chart_type"] in ("bar", "barh", "pie") else None)
+    if limit and group is None and len(data) > limit:
+        data = data.head(int(limit))
+    return data, y
+
+@traced("chart.render")
+def render_chart(df, spec, figsize=(10, 6)):
+    """Draw the chart described by spec and return a matplotlib Figure on an Agg canvas."""
+    spec = validate_spec(spec, df)
+    data, y = _prepare(df, spec)
+    x, group, chart_type = spec.get("x"), spec.get("group"), spec["chart_type"]
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+
+    if chart_type in ("bar", "barh", "line") and group:
+        wide = data.pivot_table(index=x, columns=group, values=y, aggfunc="first", observed=True)
+        wide.plot(kind=chart_type, ax=ax)
+    elif chart_type == "bar":
+        ax.bar(data[x].astype(str), data[y])
+    elif chart_type == "barh":
+        ax.barh(data[x].astype(str), data[y])
+    elif chart_type == "line":
+        ax.plot(data[x], data[y], marker="o")
+    elif chart_type == "scatter":
+        if group:
+            for name, part in data.groupby(group, observed=True):
+                ax.scatter(part[x], part[y], label=str(name), s=12)
+            ax.legend()
+        else:
+            ax.scatter(data[x], data[y], s=12)
+    elif chart_type == "hist":
+        ax.hist(data[y].dropna(), bins=min(50, max(10, int(len(data) ** 0.5))))
+    elif chart_type == "box":
+        if x:
+            groups = [(str(name), part[y].dropna()) for name, part in data.groupby(x, observed=True)]
+            ax.boxplot([values for _, values in groups])
+            ax.set_xticks(range(1, len(groups) + 1))
+            ax.set_xticklabels([name for name, _ in groups])
+        else:
+            ax.boxplot(data[y].dropna())
+    elif chart_type == "pie":
+        ax.pie(data[y], labels=data[x].astype(str), autopct="%1.1f%%")
+        ax.axis("equal")
+
+    if chart_type in ("bar", "box") and x is not None:
+        ax.tick_params(axis="x", labelrotation=60)
+        for label in ax.get_xticklabels():
+            label.set_horizontalalignment("right")
+    if chart_type != "pie":
+        ax.set_xlabel(x if chart_type not in ("hist",) else y)
+        ax.set_ylabel(y if chart_type != "hist" else "count")
+    ax.set_title(spec.get("title") or "")
+    fig.tight_layout()
+    return fig
+
+def figure_to_png(fig, dpi=120):
+    """Render a Figure straight to PNG bytes in memory."""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi)
+    return buffer.getvalue()
+
+def render_png(df, spec, dpi=120):
+    """Render a spec to in-memory PNG bytes."""
+    return figure_to_png(render_chart(df, spec), dpi=dpi)
@@ -0,0 +1,848 @@
+"""
+Columnar execution backend for single-table aggregations.
+
+Tables that queries keep coming back to are materialized once into
+cache/columnar/: one .npy file per column, memory-mapped on load, with text
+columns dictionary-encoded into int32 codes over a sorted dictionary (so codes
+compare in the same order as the strings). Queries of the shape
+
+    SELECT cols / COUNT|SUM|AVG|MIN|MAX(...) FROM table
+    [WHERE col <op> literal AND ...] [GROUP BY cols] [ORDER BY ...] [LIMIT n [OFFSET m]]
+
+are then answered with numpy instead of SQLite. Anything else (joins,
+subqueries, expressions, HAVING, ...) returns None and run_sql falls back to
+SQLite. A materialized table is rebuilt when its database file changes.
+
+Text columns whose values all read as numbers (the DepMap tables declare every
+column VARCHAR) also get a float64 numeric view, so SUM and AVG over them run
+here too, with the result SQLite's text-to-number coercion would give.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from db_connection import db_alias
+from schema_catalog import get_catalog
+from query_cache import sql_shape
+
+log = logging.getLogger(__name__)
+
+STORE_DIRECTORY = os.path.join("cache", "columnar")
+HOT_QUERIES = 2                 # supported queries on a table before it is materialized
+MAX_TABLE_ROWS = 20_000_000     # larger tables stay in SQLite
+DENSE_GROUPS = 1 << 24          # group-key spaces up to this size are counted with bincount, not sorted
+FETCH_ROWS = 50000              # rows read per fetchmany while materializing
+FORMAT_VERSION = 2              # bump when the on-disk layout changes so old copies are rebuilt
+
+AGGREGATES = ("COUNT", "SUM", "AVG", "MIN", "MAX")
+_COMPARISONS = ("=", "==", "!=", "<>", "<", "<=", ">", ">=")
+_KEYWORDS = {
+    "SELECT", "FROM", "WHERE", "GROUP", "BY", "ORDER", "LIMIT", "OFFSET", "AND", "OR", "NOT", "AS",
+    "ASC", "DESC", "IN", "IS", "NULL", "BETWEEN", "HAVING", "DISTINCT", "JOIN", "ON", "UNION", "LIKE",
+}
+
+_TOKEN = re.compile(r"""\s*(?:
+     (?P<string>'(?:[^']|'')*')
+    |(?P<qident>"(?:[^"]|"")*"|\[[^\]]*\]|`[^`]*`)
+    |(?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+    |(?P<ident>[A-Za-z_][A-Za-z0-9_$]*)
+    |(?P<op><=|>=|<>|!=|==|[=<>(),.*;+-])
+)""", re.VERBOSE)
+
+class Unsupported(Exception):
+    """The query is outside what the columnar backend can answer."""
+
+def _tokenize(sql_query):
+    tokens, pos = [], 0
+    sql_query = sql_query.rstrip()
+    while pos < len(sql_query):
+        match = _TOKEN.match(sql_query, pos)
+        if match is None or match.end() == pos:
+            raise Unsupported(f"cannot tokenize at {sql_query[pos:pos + 20]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = value[1:-1].replace("''", "'")
+        elif kind == "qident":
+            value, kind = value[1:-1].replace('""', '"'), "ident"
+        tokens.append((kind, value, match.start(kind), match.end(kind)))
+        pos = match.end()
+    return tokens
+
+class _Parser:
+    """Recursive-descent parser for the supported SELECT subset; raises Unsupported otherwise."""
+
+    def __init__(self, sql_query):
+        self.sql = sql_query
+        self.tokens = _tokenize(sql_query)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None, len(self.sql), len(self.sql))
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def is_keyword(self, *words, offset=0):
+        kind, value, _, _ = self.peek(offset)
+        return kind == "ident" and value.upper() in words
+
+    def keyword(self, *words):
+        if not self.is_keyword(*words):
+            raise Unsupported(f"expected {' '.join(words)}")
+        return self.take()[1].upper()
+
+    def op(self, *ops):
+        kind, value, _, _ = self.peek()
+        if kind != "op" or value not in ops:
+            raise Unsupported(f"expected {' or '.join(ops)}")
+        return self.take()[1]
+
+    def is_op(self, *ops):
+        kind, value, _, _ = self.peek()
+        return kind == "op" and value in ops
+
+    def identifier(self):
+        kind, value, _, _ = self.peek()
+        if kind != "ident" or (value.upper() in _KEYWORDS):
+            raise Unsupported("expected identifier")
+        return self.take()[1]
+
+    def column(self):
+        """[qualifier .] name -> (qualifier or None, name)"""
+        name = self.identifier()
+        if self.is_op("."):
+            self.take()
+            qualifier, name = name, self.identifier()
+            if self.is_op("."):
+                raise Unsupported("schema-qualified column")
+            return qualifier, name
+        return None, name
+
+    def literal(self):
+        sign = 1
+        if self.is_op("-", "+"):
+            sign = -1 if self.take()[1] == "-" else 1
+        kind, value, _, _ = self.take()
+        if kind == "number":
+            number = float(value) if any(c in value for c in ".eE") else int(value)
+            return sign * number
+        if kind == "string" and sign == 1:
+            return value
+        if kind == "ident" and value.upper() == "NULL":
+            raise Unsupported("NULL literal")
+        raise Unsupported("expected literal")
+
+    def alias(self):
+        if self.is_keyword("AS"):
+            self.take()
+            return self.identifier()
+        kind, value, _, _ = self.peek()
+        if kind == "ident" and value.upper() not in _KEYWORDS:
+            return self.take()[1]
+        return None
+
+    def select_item(self):
+        start = self.peek()[2]
+        if self.is_keyword(*AGGREGATES) and self.peek(1)[1] == "(":
+            func = self.take()[1].upper()
+            self.op("(")
+            distinct = False
+            if self.is_op("*"):
+                self.take()
+                if func != "COUNT":
+                    raise Unsupported(f"{func}(*)")
+                column = None
+            else:
+                if self.is_keyword("DISTINCT"):
+                    self.take()
+                    distinct = True
+                    if func != "COUNT":
+                        raise Unsupported(f"{func}(DISTINCT ...)")
+                column = self.column()
+            end = self.peek()[3]
+            self.op(")")
+            item = {"kind": "agg", "func": func, "column": column, "distinct": distinct,
+                    "text": self.sql[start:end]}
+        else:
+            column = self.column()
+            item = {"kind": "column", "column": column, "text": self.sql[start:self.tokens[self.pos - 1][3]]}
+        if not (self.is_op(",") or self.is_keyword("FROM")):
+            item["alias"] = self.alias()
+        return item
+
+    def predicate(self):
+        column = self.column()
+        if self.is_keyword("IS"):
+            self.take()
+            negate = bool(self.is_keyword("NOT") and self.take())
+            self.keyword("NULL")
+            return (column, "notnull" if negate else "isnull", None)
+        negate = bool(self.is_keyword("NOT") and self.take())
+        if self.is_keyword("IN"):
+            self.take()
+            self.op("(")
+            values = [self.literal()]
+            while self.is_op(","):
+                self.take()
+                values.append(self.literal())
+            self.op(")")
+            return (column, "notin" if negate else "in", values)
+        if self.is_keyword("BETWEEN"):
+            self.take()
+            low = self.literal()
+            self.keyword("AND")
+            high = self.literal()
+            return (column, "notbetween" if negate else "between", (low, high))
+        if negate:
+            raise Unsupported("NOT")
+        operator = self.op(*_COMPARISONS)
+        return (column, {"==": "=", "<>": "!="}.get(operator, operator), self.literal())
+
+    def order_item(self):
+        if self.peek()[0] == "number":
+            key = ("position", int(self.take()[1]))
+        else:
+            start = self.peek()[2]
+            if self.is_keyword(*AGGREGATES) and self.peek(1)[1] == "(":
+                depth = 0
+                while True:
+                    _, value, _, end = self.take()
+                    depth += {"(": 1, ")": -1}.get(value, 0)
+                    if depth == 0 and value == ")":
+                        break
+                key = ("text", self.sql[start:end])
+            else:
+                key = ("column", self.column())
+        descending = False
+        if self.is_keyword("ASC", "DESC"):
+            descending = self.take()[1].upper() == "DESC"
+        if self.is_keyword("NULLS", "COLLATE"):
+            raise Unsupported("NULLS/COLLATE in ORDER BY")
+        return key, descending
+
+    def parse(self):
+        self.keyword("SELECT")
+        if self.is_keyword("DISTINCT", "ALL"):
+            raise Unsupported("DISTINCT")
+        items = [self.select_item()]
+        while self.is_op(","):
+            self.take()
+            items.append(self.select_item())
+        self.keyword("FROM")
+        schema, table = self.column()
+        table_alias = self.alias()
+        where, group_by, order_by, limit, offset = [], [], [], None, 0
+        if self.is_keyword("WHERE"):
+            self.take()
+            where.append(self.predicate())
+            while self.is_keyword("AND"):
+                self.take()
+                where.append(self.predicate())
+        if self.is_keyword("GROUP"):
+            self.take()
+            self.keyword("BY")
+            while True:
+                if self.peek()[0] == "number":
+                    group_by.append(("position", int(self.take()[1])))
+                else:
+                    group_by.append(("column", self.column()))
+                if not self.is_op(","):
+                    break
+                self.take()
+        if self.is_keyword("ORDER"):
+            self.take()
+            self.keyword("BY")
+            order_by.append(self.order_item())
+            while self.is_op(","):
+                self.take()
+                order_by.append(self.order_item())
+        if self.is_keyword("LIMIT"):
+            self.take()
+            limit = int(self.literal())
+            if self.is_keyword("OFFSET"):
+                self.take()
+                offset = int(self.literal())
+            elif self.is_op(","):
+                raise Unsupported("LIMIT x, y")
+        if self.is_op(";"):
+            self.take()
+        if self.peek()[0] is not None:
+            raise Unsupported(f"unexpected {self.peek()[1]!r}")
+        return {"schema": schema, "table": table, "alias": table_alias, "items": items, "where": where,
+                "group_by": group_by, "order_by": order_by, "limit": limit, "offset": offset}
+
+def parse_query(sql_query):
+    """Parse a query in the supported subset, or return None."""
+    try:
+        return _Parser(sql_query).parse()
+    except Unsupported:
+        return None
+
+_NUMERIC_TEXT = re.compile(r"\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\s*")
+_INTEGER_TEXT = re.compile(r"\s*[-+]?\d+\s*")
+
+def _numeric_view(values):
+    """
+    ("int" or "float", float64 array with NaN for NULL) for a text column whose
+    values all read as numbers under SQLite's numeric affinity, else None.
+    """
+    integral = True
+    for v in values:
+        if v is None:
+            continue
+        if not _NUMERIC_TEXT.fullmatch(v):
+            return None
+        integral = integral and _INTEGER_TEXT.fullmatch(v) is not None and abs(int(v)) < 2 ** 63
+    data = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    return ("int" if integral else "float"), data
+
+def check_interrupt(deadline=None, cancel_token=None):
+    """Raise what SQLite's progress handler would once the deadline passes or the query is cancelled."""
+    if (deadline is not None and time.monotonic() > deadline) or (cancel_token is not None and cancel_token.cancelled):
+        raise sqlite3.OperationalError("interrupted")
+
+def _column_kind(values):
+    """'int', 'float' or 'str' for a column's fetched values, or None if it cannot be stored."""
+    kinds = {type(v) for v in values if v is not None}
+    has_null = len(kinds) < len({type(v) for v in values})
+    if not kinds:
+        return "float"
+    if kinds == {int}:
+        return None if has_null else "int"   # NULLs would turn it into floats and change SUM/MIN/MAX types
+    if kinds <= {int, float}:
+        return "float"
+    if kinds == {str}:
+        return "str"
+    return None
+
+class ColumnTable:
+    """One materialized table: memory-mapped column arrays plus text dictionaries."""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.rows = manifest["rows"]
+        self.kinds = manifest["kinds"]
+        self.numeric = manifest.get("numeric", {})  # text column -> "int"/"float" of its numeric view
+        self._arrays = {}
+        self._dictionaries = {}
+
+    def array(self, column):
+        if column not in self._arrays:
+            self._arrays[column] = np.load(os.path.join(self.directory, f"{column}.npy"), mmap_mode="r")
+        return self._arrays[column]
+
+    def numbers(self, column):
+        """float64 numeric view of a text column listed in numeric, NaN for NULL."""
+        key = f"{column}.num"
+        if key not in self._arrays:
+            self._arrays[key] = np.load(os.path.join(self.directory, f"{column}.num.npy"), mmap_mode="r")
+        return self._arrays[key]
+
+    def dictionary(self, column):
+        """Sorted distinct strings of a text column, as an object array with None appended for code -1."""
+        if column not in self._dictionaries:
+            with open(os.path.join(self.directory, f"{column}.dict.json"), "r", encoding="utf-8") as file:
+                self._dictionaries[column] = np.array(json.load(file) + [None], dtype=object)
+        return self._dictionaries[column]
+
+    def values(self, column, rows=None):
+        """Decoded values of a column, optionally for a subset of row positions."""
+        data = self.array(column)
+        data = data if rows is None else data[rows]
+        if self.kinds[column] == "str":
+            return self.dictionary(column)[data]
+        return np.asarray(data)
+
+class ColumnStore:
+    """Columnar copies of hot tables and the vectorized executor that queries them."""
+
+    name = "columnar"
+
+    def __init__(self, directory=STORE_DIRECTORY, hot_queries=HOT_QUERIES):
+        self.directory = directory
+        self.hot_queries = hot_queries
+        self._lock = threading.Lock()
+        self._tables = {}       # (db_file, table) -> (fingerprint, ColumnTable)
+        self._hits = {}         # (db_file, table) -> supported queries seen
+        self._building = set()
+        self._rejected = set()  # query shapes that must go to SQLite
+
+    def _table_dir(self, db_file, table):
+        return os.path.join(self.directory, db_alias(db_file), table)
+
+    def _resolve(self, schema, table):
+        """(db_file, table name, columns) for a table reference, matched case-insensitively."""
+        catalog = get_catalog()
+        catalog.refresh()
+        for table_key, columns in catalog.schema().items():
+            name, _, db_file = table_key.partition(" in ")
+            if name.lower() == table.lower() and (schema is None or db_alias(db_file).lower() == schema.lower()):
+                return db_file, name, columns
+        return None
+
+    def materialize(self, db_file, table, fingerprint):
+        """Read a table out of SQLite into per-column .npy files; returns the manifest."""
+        conn = sqlite3.connect(Path(db_file).resolve().as_uri() + "?mode=ro", uri=True)
+        try:
+            create_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                      (table,)).fetchone()[0] or ""
+            if "COLLATE" in create_sql.upper():
+                raise Unsupported("column collations")  # comparisons would not be BINARY
+            order = "" if "WITHOUT ROWID" in create_sql.upper() else " ORDER BY rowid"
+            cursor = conn.execute(f'SELECT * FROM "{table}"{order}')
+            names = [d[0] for d in cursor.description]
+            columns = [[] for _ in names]
+            while True:
+                rows = cursor.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                for i, values in enumerate(zip(*rows)):
+                    columns[i].extend(values)
+                if len(columns[0]) > MAX_TABLE_ROWS:
+                    raise Unsupported("table too large")
+        finally:
+            conn.close()
+
+        target = self._table_dir(db_file, table)
+        staging = f"{target}.building"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        kinds, numeric = {}, {}
+        for name, values in zip(names, columns):
+            kind = _column_kind(values)
+            if kind is None:
+                continue
+            if kind == "str":
+                view = _numeric_view(values)
+                if view is not None:
+                    numeric[name] = view[0]
+                    np.save(os.path.join(staging, f"{name}.num.npy"), view[1])
+                dictionary = sorted({v for v in values if v is not None})
+                lookup = {v: i for i, v in enumerate(dictionary)}
+                data = np.fromiter((lookup.get(v, -1) if v is not None else -1 for v in values),
+                                   dtype=np.int32, count=len(values))
+                with open(os.path.join(staging, f"{name}.dict.json"), "w", encoding="utf-8") as file:
+                    json.dump(dictionary, file)
+            elif kind == "int":
+                data = np.array(values, dtype=np.int64)
+            else:
+                data = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            np.save(os.path.join(staging, f"{name}.npy"), data)
+            kinds[name] = kind
+        manifest = {"db_file": db_file, "table": table, "fingerprint": list(fingerprint),
+                    "rows": len(columns[0]) if columns else 0, "kinds": kinds, "numeric": numeric,
+                    "version": FORMAT_VERSION}
+        with open(os.path.join(staging, "manifest.json"), "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(staging, target)
+        return manifest
+
+    def _build(self, key, fingerprint):
+        try:
+            self.materialize(*key, fingerprint)
+            log.info("Columnar copy of %s in %s is ready", key[1], key[0])
+        except Exception as e:
+            log.warning("Could not build columnar copy of %s in %s: %s", key[1], key[0], e)
+        finally:
+            with self._lock:
+                self._building.discard(key)
+
+    def table(self, db_file, table):
+        """The columnar copy of a table if it is current, else None (starting a build once it is hot)."""
+        key = (db_file, table)
+        fingerprint = get_catalog().fingerprints().get(db_file)
+        if fingerprint is None:
+            return None
+        with self._lock:
+            loaded = self._tables.get(key)
+            if loaded is not None and loaded[0] == fingerprint:
+                return loaded[1]
+        manifest_path = os.path.join(self._table_dir(db_file, table), "manifest.json")
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            manifest = None
+        if (manifest is not None and manifest.get("version") == FORMAT_VERSION
+                and tuple(manifest["fingerprint"]) == tuple(fingerprint)):
+            column_table = ColumnTable(os.path.dirname(manifest_path), manifest)
+            with self._lock:
+                self._tables[key] = (fingerprint, column_table)
+            return column_table
+        with self._lock:
+            self._hits[key] = self._hits.get(key, 0) + 1
+            if self._hits[key] < self.hot_queries or key in self._building:
+                return None
+            self._building.add(key)
+        threading.Thread(target=self._build, args=(key, fingerprint), name="columnar-build", daemon=True).start()
+        return None
+
+    def warm(self, sql_query):
+        """Build the columnar copy of the table a supported query reads, in this thread; returns whether it is ready."""
+        query = parse_query(sql_query)
+        resolved = query and self._resolve(query["schema"], query["table"])
+        if not resolved:
+            return False
+        db_file, table, _ = resolved
+        key = (db_file, table)
+        if get_catalog().fingerprints().get(db_file) is None:
+            return False
+        while self.table(db_file, table) is None:
+            with self._lock:
+                building = key in self._building
+                if not building:
+                    self._building.add(key)
+            if building:
+                time.sleep(0.05)  # a background build is under way
+                continue
+            self._build(key, get_catalog().fingerprints().get(db_file))
+            return self.table(db_file, table) is not None
+        return True
+
+    def reject(self, sql_query):
+        """Send queries of this shape to SQLite from now on, e.g. after a result mismatch."""
+        with self._lock:
+            self._rejected.add(sql_shape(sql_query))
+
+    def execute(self, sql_query, max_rows=None, max_bytes=None, deadline=None, cancel_token=None):
+        """
+        Answer a supported query from a columnar copy, or return None to fall back to SQLite.
+        Like SQLite, raises sqlite3.OperationalError("interrupted") past deadline
+        (time.monotonic()) or once cancel_token is cancelled.
+        """
+        check_interrupt(deadline, cancel_token)
+        if sql_shape(sql_query) in self._rejected:
+            return None
+        query = parse_query(sql_query)
+        if query is None:
+            return None
+        resolved = self._resolve(query["schema"], query["table"])
+        if resolved is None:
+            return None
+        db_file, table, _ = resolved
+        column_table = self.table(db_file, table)
+        if column_table is None:
+            return None
+        try:
+            result_df = _evaluate(query, table, column_table, lambda: check_interrupt(deadline, cancel_token))
+        except Unsupported:
+            return None
+        truncated = False
+        if max_rows is not None and len(result_df) > max_rows:
+            result_df, truncated = result_df.iloc[:max_rows].reset_index(drop=True), True
+        if max_bytes is not None and len(result_df):
+            size = int(result_df.memory_usage(index=False, deep=True).sum())
+            if size > max_bytes:
+                keep = max(1, int(len(result_df) * max_bytes / size))
+                result_df, truncated = result_df.iloc[:keep].reset_index(drop=True), True
+        result_df.attrs["truncated"] = truncated
+        return result_df
+
+def _resolve_column(reference, table, query, column_table):
+    """Map a (qualifier, name) reference to the table's column name, case-insensitively."""
+    qualifier, name = reference
+    if qualifier is not None and qualifier.lower() not in {table.lower(), (query["alias"] or "").lower()}:
+        raise Unsupported(f"unknown qualifier {qualifier}")
+    for column in column_table.kinds:
+        if column.lower() == name.lower():
+            return column
+    raise Unsupported(f"column {name} not materialized")
+
+def _filter(query, table, column_table):
+    """Boolean mask of rows matching the WHERE clause, or None for all rows."""
+    mask = None
+    for reference, operator, value in query["where"]:
+        column = _resolve_column(reference, table, query, column_table)
+        kind = column_table.kinds[column]
+        data = column_table.array(column)
+        values = value if isinstance(value, (list, tuple)) else [value]
+        if operator not in ("isnull", "notnull") and any(isinstance(v, str) != (kind == "str") for v in values):
+            raise Unsupported("comparison across types")  # SQLite affinity rules would apply
+        if kind == "str":
+            dictionary = column_table.dictionary(column)[:-1]
+            null = data == -1
+            if operator in ("in", "notin", "=", "!="):
+                codes = np.searchsorted(dictionary, values) if len(dictionary) else np.zeros(len(values), dtype=int)
+                codes = [c for c, v in zip(codes, values) if c < len(dictionary) and dictionary[c] == v]
+                hit = np.isin(data, codes)
+                matched = hit if operator in ("in", "=") else ~hit & ~null
+            elif operator in ("<", "<=", ">", ">="):
+                side = "left" if operator in ("<", ">=") else "right"
+                bound = np.searchsorted(dictionary, value, side=side)
+                matched = (data < bound) if operator in ("<", "<=") else (data >= bound)
+                matched &= ~null
+            elif operator in ("between", "notbetween"):
+                low = np.searchsorted(dictionary, value[0], side="left")
+                high = np.searchsorted(dictionary, value[1], side="right")
+                matched = (data >= low) & (data < high)
+                matched = matched if operator == "between" else ~matched & ~null
+            else:
+                matched = null if operator == "isnull" else ~null
+        else:
+            null = np.isnan(data) if kind == "float" else np.zeros(len(data), dtype=bool)
+            if operator == "=":
+                matched = data == value
+            elif operator == "!=":
+                matched = (data != value) & ~null
+            elif operator == "<":
+                matched = data < value
+            elif operator == "<=":
+                matched = data <= value
+            elif operator == ">":
+                matched = data > value
+            elif operator == ">=":
+                matched = data >= value
+            elif operator in ("in", "notin"):
+                hit = np.isin(data, values)
+                matched = hit if operator == "in" else ~hit & ~null
+            elif operator in ("between", "notbetween"):
+                matched = (data >= value[0]) & (data <= value[1])
+                matched = matched if operator == "between" else ~matched & ~null
+            else:
+                matched = null if operator == "isnull" else ~null
+        mask = matched if mask is None else mask & matched
+    return mask
+
+def _sort_codes(data, kind, dictionary=None):
+    """
+    Order-preserving integer codes for a column, with NULL as code 0 where the
+    column can hold NULLs, and an array giving the value each code stands for.
+    """
+    if kind == "str":
+        return data.astype(np.int64) + 1, np.concatenate([np.array([None], dtype=object), dictionary[:-1]])
+    if kind == "float":
+        null = np.isnan(data)
+        uniques, inverse = np.unique(data[~null], return_inverse=True)
+        codes = np.zeros(len(data), dtype=np.int64)
+        codes[~null] = inverse + 1
+        return codes, np.array([None] + uniques.tolist(), dtype=object)
+    uniques, inverse = np.unique(data, return_inverse=True)
+    return inverse.astype(np.int64), uniques
+
+def _rank(values):
+    """Dense ascending rank of a list of Python values, NULLs first."""
+    values = np.array(values, dtype=object)
+    null = np.array([v is None for v in values], dtype=bool)
+    key = np.zeros(len(values), dtype=np.int64)
+    if not null.all():
+        key[~null] = np.unique(values[~null], return_inverse=True)[1].ravel() + 1
+    return key
+
+def _aggregate(item, kind, data, groups, n_groups, dictionary=None):
+    """
+    One aggregate per group as a list of Python values (None for SQL NULL).
+    data is None for COUNT(*); dictionary decodes MIN/MAX of a text column.
+    """
+    func = item["func"]
+    if data is None:
+        return np.bincount(groups, minlength=n_groups).tolist()
+    valid = data != -1 if kind == "str" else (~np.isnan(data) if kind == "float" else np.ones(len(data), dtype=bool))
+    valid_groups, valid_data = groups[valid], data[valid]
+    counts = np.bincount(valid_groups, minlength=n_groups)
+    if func == "COUNT":
+        if item["distinct"]:
+            codes, decode = _sort_codes(valid_data, kind, dictionary)
+            size = len(decode)
+            if n_groups * size <= DENSE_GROUPS:
+                seen = np.zeros(n_groups * size, dtype=bool)
+                seen[valid_groups * size + codes] = True
+                return seen.reshape(n_groups, size).sum(axis=1).tolist()
+            pairs = np.unique(valid_groups * size + codes)
+            return np.bincount(pairs // size, minlength=n_groups).tolist()
+        return counts.tolist()
+    if func in ("SUM", "AVG"):
+        if kind == "str":
+            raise Unsupported(f"{func} of text")
+        exact = kind == "int" and float(np.abs(valid_data).sum()) < 2 ** 53
+        if kind == "int" and not exact:
+            raise Unsupported("integer sum beyond float precision")
+        sums = np.bincount(valid_groups, weights=valid_data, minlength=n_groups)
+        if func == "AVG":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means = sums / counts
+            return [float(m) if c else None for m, c in zip(means, counts)]
+        if kind == "int":
+            return [int(round(s)) if c else None for s, c in zip(sums, counts)]
+        return [float(s) if c else None for s, c in zip(sums, counts)]
+    # MIN / MAX
+    if kind == "str":
+        fill = np.iinfo(np.int64).max if func == "MIN" else -1
+        out = np.full(n_groups, fill, dtype=np.int64)
+        (np.minimum if func == "MIN" else np.maximum).at(out, valid_groups, valid_data.astype(np.int64))
+        return [dictionary[int(code)] if c else None for code, c in zip(out, counts)]
+    dtype = np.int64 if kind == "int" else np.float64
+    fill = (np.iinfo(np.int64).max if func == "MIN" else np.iinfo(np.int64).min) if kind == "int" \
+        else (np.inf if func == "MIN" else -np.inf)
+    out = np.full(n_groups, fill, dtype=dtype)
+    (np.minimum if func == "MIN" else np.maximum).at(out, valid_groups, valid_data)
+    return [v if c else None for v, c in zip(out.tolist(), counts)]
+
+def _column_sort_key(column_table, column, data):
+    kind = column_table.kinds[column]
+    return _sort_codes(data, kind, column_table.dictionary(column) if kind == "str" else None)[0]
+
+def _output_name(item, column):
+    if item.get("alias"):
+        return item["alias"]
+    return column if item["kind"] == "column" else item["text"]
+
+def _evaluate(query, table, column_table, check=lambda: None):
+    """Run a parsed query against a columnar table and return a DataFrame; check() runs between steps."""
+    from run_sql import _column_array, schema_column_types
+
+    items = query["items"]
+    mask = _filter(query, table, column_table)
+    check()
+    rows = None if mask is None else np.flatnonzero(mask)
+    aggregated = query["group_by"] or any(item["kind"] == "agg" for item in items)
+    item_columns = [None if item["kind"] == "agg" and item["column"] is None
+                    else _resolve_column(item["column"], table, query, column_table) for item in items]
+    names = [_output_name(item, column) for item, column in zip(items, item_columns)]
+
+    def column_data(column):
+        data = column_table.array(column)
+        return np.asarray(data if rows is None else data[rows])
+
+    outputs, sort_keys = [], {}
+    if aggregated:
+        group_columns = []
+        for kind, ref in query["group_by"]:
+            if kind == "position":
+                if not 1 <= ref <= len(items) or items[ref - 1]["kind"] != "column":
+                    raise Unsupported("GROUP BY position")
+                group_columns.append(item_columns[ref - 1])
+            else:
+                group_columns.append(_resolve_column(ref, table, query, column_table))
+        for item, column in zip(items, item_columns):
+            if item["kind"] == "column" and column not in group_columns:
+                raise Unsupported("bare column outside GROUP BY")
+        n_rows = column_table.rows if rows is None else len(rows)
+        group_values = {}
+        if group_columns:
+            codes, decoders = [], []
+            for column in group_columns:
+                kind = column_table.kinds[column]
+                dictionary = column_table.dictionary(column) if kind == "str" else None
+                column_codes, decode = _sort_codes(column_data(column), kind, dictionary)
+                codes.append(column_codes)
+                decoders.append(decode)
+            sizes = [len(decode) for decode in decoders]
+            space = float(np.prod([float(size) for size in sizes]))
+            if space >= 2 ** 62:
+                raise Unsupported("too many group combinations")
+            combined = np.ravel_multi_index(codes, sizes) if len(codes) > 1 else codes[0]
+            if space <= DENSE_GROUPS:
+                # Group codes are dense small integers: count them instead of sorting
+                keys = np.flatnonzero(np.bincount(combined, minlength=int(space)))
+                remap = np.zeros(int(space), dtype=np.int64)
+                remap[keys] = np.arange(len(keys))
+                groups = remap[combined]
+            else:
+                keys, groups = np.unique(combined, return_inverse=True)
+                groups = groups.ravel()
+            n_groups = len(keys)
+            key_codes = np.unravel_index(keys, sizes) if len(codes) > 1 else (keys,)
+            for column, column_codes, decode in zip(group_columns, key_codes, decoders):
+                group_values[column] = decode[column_codes]
+                sort_keys[column] = column_codes
+        else:
+            groups, n_groups = np.zeros(n_rows, dtype=np.int64), 1
+        for item, column in zip(items, item_columns):
+            kind = column_table.kinds.get(column)
+            if item["kind"] == "column":
+                outputs.append(group_values[column].tolist())
+            elif item["func"] in ("SUM", "AVG") and kind == "str" and column in column_table.numeric:
+                numbers = column_table.numbers(column)
+                numbers = np.asarray(numbers if rows is None else numbers[rows])
+                values = _aggregate(item, "float", numbers, groups, n_groups)
+                if item["func"] == "SUM" and column_table.numeric[column] == "int":
+                    # SQLite sums integer-looking text as integers
+                    if float(np.nansum(np.abs(numbers))) >= 2 ** 53:
+                        raise Unsupported("integer sum beyond float precision")
+                    values = [None if v is None else int(round(v)) for v in values]
+                outputs.append(values)
+            else:
+                data = column_data(column) if column is not None else None
+                dictionary = column_table.dictionary(column) if kind == "str" else None
+                outputs.append(_aggregate(item, kind, data, groups, n_groups, dictionary))
+            check()
+    else:
+        for column in item_columns:
+            outputs.append(column_table.values(column, rows))
+
+    order = None
+    if query["order_by"]:
+        keys = []
+        for (kind, ref), descending in query["order_by"]:
+            position = None
+            if kind == "position":
+                position = ref - 1
+            elif kind == "text":
+                matches = [i for i, item in enumerate(items) if item["kind"] == "agg"
+                           and re.sub(r"\s+", "", item["text"]).upper() == re.sub(r"\s+", "", ref).upper()]
+                position = matches[0] if matches else None
+            else:
+                qualifier, name = ref
+                matches = [i for i, n in enumerate(names) if qualifier is None and n.lower() == name.lower()]
+                position = matches[0] if matches else None
+                if position is None:
+                    column = _resolve_column(ref, table, query, column_table)
+                    if aggregated:
+                        if column not in sort_keys:
+                            raise Unsupported("ORDER BY column outside GROUP BY")
+                        key = sort_keys[column]
+                    else:
+                        key = _column_sort_key(column_table, column, column_data(column))
+                    keys.append(-key if descending else key)
+                    continue
+            if position is None or not 0 <= position < len(outputs):
+                raise Unsupported("ORDER BY expression")
+            if aggregated:
+                key = _rank(outputs[position])
+            else:
+                column = item_columns[position]
+                key = _column_sort_key(column_table, column, column_data(column))
+            keys.append(-key if descending else key)
+        order = np.lexsort(keys[::-1])
+
+    known_types = schema_column_types()
+    columns = {}
+    for i, (name, values) in enumerate(zip(names, outputs)):
+        values = np.asarray(values, dtype=object) if isinstance(values, list) else values
+        if order is not None:
+            values = values[order]
+        start = query["offset"] or 0
+        stop = None if query["limit"] is None or query["limit"] < 0 else start + query["limit"]
+        values = values[start:stop]
+        columns[i] = _column_array(values.tolist() if values.dtype == object else values, known_types.get(name))
+    result_df = pd.DataFrame(columns)
+    result_df.columns = names
+    return result_df
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_column_store():
+    """Process-wide columnar backend; None when GALEN_COLUMNAR=off."""
+    global _store
+    if os.getenv("GALEN_COLUMNAR", "").lower() == "off":
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ColumnStore()
+    return _store
@@ -1,61 +1,184 @@
 import os
 import sqlite3
 import glob
+import time
+import atexit
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
 
-def connect_sqlite():
+log = logging.getLogger(__name__)
+
+DB_DIRECTORY = "db/"
+
+# Read-tuned settings applied to every attached database
+MMAP_SIZE = 256 * 1024 * 1024   # bytes of each db file to memory-map
+CACHE_SIZE = -64000             # negative means KiB, so ~64 MB of page cache per db
+MAX_CONNECTIONS = 8             # upper bound on open pooled connections
+RESCAN_INTERVAL = 1.0           # seconds between checks of the db directory
+
+def find_db_files(db_directory=DB_DIRECTORY):
+    """Return the sorted list of .db files in the database directory."""
+    return sorted(glob.glob(os.path.join(db_directory, "*.db")))
+
+def db_alias(db_file):
+    """Schema name a database is attached under: its base name without extension."""
+    return os.path.splitext(os.path.basename(db_file))[0]
+
+def _attach_databases(conn, db_files, read_only=True):
     """
-    Connect to a primary database and attach additional databases found in the directory.
-    Returns the connection and cursor of the primary database, with other databases attached.
+    Attach every database file to the connection and apply the read-tuned pragmas.
+    Files are opened read-only through a URI when read_only is set.
     """
-    db_directory = "db/"
-    
-    # Absolute path check
-    current_dir = os.getcwd()
-    absolute_db_path = os.path.join(current_dir, db_directory)
-    print(f"Looking for databases in: {absolute_db_path}")
-    
-    # Check if directory exists
-    if not os.path.exists(absolute_db_path):
-        print(f"ERROR: Database directory not found at {absolute_db_path}")
-        
-    # List all files in the directory
-    try:
-        all_files = os.listdir(absolute_db_path)
-        print(f"All files in directory: {all_files}")
-    except Exception as e:
-        print(f"Error listing directory: {e}")
-    
-    # Use glob to find db files
-    db_files = glob.glob(os.path.join(db_directory, "*.db"))
-    print(f"Found {len(db_files)} database files: {db_files}")
-    
-    if not db_files:
-        raise Exception(f"No database files found in {absolute_db_path}")
-    
-    # Connect to an in-memory database as primary
-    conn = sqlite3.connect(':memory:')
     cursor = conn.cursor()
-
-    # Attach other databases
     for db_file in db_files:
-        db_name = os.path.splitext(os.path.basename(db_file))[0]  # Get the base name without extension
-        print(f"ATTACH DATABASE '{db_file}' AS {db_name}")
+        db_name = db_alias(db_file)
+        target = Path(db_file).resolve().as_uri() + "?mode=ro" if read_only else db_file
+        try:
+            cursor.execute(f'ATTACH DATABASE ? AS "{db_name}"', (target,))
+            cursor.execute(f'PRAGMA "{db_name}".mmap_size = {MMAP_SIZE}')
+            cursor.execute(f'PRAGMA "{db_name}".cache_size = {CACHE_SIZE}')
+        except sqlite3.Error as e:
+            log.warning("Error attaching %s: %s", db_file, e)
+    if read_only:
+        cursor.execute("PRAGMA query_only = 1")
+    cursor.close()
+
+def _open_connection(db_files, read_only=True, check_same_thread=True):
+    """Open an in-memory primary connection with all databases attached."""
+    conn = sqlite3.connect(':memory:', uri=True, check_same_thread=check_same_thread)
+    _attach_databases(conn, db_files, read_only=read_only)
+    return conn
+
+class ConnectionPool:
+    """
+    Bounded pool of pre-attached, read-only SQLite connections.
+
+    Connections are handed out one caller at a time and returned to the pool
+    afterwards. The db directory is re-scanned at most every RESCAN_INTERVAL
+    seconds; when the set of .db files changes the pool moves to a new
+    generation and connections from the old one are closed as they come back.
+    """
+
+    def __init__(self, db_directory=DB_DIRECTORY, max_connections=MAX_CONNECTIONS):
+        self.db_directory = db_directory
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = []
+        self._db_files = None
+        self._generation = 0
+        self._last_scan = 0.0
+
+    def db_files(self):
+        """Current set of attached database files, re-scanning if due."""
+        self._refresh()
+        return list(self._db_files)
+
+    @property
+    def generation(self):
+        """Incremented every time the set of attached databases changes."""
+        self._refresh()
+        return self._generation
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._db_files is not None and now - self._last_scan < RESCAN_INTERVAL:
+                return
+            self._last_scan = now
+            db_files = find_db_files(self.db_directory)
+            if db_files == self._db_files:
+                return
+            if not db_files:
+                raise Exception(f"No database files found in {os.path.abspath(self.db_directory)}")
+            self._db_files = db_files
+            self._generation += 1
+            stale, self._idle = self._idle, []
+        for _, conn in stale:
+            conn.close()
+
+    def acquire(self):
+        """Take a connection from the pool, opening one if none are idle."""
+        self._refresh()
+        self._slots.acquire()
+        try:
+            with self._lock:
+                generation, db_files = self._generation, self._db_files
+                while self._idle:
+                    conn_generation, conn = self._idle.pop()
+                    if conn_generation == generation:
+                        return conn_generation, conn
+                    conn.close()
+            return generation, _open_connection(db_files, check_same_thread=False)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, generation, conn):
+        """Return a connection to the pool, closing it if its generation is stale."""
         try:
-            cursor.execute(f"ATTACH DATABASE '{db_file}' AS {db_name}")
-            print(f"Successfully attached {db_name}")
-        except Exception as e:
-            print(f"Error attaching {db_file}: {e}")
-
-    # Verify databases are attached
-    try:
-        cursor.execute("PRAGMA database_list;")
-        attached_dbs = cursor.fetchall()
-        print(f"Attached databases: {attached_dbs}")
-    except Exception as e:
-        print(f"Error checking attached databases: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                if generation == self._generation:
+                    self._idle.append((generation, conn))
+                    return
+            conn.close()
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager yielding a pooled connection."""
+        generation, conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(generation, conn)
+
+    def close_all(self):
+        """Close every idle connection; busy ones are closed when released."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._generation += 1
+            self._db_files = None
+        for _, conn in idle:
+            conn.close()
+
+_pool = None
+_pool_lock = threading.Lock()
 
+def get_pool():
+    """Process-wide connection pool, created on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+                atexit.register(_pool.close_all)
+    return _pool
+
+def pooled_connection():
+    """Shortcut for get_pool().connection()."""
+    return get_pool().connection()
+
+def connect_sqlite():
+    """
+    Connect to a primary database and attach additional databases found in the directory.
+    Returns an unpooled connection and cursor with other databases attached read-only.
+    Prefer pooled_connection() on hot paths; the caller owns and must close this one.
+    """
+    db_files = find_db_files(DB_DIRECTORY)
+    if not db_files:
+        raise Exception(f"No database files found in {os.path.abspath(DB_DIRECTORY)}")
+    conn = _open_connection(db_files)
+    cursor = conn.cursor()
     return conn, cursor
 
 if __name__ == "__main__":
     conn, cursor = connect_sqlite()
+    cursor.execute("PRAGMA database_list;")
+    print(f"Attached databases: {cursor.fetchall()}")
     conn.close()
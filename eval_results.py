@@ -0,0 +1,244 @@
+"""
+Results store for LLM evaluation runs.
+
+One row per (run, task, model) call with its latency and token counts, kept in
+a local SQLite file so interactive runs, batch runs and later analysis all read
+and write the same table. Batch runs also keep one row per submitted provider
+batch, so an interrupted sweep knows what it already sent. Graders' scores for
+answers (0 to 1, higher is better) go in a scores table keyed like the results;
+model_router.py reads them as each model's quality per task type.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from utils.stats import percentile
+
+RESULTS_PATH = os.path.join("logs", "eval_results.sqlite")
+
+COLUMNS = (
+    "run_id", "task_id", "task_type", "provider", "model", "mode",
+    "started_at", "wall_s", "ttft_s", "prompt_tokens", "completion_tokens",
+    "cache_hit", "ok", "error", "response", "extra",
+)
+
+BATCH_COLUMNS = ("batch_id", "run_id", "provider", "status", "submitted_at", "ended_at", "requests")
+BATCH_DONE = ("ingested", "failed")     # batch statuses that need no more polling
+
+SCORE_COLUMNS = ("run_id", "task_id", "provider", "model", "grader", "score", "scored_at")
+
+class ResultsStore:
+    """Thread-safe writer/reader over the eval results table."""
+
+    def __init__(self, path=RESULTS_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " run_id TEXT, task_id TEXT, task_type TEXT, provider TEXT, model TEXT, mode TEXT,"
+            " started_at REAL, wall_s REAL, ttft_s REAL, prompt_tokens INTEGER, completion_tokens INTEGER,"
+            " cache_hit INTEGER, ok INTEGER, error TEXT, response TEXT, extra TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_model_type ON results(model, task_type)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_run ON results(run_id, task_id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batches ("
+            " batch_id TEXT PRIMARY KEY, run_id TEXT, provider TEXT, status TEXT,"
+            " submitted_at REAL, ended_at REAL, requests TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " run_id TEXT, task_id TEXT, provider TEXT, model TEXT, grader TEXT, score REAL, scored_at REAL,"
+            " PRIMARY KEY (run_id, task_id, provider, model, grader))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _row(result):
+        row = {name: result.get(name) for name in COLUMNS}
+        extra = {k: v for k, v in result.items() if k not in COLUMNS}
+        if extra:
+            row["extra"] = json.dumps(extra, default=str)
+        row["started_at"] = row["started_at"] or time.time()
+        return [row[name] for name in COLUMNS]
+
+    def _insert(self, results):
+        self._conn.executemany(
+            f"INSERT INTO results ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+            [self._row(result) for result in results],
+        )
+
+    def record(self, result):
+        """Insert one result dict; unknown keys go into the JSON 'extra' column."""
+        with self._lock:
+            self._insert([result])
+            self._conn.commit()
+
+    def record_batch(self, run_id, provider, batch_id, requests, status="submitted"):
+        """
+        Remember a submitted provider batch. requests maps each custom_id in it
+        to the (task_id, task_type, model) it answers.
+        """
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO batches ({', '.join(BATCH_COLUMNS)}) VALUES (?, ?, ?, ?, ?, NULL, ?)",
+                (batch_id, run_id, provider, status, time.time(), json.dumps(requests)),
+            )
+            self._conn.commit()
+
+    def batches(self, run_id, pending_only=False):
+        """Batch rows of a run as dicts (requests decoded), oldest first."""
+        query = f"SELECT {', '.join(BATCH_COLUMNS)} FROM batches WHERE run_id = ?"
+        if pending_only:
+            query += f" AND status NOT IN ({', '.join('?' for _ in BATCH_DONE)})"
+        with self._lock:
+            cursor = self._conn.execute(query + " ORDER BY submitted_at",
+                                        (run_id, *BATCH_DONE) if pending_only else (run_id,))
+            rows = [dict(zip(BATCH_COLUMNS, row)) for row in cursor.fetchall()]
+        for row in rows:
+            row["requests"] = json.loads(row["requests"])
+        return rows
+
+    def set_batch_status(self, batch_id, status):
+        with self._lock:
+            self._conn.execute("UPDATE batches SET status = ? WHERE batch_id = ?", (status, batch_id))
+            self._conn.commit()
+
+    def ingest_batch(self, batch_id, results, status="ingested"):
+        """Insert a finished batch's results and mark it done in one transaction, so a crash cannot ingest twice."""
+        with self._lock, self._conn:
+            self._insert(results)
+            self._conn.execute("UPDATE batches SET status = ?, ended_at = ? WHERE batch_id = ?",
+                               (status, time.time(), batch_id))
+
+    def record_scores(self, scores):
+        """
+        Insert or replace graders' scores. Each dict needs run_id, task_id,
+        provider, model and score (0 to 1); grader defaults to "human".
+        """
+        rows = [(s["run_id"], s["task_id"], s["provider"], s["model"], s.get("grader") or "human",
+                 float(s["score"]), s.get("scored_at") or time.time()) for s in scores]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO scores ({', '.join(SCORE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def quality(self, since=None):
+        """{(task_type, provider, model): (mean score, number of scores)} over scores given since `since`."""
+        query = (
+            "SELECT r.task_type, s.provider, s.model, AVG(s.score), COUNT(*) FROM scores s"
+            " JOIN (SELECT DISTINCT run_id, task_id, provider, model, task_type FROM results) r"
+            " ON r.run_id = s.run_id AND r.task_id = s.task_id AND r.provider = s.provider AND r.model = s.model"
+        )
+        params = ()
+        if since is not None:
+            query += " WHERE s.scored_at >= ?"
+            params = (since,)
+        with self._lock:
+            cursor = self._conn.execute(query + " GROUP BY r.task_type, s.provider, s.model", params)
+            return {(task_type, provider, model): (mean, count) for task_type, provider, model, mean, count in cursor}
+
+    def fetch(self, run_id=None, model=None, task_type=None, since=None, columns=COLUMNS):
+        """Return result rows as dicts, optionally filtered and limited to some columns."""
+        clauses, params = [], []
+        for column, value in (("run_id", run_id), ("model", model), ("task_type", task_type)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("started_at >= ?")
+            params.append(since)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT {', '.join(columns)} FROM results{where} ORDER BY started_at", params)
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def completed_tasks(self, run_id, include_failed=False):
+        """(task_id, provider, model) triples that already succeeded (or, with include_failed, ran at all) in a run."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT task_id, provider, model FROM results WHERE run_id = ?" + ("" if include_failed else " AND ok = 1"),
+                (run_id,)
+            )
+            return set(cursor.fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def summarize(rows):
+    """
+    Per-(provider, model) latency percentiles (of calls not answered from the
+    response cache), error rate, token and retry
+    totals, and input tokens served from the provider's prompt cache with the
+    median time-to-first-token of calls that did and did not hit it.
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["provider"], row["model"]), []).append(row)
+    summary = []
+    for (provider, model), group in sorted(groups.items()):
+        # Response-cache hits return in milliseconds; keep them out of the latency figures
+        measured = [r for r in group if r["ok"] and not r["cache_hit"]]
+        walls = [r["wall_s"] for r in measured]
+        extras = [json.loads(r["extra"]) if r["extra"] else {} for r in group]
+        prefix_hit = [bool(extra.get("cached_tokens")) for extra in extras]
+        summary.append({
+            "provider": provider,
+            "model": model,
+            "calls": len(group),
+            "errors": sum(1 for r in group if not r["ok"]),
+            "error_rate": sum(1 for r in group if not r["ok"]) / len(group),
+            "wall_p50": percentile(walls, 50),
+            "wall_p95": percentile(walls, 95),
+            "ttft_p50": percentile([r["ttft_s"] for r in measured], 50),
+            "prompt_tokens": sum(r["prompt_tokens"] or 0 for r in group),
+            "completion_tokens": sum(r["completion_tokens"] or 0 for r in group),
+            "cache_hits": sum(1 for r in group if r["cache_hit"]),
+            "retries": sum(extra.get("retries", 0) for extra in extras),
+            "cached_tokens": sum(extra.get("cached_tokens", 0) for extra in extras),
+            "prompt_cache_hits": sum(prefix_hit),
+            "ttft_p50_prompt_cached": percentile([r["ttft_s"] for r, hit in zip(group, prefix_hit) if r["ok"] and hit], 50),
+            "ttft_p50_uncached": percentile([r["ttft_s"] for r, hit in zip(group, prefix_hit)
+                                             if r["ok"] and not hit and not r["cache_hit"]], 50),
+        })
+    return summary
+
+def summarize_hedging(rows, baseline_rows):
+    """
+    Per hedging primary: hedge rate, backup wins and wall-time percentiles of
+    the hedged calls in rows, next to the primary model's unhedged calls in
+    baseline_rows and the latency the hedging saved at each percentile.
+    """
+    groups = {}
+    for row in rows:
+        if row["mode"] == "hedged":
+            extra = json.loads(row["extra"]) if row["extra"] else {}
+            groups.setdefault(extra.get("primary"), []).append((row, extra))
+    summary = []
+    for primary, group in sorted(groups.items(), key=lambda item: str(item[0])):
+        provider, _, model = (primary or "").partition("/")
+        baseline = [r["wall_s"] for r in baseline_rows
+                    if r["ok"] and r["provider"] == provider and r["model"] == model and r["mode"] == "interactive"]
+        walls = [r["wall_s"] for r, _ in group if r["ok"]]
+        entry = {
+            "primary": primary,
+            "calls": len(group),
+            "hedge_rate": sum(1 for _, extra in group if extra.get("hedged")) / len(group),
+            "failovers": sum(1 for _, extra in group if extra.get("failover")),
+            "backup_wins": sum(1 for _, extra in group if extra.get("winner") == "backup"),
+            "baseline_calls": len(baseline),
+        }
+        for q in (50, 95, 99):
+            hedged, unhedged = percentile(walls, q), percentile(baseline, q)
+            entry[f"wall_p{q}"] = hedged
+            entry[f"baseline_p{q}"] = unhedged
+            entry[f"saved_p{q}"] = unhedged - hedged if hedged is not None and unhedged is not None else None
+        summary.append(entry)
+    return summary
@@ -0,0 +1,156 @@
+"""
+Compact, token-budgeted description of a DataFrame for prompts.
+
+A result table is never inlined into a prompt. Instead the model gets its
+shape, the dtype and null count of every column, summary statistics for the
+numeric and datetime columns (computed in one vectorized pass), cardinality
+and top values for the text columns, and a small sample stratified on the
+lowest-cardinality text column. If that does not fit the token budget, the
+sample, then the top values, then the listed columns are cut down until it
+does. Whoever needs the rows themselves gets them through frame_file().
+"""
+import io
+
+import numpy as np
+import pandas as pd
+
+from schema_index import estimate_tokens
+
+TOKEN_BUDGET = 1200         # approximate prompt tokens for one table summary
+SAMPLE_ROWS = 20            # rows in the sample before budget cuts
+TOP_VALUES = 5              # most frequent values listed per text column
+MAX_STRATA = 50             # text columns with more distinct values are not used to stratify
+MAX_CELL_CHARS = 40         # text cells are cut to this length in the sample
+
+def _is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def _format_number(value):
+    if value is None or pd.isna(value):
+        return "null"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return f"{value:.4g}"
+
+def column_stats(df):
+    """
+    Per-column statistics as {column: dict}. Numeric quantiles, means, null and
+    distinct counts are each computed across all columns at once.
+    """
+    nulls = df.isna().sum()
+    numeric = [c for c in df.columns if _is_numeric(df[c])]
+    dates = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    text = [c for c in df.columns if c not in numeric and c not in dates]
+
+    stats = {c: {"dtype": str(df[c].dtype), "nulls": int(nulls[c])} for c in df.columns}
+    if numeric:
+        quantiles = df[numeric].quantile([0, 0.25, 0.5, 0.75, 1])
+        means = df[numeric].mean()
+        for c in numeric:
+            q = quantiles[c].tolist()
+            stats[c].update(kind="numeric", min=q[0], p25=q[1], median=q[2], p75=q[3], max=q[4], mean=means[c])
+    if dates:
+        lows, highs = df[dates].min(), df[dates].max()
+        for c in dates:
+            stats[c].update(kind="datetime", min=lows[c], max=highs[c])
+    if text:
+        distinct = df[text].nunique()
+        for c in text:
+            counts = df[c].value_counts().head(TOP_VALUES)
+            stats[c].update(kind="text", distinct=int(distinct[c]),
+                            top=[(str(v)[:MAX_CELL_CHARS], n) for v, n in zip(counts.index.tolist(), counts.tolist())])
+    return stats
+
+def stratify_column(df, stats):
+    """Text column with the fewest distinct values (at least two, at most MAX_STRATA), or None."""
+    candidates = [(s["distinct"], c) for c, s in stats.items()
+                  if s.get("kind") == "text" and 2 <= s["distinct"] <= MAX_STRATA]
+    return min(candidates, key=lambda item: item[0])[1] if candidates else None
+
+def stratified_sample(df, rows, column=None, seed=0):
+    """
+    Up to rows rows. With a column, every value of it is represented in
+    proportion to its frequency (at least one row each, as far as rows allows);
+    without one, rows are evenly spaced through the table. Original order is kept.
+    """
+    if rows <= 0 or df.empty:
+        return df.iloc[:0]
+    if len(df) <= rows:
+        return df
+    if column is None:
+        return df.iloc[np.unique(np.linspace(0, len(df) - 1, rows).astype(int))]
+    shuffled = np.random.default_rng(seed).permutation(len(df))
+    keys = df[column].astype("object").iloc[shuffled]
+    position = keys.groupby(keys, dropna=False).cumcount().to_numpy()
+    sizes = keys.map(keys.value_counts(dropna=False)).fillna(keys.isna().sum()).to_numpy()
+    quota = np.maximum(1, np.round(sizes * rows / len(df)))
+    chosen = shuffled[position < quota]
+    # Round-robin over the strata when the minimum of one row each overshoots
+    chosen = chosen[np.argsort(position[position < quota], kind="stable")][:rows]
+    return df.iloc[np.sort(chosen)]
+
+def _column_line(column, stat, top_values):
+    line = f"- {column} ({stat['dtype']}, {stat['nulls']} null)"
+    if stat.get("kind") == "numeric":
+        line += (f": min {_format_number(stat['min'])}, p25 {_format_number(stat['p25'])}, "
+                 f"median {_format_number(stat['median'])}, p75 {_format_number(stat['p75'])}, "
+                 f"max {_format_number(stat['max'])}, mean {_format_number(stat['mean'])}")
+    elif stat.get("kind") == "datetime":
+        line += f": {stat['min']} to {stat['max']}"
+    elif stat.get("kind") == "text":
+        line += f": {stat['distinct']} distinct"
+        if top_values and stat["top"]:
+            line += "; top " + ", ".join(f"{v} ({n})" for v, n in stat["top"][:top_values])
+    return line
+
+def _clip_cells(sample):
+    """Sample with long text cells cut to MAX_CELL_CHARS."""
+    sample = sample.copy()
+    for column in sample.columns:
+        if not _is_numeric(sample[column]):
+            sample[column] = sample[column].astype("object").map(
+                lambda v: v if v is None or pd.isna(v) else str(v)[:MAX_CELL_CHARS])
+    return sample
+
+def _render(df, stats, columns, top_values, sample, stratum, data_name):
+    header = f"{len(df)} rows x {len(df.columns)} columns"
+    if data_name:
+        header += f" (the full table is in {data_name})"
+    lines = [header, "Columns:"]
+    lines += [_column_line(c, stats[c], top_values) for c in columns]
+    if len(columns) < len(df.columns):
+        lines.append(f"- ... {len(df.columns) - len(columns)} more: {', '.join(map(str, df.columns[len(columns):]))}")
+    if len(sample):
+        how = f"stratified by {stratum}" if stratum else "evenly spaced"
+        lines += [f"Sample ({len(sample)} rows, {how}):", sample[columns].to_csv(index=False, float_format="%.6g").strip()]
+    return "\n".join(lines)
+
+def summarize_frame(df, token_budget=TOKEN_BUDGET, sample_rows=SAMPLE_ROWS, data_name=None):
+    """
+    Prompt text describing df within about token_budget tokens. data_name, if
+    given, tells the model where the full table is (an attached file name).
+    """
+    stats = column_stats(df)
+    stratum = stratify_column(df, stats)
+    full_sample = _clip_cells(stratified_sample(df, sample_rows, stratum))
+    columns, top_values, rows = list(df.columns), TOP_VALUES, len(full_sample)
+    while True:
+        sample = stratified_sample(full_sample, rows, stratum) if rows < len(full_sample) else full_sample
+        text = _render(df, stats, columns, top_values, sample, stratum, data_name)
+        if estimate_tokens(text) <= token_budget:
+            return text
+        # Cut the least useful detail first: sample rows, then top values, then columns
+        if rows > 0:
+            rows = rows // 2
+        elif top_values > 0:
+            top_values = top_values // 2
+        elif len(columns) > 1:
+            columns = columns[:len(columns) // 2]
+        else:
+            return text
+
+def frame_file(df, name="data.csv"):
+    """The full DataFrame as an in-memory CSV file, as (name, bytes) ready for an upload."""
+    buffer = io.BytesIO()
+    df.to_csv(buffer, index=False)
+    return name, buffer.getvalue()
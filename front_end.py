@@ -1,21 +1,248 @@
 import os
-import pandas as pd
-from openai import OpenAI
+import io
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+from llms.clients import get_openai_client
 import streamlit as st
-import matplotlib.pyplot as plt
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from dotenv import load_dotenv
-from util import read_json, get_schema_and_table_list, execute_function_call, visualise, extract_SQL
+from util import visualise, extract_SQL
+from run_sql import CancelToken, QueryError, cancel_scope
+from utils import span, capture, configure_logging, preload
+from utils.tracing import waterfall_figure, waterfall_rows
+from settings import get_info
+from model_router import model_override, routing_config
 
 # Load environment variables from .env file
 load_dotenv()
+configure_logging()
 
 dirname = os.path.dirname(os.path.abspath(__file__))
 config_path = os.path.join(dirname, 'config')
 log_path = os.path.join(dirname, 'logs')
 
-# Initialize schema and info
-final_schema, tables = get_schema_and_table_list(config_path)
-info = read_json(os.path.join(config_path, 'info.json'))
+# Streamlit re-runs this script on every interaction; answers and charts are cached so that only a new question does work
+ANSWER_CACHE_ENTRIES = 32       # answered questions kept in memory for all sessions
+ANSWER_TTL = 6 * 3600           # seconds before an answered question is asked again
+CHART_CACHE_ENTRIES = 64        # rendered charts kept in memory for all sessions
+AUTO_MODEL = "Auto"             # model choice that leaves each call to the router
+
+@st.cache_resource(show_spinner=False)
+def load_resources(api_key):
+    """
+    Objects shared by every session and rerun: the OpenAI client, the SQLite
+    connection pool and the schema catalog, built on the first script run.
+    """
+    from db_connection import get_pool
+    from schema_catalog import get_catalog
+    catalog = get_catalog()
+    catalog.refresh()
+    return get_openai_client(api_key), get_pool(), catalog
+
+@st.cache_resource(show_spinner=False)
+def shared_answers():
+    """Finished answers for every session: ({key: (finished_at, answer)} in least-recently-used order, lock)."""
+    return OrderedDict(), threading.Lock()
+
+def question_key(question, model=None):
+    """An answer is reused while the question text, the chosen model and the database files are unchanged."""
+    from query_cache import db_fingerprint
+    return " ".join(question.split()), model, db_fingerprint()
+
+def cached_answer(key):
+    answers, lock = shared_answers()
+    with lock:
+        entry = answers.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > ANSWER_TTL:
+            del answers[key]
+            return None
+        answers.move_to_end(key)
+        return entry[1]
+
+def store_answer(key, answer):
+    answers, lock = shared_answers()
+    with lock:
+        answers[key] = (time.time(), answer)
+        answers.move_to_end(key)
+        while len(answers) > ANSWER_CACHE_ENTRIES:
+            answers.popitem(last=False)
+
+def forget_answers(key=None):
+    """Drop one question's answer (this session's and the shared one), or every answer."""
+    answers, lock = shared_answers()
+    with lock:
+        if key is None:
+            answers.clear()
+        else:
+            answers.pop(key, None)
+    current = st.session_state.get("answer")
+    if current is not None and (key is None or current[0] == key):
+        del st.session_state["answer"]
+
+def lookup_answer(key):
+    """(answer, "session" or "shared") for a question that was already answered, else (None, None)."""
+    current = st.session_state.get("answer")
+    if current is not None and current[0] == key:
+        return current[1], "session"
+    answer = cached_answer(key)
+    if answer is not None:
+        st.session_state["answer"] = (key, answer)
+        return answer, "shared"
+    return None, None
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def chart_for(key, visual_request, _df):
+    """PNG bytes (None if drawing failed) and the trace of drawing one answer's chart for one visual request."""
+    with capture() as spans, span("chart", request=visual_request):
+        png = None
+        fig = visualise(_df, visual_request)
+        if fig is not None:
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format="png", bbox_inches="tight")
+            png = buffer.getvalue()
+    return png, spans
+
+def run_cancellable(fn, *args, status=None, **kwargs):
+    """
+    Run fn in a worker thread under a fresh CancelToken while this script run waits.
+    Streamlit stops an abandoned run (new question, Stop button) at its next st call,
+    so waiting here with status updates is what lets the running SQL be cancelled.
+    The worker runs in a copy of this context so its trace spans nest under ours.
+    """
+    token = CancelToken()
+    st.session_state["cancel_token"] = token
+    outcome = {}
+
+    def work():
+        with cancel_scope(token):
+            try:
+                outcome["value"] = fn(*args, **kwargs)
+            except Exception as e:
+                outcome["error"] = e
+
+    context = contextvars.copy_context()
+    worker = threading.Thread(target=context.run, args=(work,), daemon=True)
+    add_script_run_ctx(worker, get_script_run_ctx())
+    started = time.perf_counter()
+    worker.start()
+    try:
+        shown = -1
+        while worker.is_alive():
+            worker.join(0.25)
+            elapsed = int(time.perf_counter() - started)
+            if status is not None and elapsed != shown:
+                status.info(f"Working... {elapsed}s")
+                shown = elapsed
+    finally:
+        if worker.is_alive():
+            token.cancel()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("value")
+
+def answer_question(question, status, sql_preview):
+    """
+    Run the question -> SQL -> DataFrame pipeline, streaming the SQL into
+    sql_preview as it is written. Returns the answer as a dict.
+    """
+    started = time.perf_counter()
+    first_output = []
+
+    def show_partial(text):
+        if not first_output:
+            first_output.append(time.perf_counter() - started)
+        sql_preview.code(text)
+
+    answer = {"df": None, "error": None}
+    with capture() as spans, span("question", question=question):
+        try:
+            answer["df"] = run_cancellable(extract_SQL, [question], on_delta=show_partial, status=status)
+        except QueryError as e:
+            answer["error"] = e
+    answer.update(first_output_s=first_output[0] if first_output else None,
+                  data_s=time.perf_counter() - started, spans=spans)
+    return answer
+
+def show_timing_waterfall(title, spans):
+    import pandas as pd
+    st.write(f"### Timing: {title}")
+    st.pyplot(waterfall_figure(spans))
+    st.dataframe(pd.DataFrame(
+        [("  " * depth + name, offset, wall, cpu, attrs) for depth, name, offset, wall, cpu, attrs in waterfall_rows(spans)],
+        columns=["step", "start_s", "wall_s", "cpu_s", "attributes"]))
+
+def show_answer(key, answer, visual_request, show_timing, source=None):
+    """Display an answer and its chart; both come from the caches when this question was seen before."""
+    import pandas as pd
+    if source == "shared":
+        st.caption("Answered earlier; use Ask again in the sidebar to run it from scratch.")
+    elif answer["first_output_s"] is not None:
+        st.caption(f"First output after {answer['first_output_s']:.2f}s, data after {answer['data_s']:.2f}s")
+    query_error, df = answer["error"], answer["df"]
+    chart_spans = []
+    if query_error is not None:
+        st.error(f"The query could not be run ({query_error.kind}): {query_error}")
+        st.code(query_error.sql_query, language="sql")
+    elif isinstance(df, pd.DataFrame) and not df.empty:
+        st.write("### Data Table")
+        if df.attrs.get("truncated"):
+            st.warning(f"Showing the first {len(df):,} rows; the full result was larger and was not loaded.")
+        if df.attrs.get("cost_warning"):
+            st.warning(df.attrs["cost_warning"])
+        st.write(df)
+        with st.spinner("Drawing chart..."):
+            png, chart_spans = chart_for(key, visual_request, df)
+        if png is not None:
+            st.write("### Chart")
+            st.image(png)
+        else:
+            st.error("Chart generation failed.")
+    else:
+        st.error("No data returned or the data format is incorrect.")
+    if show_timing:
+        for title, spans in (("question", answer["spans"]), ("chart", chart_spans)):
+            if spans:
+                show_timing_waterfall(title, spans)
+
+def ask_again(key, visual_request):
+    forget_answers(key)
+    chart_for.clear(key, visual_request)
+
+def clear_cached_results():
+    from query_cache import get_query_cache
+    forget_answers()
+    chart_for.clear()
+    get_query_cache().clear()
+
+def reload_databases():
+    """Pick up new or changed database files: rebuild the schema catalog and reopen connections."""
+    _, pool, catalog = load_resources(os.getenv('OPENAI_API_KEY'))
+    clear_cached_results()
+    pool.close_all()
+    catalog.refresh(force=True)
+    load_resources.clear()
+
+def cache_controls(key, visual_request):
+    st.sidebar.write("### Cached results")
+    if key is not None:
+        st.sidebar.button("Ask again", on_click=ask_again, args=(key, visual_request),
+                          help="Forget this question's answer and chart and run it from scratch")
+    st.sidebar.button("Clear all cached results", on_click=clear_cached_results,
+                      help="Forget every answer, chart and query result held in memory")
+    st.sidebar.button("Reload databases", on_click=reload_databases,
+                      help="Re-read the schema and reopen connections after changing the files in db/")
+
+def model_choice(info):
+    """Sidebar choice of the model for every call, or None to let the router pick per task."""
+    models = [entry["model"] for entry in (routing_config(info) or {}).get("models", []) if entry["provider"] == "openai"]
+    st.sidebar.write("### Model")
+    choice = st.sidebar.selectbox("Model", [AUTO_MODEL] + models, label_visibility="collapsed",
+                                  help="Auto picks the cheapest model good enough for each step")
+    return None if choice == AUTO_MODEL else choice
 
 def main():
     openai_api_key = os.getenv('OPENAI_API_KEY')
@@ -29,9 +256,9 @@ def main():
         else:
             return
 
-    openai_client = OpenAI(api_key=openai_api_key)
+    openai_client, pool, catalog = load_resources(openai_api_key)
+    info = get_info(config_path)
     INSTRUCTION = info.get('DB_instructions')
-    GPT_MODEL = info.get('GPT_MODEL')
     VISUAL_INSTRUCTIONS = info.get('Visual_Builder')
 
     st.title("Galen: Data Analysis for Oncology")
@@ -40,6 +267,8 @@ def main():
     run_queries = st.checkbox("Run DB queries", value=False)
     ask_research_questions = st.checkbox("Ask questions of your research papers", value=False)
     run_evaluation = st.checkbox("Run an evaluation", value=False)
+    # Import the table and chart stack while the user is still typing
+    preload("pandas", "chart_renderer")
 
     # Depending on which checkbox is checked, display corresponding input fields and outputs
     if run_queries:
@@ -47,21 +276,37 @@ def main():
         with col1:  # Input column for DB queries
             user_text_query = st.text_input("What are you curious about in the data?", key="db_query")
             user_visual_type_query = st.text_input("How do you want to visualize the data?", key="visual_type")
+            show_timing = st.checkbox("Show timing waterfall", value=False, key="show_timing")
+
+        question = (user_text_query, user_visual_type_query)
+        model = model_choice(info)
+        key = question_key(user_text_query, model) if user_text_query else None
+        cache_controls(key, user_visual_type_query)
+
+        def stop_query():
+            st.session_state["stopped_question"] = question
+            token = st.session_state.get("cancel_token")
+            if token is not None:
+                token.cancel()
 
-        if user_text_query and user_visual_type_query:
-            user_prompt = [user_text_query]
-            df_returned = extract_SQL(user_prompt)
-            if isinstance(df_returned, pd.DataFrame) and not df_returned.empty:
-                st.write("### Data Table")
-                st.write(df_returned)
-                chart = visualise(df_returned)
-                if chart is not None:
-                    st.write("### Chart")
-                    st.pyplot(chart)
-                else:
-                    st.error("Chart generation failed.")
-            else:
-                st.error("No data returned or the data format is incorrect.")
+        if user_text_query and user_visual_type_query and st.session_state.get("stopped_question") == question:
+            st.info("Query stopped. Change the question to run it again.")
+        elif user_text_query and user_visual_type_query:
+            answer, source = lookup_answer(key)
+            if answer is None:
+                status = st.empty()
+                status.info("Writing SQL...")
+                st.button("Stop query", on_click=stop_query)
+                sql_preview = st.empty()
+                with model_override(model):
+                    answer = answer_question(user_text_query, status, sql_preview)
+                status.empty()
+                # The session keeps failed answers too, so a checkbox tick does not re-run them
+                st.session_state["answer"] = (key, answer)
+                if answer["error"] is None and answer["df"] is not None:
+                    store_answer(key, answer)
+            with model_override(model):
+                show_answer(key, answer, user_visual_type_query, show_timing, source)
 
     if ask_research_questions:
         # Input for research paper questions
@@ -77,7 +322,7 @@ def main():
 
     # Buttons for user interaction
     if st.button("Ask another question"):
-        st.experimental_rerun()
+        st.rerun()
     elif st.button("Exit"):
         st.stop()
 
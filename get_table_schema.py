@@ -5,48 +5,41 @@ import os
 import glob
 import sqlite3
 import json
-from sqlalchemy import create_engine, MetaData, Table, Column, String
 import re
 import logging
 
-logging.basicConfig(level=logging.WARNING)
-log = logging.getLogger(__name__)
+from utils import configure_logging
 
-def combine_schemas(db_files):
-    combined_schema = {}
+log = logging.getLogger(__name__)
 
-    for db_file in db_files:
-        engine = create_engine('sqlite:///' + db_file)
-        print(db_file)
+def introspect_database(db_file, conn=None):
+    """
+    Return {"<table> in <db_file>": [{"column_name", "data_type"}, ...]} for one database,
+    keeping each column's declared SQLite type.
+    """
+    own_conn = conn is None
+    if own_conn:
         conn = sqlite3.connect(db_file)
+    schema = {}
+    try:
         cursor = conn.cursor()
-
-        # Get all tables
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-
-        for table in tables:
-            table_name = table[0]
-            metadata_obj = MetaData()
-            
-            # Get table schema
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            schema = cursor.fetchall()
-
-            # Create a Table object to store schema info
-            table_obj = Table(table_name, metadata_obj)
-
-            for column in schema:
-                col_name, col_type = column[1], column[2]
-                # Add column to the table object
-                table_obj.append_column(Column(col_name, String))
-
-            # Serialize table schema
-            schema_info = [{"column_name": col.name, "data_type": str(col.type)} for col in table_obj.columns]
-            combined_schema[f"{table_name} in {db_file}"] = schema_info
-
-        conn.close()
+        for (table_name,) in cursor.fetchall():
+            cursor.execute(f'PRAGMA table_info("{table_name}");')
+            schema[f"{table_name} in {db_file}"] = [
+                {"column_name": column[1], "data_type": column[2] or "BLOB"} for column in cursor.fetchall()
+            ]
+        cursor.close()
+    finally:
+        if own_conn:
+            conn.close()
+    return schema
 
+def combine_schemas(db_files):
+    combined_schema = {}
+    for db_file in db_files:
+        log.info("Reading schema from %s", db_file)
+        combined_schema.update(introspect_database(db_file))
     return combined_schema
 
 def save_schema_to_json(combined_schema, filename="config/combined_schema.json"):
@@ -56,18 +49,17 @@ def save_schema_to_json(combined_schema, filename="config/combined_schema.json")
 # SQL check
 def extract_sql(llm_response: str) -> str:
     # If the llm_response contains a markdown code block, with or without the sql tag, extract the sql from it
-    print(f"The original llm response is: {llm_response}")
     sql = re.search(r"```sql\n(.*)```", llm_response, re.DOTALL)
-    print(f"The SQL query that's extracted is: {sql}")
     if sql:
-        log.info(f"Output from LLM: {llm_response} \nExtracted SQL: {sql.group(1)}")
+        log.debug("Output from LLM: %s \nExtracted SQL: %s", llm_response, sql.group(1))
         return sql.group(1)
 
     sql = re.search(r"```(.*)```", llm_response, re.DOTALL)
     if sql:
-        log.info(f"Output from LLM: {llm_response} \nExtracted SQL: {sql.group(1)}")
+        log.debug("Output from LLM: %s \nExtracted SQL: %s", llm_response, sql.group(1))
         return sql.group(1)
 
+    log.debug("No SQL found in LLM response: %s", llm_response)
     return sql
 
 def is_sql_valid(sql: str) -> bool:
@@ -80,6 +72,7 @@ def is_sql_valid(sql: str) -> bool:
         return False
 
 if __name__ == '__main__':
+    configure_logging()
     db_directory = "db/"
     db_files = glob.glob(os.path.join(db_directory, "*.db"))
     # db_files = ["db/DepExprDB.db"]
@@ -0,0 +1,257 @@
+"""
+Index advisor for the attached databases, driven by the query log.
+
+Replays every distinct logged SELECT through EXPLAIN QUERY PLAN, picks out
+full-table SCAN steps (and automatic indexes SQLite has to build on every run)
+on large tables, and proposes a covering index for each: equality columns
+first, then one range column, then GROUP BY / ORDER BY columns, then the other
+columns the query reads. Queries that want the same index share one proposal.
+With --build the indexes are created, either in the db/*.db files themselves
+or in sidecar copies, and the affected queries are timed before and after.
+
+    python index_advisor.py                      # propose only
+    python index_advisor.py --build              # create the indexes in db/*.db
+    python index_advisor.py --build --sidecar db_indexed/
+"""
+import os
+import re
+import sys
+import csv
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+
+from db_connection import find_db_files, connect_sqlite, _open_connection
+from schema_catalog import get_catalog
+from query_plan import plan_steps, table_aliases, tables_by_db
+from query_cache import normalize_sql
+from query_log import read_entries, LOG_PATH
+
+LEGACY_LOG_PATH = os.path.join("logs", "query_log.csv")
+MIN_ROWS = 10000            # tables smaller than this are not worth indexing
+MAX_INDEX_COLUMNS = 6       # beyond this the index stops being covering
+TIMING_REPEATS = 3          # best-of runs when timing a query
+
+_CLAUSE = re.compile(r"\b(WHERE|GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT|ON)\b", re.IGNORECASE)
+
+def logged_queries(log_path=LOG_PATH, legacy_path=LEGACY_LOG_PATH):
+    """
+    Distinct successful SELECTs from the query log (and the old CSV log, if one
+    is still around), as {normalized_sql: {"sql": text, "count": n}}.
+    """
+    queries = {}
+
+    def add(sql_query):
+        if not sql_query or not normalize_sql(sql_query).startswith(("SELECT", "WITH")):
+            return
+        entry = queries.setdefault(normalize_sql(sql_query), {"sql": sql_query.strip(), "count": 0})
+        entry["count"] += 1
+
+    for entry in read_entries(log_path):
+        if not entry.get("error"):
+            add(entry.get("sql"))
+    if legacy_path and os.path.exists(legacy_path):
+        csv.field_size_limit(sys.maxsize)
+        with open(legacy_path, newline="", encoding="utf-8") as file:
+            for row in csv.DictReader(file):
+                add(row.get("Query"))
+    return queries
+
+def _clauses(sql_query):
+    """Split a query into {clause keyword: [text, ...]} for WHERE, ON, GROUP BY, ORDER BY, ..."""
+    parts = _CLAUSE.split(sql_query)
+    clauses = {"SELECT": [parts[0]]}
+    for keyword, text in zip(parts[1::2], parts[2::2]):
+        clauses.setdefault(re.sub(r"\s+", " ", keyword.upper()), []).append(text)
+    return clauses
+
+def _column_refs(text, columns, names):
+    """Columns of one table referenced in text, bare or qualified by one of its names, in order."""
+    refs = []
+    for qualifier, column in re.findall(r'(?:"?(\w+)"?\s*\.\s*)?"?(\w+)"?', text):
+        if column in columns and (not qualifier or qualifier in names) and column not in refs:
+            refs.append(column)
+    return refs
+
+def propose_index(sql_query, table, db_file, columns, names, automatic_columns=()):
+    """
+    Index columns for one table in one query: (key_columns, include_columns).
+    key_columns is empty when no predicate or ordering on the table could use an index.
+    """
+    clauses = _clauses(sql_query)
+    equality, ranges = list(automatic_columns), []
+    for text in clauses.get("WHERE", []) + clauses.get("ON", []):
+        for predicate in re.split(r"\bAND\b|\bOR\b", text, flags=re.IGNORECASE):
+            refs = _column_refs(predicate, columns, names)
+            if re.search(r"(?<![<>!])==?|\bIN\s*\(|\bIS\b", predicate, re.IGNORECASE):
+                equality += refs
+            elif re.search(r"[<>]|\bBETWEEN\b|\bLIKE\b|\bGLOB\b", predicate, re.IGNORECASE):
+                ranges += refs
+    ordering = []
+    for keyword in ("GROUP BY", "ORDER BY"):
+        for text in clauses.get(keyword, []):
+            ordering += _column_refs(text, columns, names)
+
+    key = list(dict.fromkeys(equality))
+    key += [c for c in ranges[:1] if c not in key]
+    if not ranges:
+        key += [c for c in dict.fromkeys(ordering) if c not in key]
+    if not key:
+        return [], []
+    selects_all = re.search(r"SELECT\s+(?:DISTINCT\s+)?(?:\w+\.)?\*", sql_query, re.IGNORECASE)
+    include = [] if selects_all else [c for c in _column_refs(sql_query, columns, names) if c not in key]
+    if len(key) + len(include) > MAX_INDEX_COLUMNS:
+        include = []
+    return key[:MAX_INDEX_COLUMNS], include
+
+def index_name(table, columns):
+    digest = hashlib.sha1(",".join(columns).encode("utf-8")).hexdigest()[:8]
+    return f"galen_idx_{table}_{digest}"
+
+def analyse(queries, min_rows=MIN_ROWS):
+    """
+    Replay queries through EXPLAIN QUERY PLAN and return proposals, one per
+    distinct (db, table, columns), most-run first. Each is a dict with
+    db_file, table, rows, columns, index, sql, queries, plans and weight.
+    """
+    tables = tables_by_db()
+    proposals = {}
+    # A fresh connection: a cached EXPLAIN statement would not see indexes built since
+    conn, _ = connect_sqlite()
+    try:
+        for entry in sorted(queries.values(), key=lambda e: -e["count"]):
+            sql_query = entry["sql"]
+            try:
+                steps = plan_steps(conn, sql_query)
+            except sqlite3.Error as e:
+                print(f"Skipping query that no longer plans ({e}): {sql_query[:80]}")
+                continue
+            aliases = table_aliases(sql_query)
+            for step in steps:
+                if step["kind"] not in ("scan", "automatic") or step["db_file"] is None or step["rows"] < min_rows:
+                    continue
+                db_file, table = step["db_file"], step["table"]
+                names = {n for n, ref in aliases.items() if ref[1] == table} | {step["name"], table}
+                key, include = propose_index(sql_query, table, db_file, tables[db_file][table], names,
+                                             step["index_columns"])
+                if not key:
+                    continue
+                proposal = proposals.setdefault((db_file, table, tuple(key + include)), {
+                    "db_file": db_file, "table": table, "rows": step["rows"],
+                    "columns": key + include, "queries": [], "plans": [], "weight": 0,
+                })
+                proposal["queries"].append(sql_query)
+                proposal["plans"].append(step["detail"])
+                proposal["weight"] += entry["count"]
+    finally:
+        conn.close()
+    for proposal in proposals.values():
+        name = index_name(proposal["table"], proposal["columns"])
+        cols = ", ".join(f'"{c}"' for c in proposal["columns"])
+        proposal["index"] = name
+        proposal["sql"] = f'CREATE INDEX IF NOT EXISTS "{name}" ON "{proposal["table"]}" ({cols})'
+    return sorted(proposals.values(), key=lambda p: (-p["weight"], p["db_file"], p["table"]))
+
+def time_query(sql_query, db_files, repeats=TIMING_REPEATS):
+    """Best-of-N wall time in ms for running a query to completion against the given db files."""
+    conn = _open_connection(db_files)
+    try:
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            conn.execute(sql_query).fetchall()
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+    finally:
+        conn.close()
+
+def _sidecar_copy(db_file, sidecar_dir):
+    """Consistent copy of a db file into the sidecar directory, made once."""
+    os.makedirs(sidecar_dir, exist_ok=True)
+    target = os.path.join(sidecar_dir, os.path.basename(db_file))
+    if not os.path.exists(target):
+        source, dest = sqlite3.connect(db_file), sqlite3.connect(target)
+        try:
+            source.backup(dest)
+        finally:
+            source.close()
+            dest.close()
+    return target
+
+def build(proposals, sidecar_dir=None):
+    """
+    Create the proposed indexes and time every affected query before and after.
+    Without sidecar_dir the indexes go into the db files themselves; with it each
+    affected db is copied there first and only the copy is changed.
+    """
+    db_files = find_db_files()
+    before = {}
+    for proposal in proposals:
+        for sql_query in proposal["queries"]:
+            if sql_query not in before:
+                before[sql_query] = time_query(sql_query, db_files)
+
+    swapped = {}
+    for proposal in proposals:
+        target = proposal["db_file"]
+        if sidecar_dir:
+            target = swapped.setdefault(target, _sidecar_copy(target, sidecar_dir))
+        start = time.perf_counter()
+        conn = sqlite3.connect(target)
+        try:
+            conn.execute(proposal["sql"])
+            conn.execute(f'ANALYZE "{proposal["index"]}"')
+            conn.commit()
+        finally:
+            conn.close()
+        proposal["built_in"] = target
+        proposal["build_s"] = time.perf_counter() - start
+
+    after_files = [swapped.get(db_file, db_file) for db_file in db_files]
+    for proposal in proposals:
+        proposal["timings"] = []
+        for sql_query in proposal["queries"]:
+            after = time_query(sql_query, after_files)
+            proposal["timings"].append({
+                "sql": sql_query, "before_ms": before[sql_query], "after_ms": after,
+                "speedup": before[sql_query] / after if after else None,
+            })
+    if not sidecar_dir:
+        get_catalog().refresh(force=True)
+    return proposals
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Propose and build indexes for the queries in the query log.")
+    parser.add_argument("--log", default=LOG_PATH, help="JSONL query log")
+    parser.add_argument("--legacy-log", default=LEGACY_LOG_PATH, help="old CSV query log, read if present")
+    parser.add_argument("--min-rows", type=int, default=MIN_ROWS, help="ignore tables with fewer rows")
+    parser.add_argument("--build", action="store_true", help="create the proposed indexes and time the queries")
+    parser.add_argument("--sidecar", help="build into copies of the affected dbs in this directory instead")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    queries = logged_queries(args.log, args.legacy_log)
+    proposals = analyse(queries, min_rows=args.min_rows)
+    if args.build and proposals:
+        build(proposals, sidecar_dir=args.sidecar)
+
+    if args.json:
+        print(json.dumps(proposals, indent=4, default=str))
+        return 0
+    print(f"{len(queries)} distinct queries, {len(proposals)} index proposals")
+    for proposal in proposals:
+        print(f"\n{proposal['table']} in {proposal['db_file']} ({proposal['rows']} rows, "
+              f"{len(proposal['queries'])} queries, {proposal['weight']} runs)")
+        print(f"  {proposal['sql']}")
+        for timing in proposal.get("timings", []):
+            print(f"  {timing['before_ms']:.1f} ms -> {timing['after_ms']:.1f} ms "
+                  f"(x{timing['speedup']:.1f})  {timing['sql'][:80]}")
+    if args.sidecar and args.build:
+        print(f"\nIndexed copies are in {args.sidecar}; move them over db/ to use them.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Helpers for the OpenAI Assistants API.
+
+Assistants are created once per (name, instructions, model, tools) and reused,
+both within a process and across processes through a metadata tag. Runs are
+driven to completion from the streaming run events, falling back to polling
+with exponential backoff, and both paths honour a deadline and a cancel event.
+A stream that goes quiet for STREAM_STALL seconds is given up for polling, so
+neither a stalled connection nor a missed event holds a run past its deadline.
+
+    python -m llms.assistants --purge    # delete untagged assistants left by older code
+"""
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+
+from utils.retry import resilient, resilient_call, attempt_timeout, MIN_ATTEMPT_TIMEOUT
+
+METADATA_KEY = "galen_key"
+LEAKED_NAMES = ("Chart Generator", "PoY Evaluator to read DB", "Slide Generator")
+
+RUN_TIMEOUT = 560            # seconds before a run is cancelled
+POLL_INITIAL = 0.25          # first polling interval in seconds
+POLL_MAX = 4.0               # polling interval ceiling in seconds
+POLL_BACKOFF = 1.6           # growth factor between polls
+STREAM_STALL = 30.0          # seconds without a run event before switching to polling
+
+log = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled", "expired", "incomplete", "requires_action")
+
+_assistant_ids = {}
+_lock = threading.Lock()
+
+class RunTimeout(TimeoutError):
+    """A run did not finish before its deadline and was cancelled."""
+
+def assistant_key(name, instructions, model, tools=None):
+    payload = json.dumps([name, instructions, model, tools or []], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def get_or_create_assistant(client, name, instructions, model, tools=None):
+    """
+    Return the id of an assistant with exactly this configuration, creating it
+    only if neither this process nor the account already has one.
+    """
+    key = assistant_key(name, instructions, model, tools)
+    assistant_id = _assistant_ids.get(key)
+    if assistant_id is not None:
+        return assistant_id
+    with _lock:
+        assistant_id = _assistant_ids.get(key)
+        if assistant_id is None:
+            assistants = resilient_call("openai", lambda: list(client.beta.assistants.list(limit=100, order="desc")))
+            for assistant in assistants:
+                if (assistant.metadata or {}).get(METADATA_KEY) == key:
+                    assistant_id = assistant.id
+                    break
+            else:
+                assistant_id = resilient_call(
+                    "openai", client.beta.assistants.create,
+                    name=name,
+                    instructions=instructions,
+                    tools=tools or [],
+                    model=model,
+                    metadata={METADATA_KEY: key},
+                ).id
+            _assistant_ids[key] = assistant_id
+    return assistant_id
+
+def _cancel(client, thread_id, run_id):
+    try:
+        return resilient_call("openai", client.beta.threads.runs.cancel, run_id, thread_id=thread_id)
+    except Exception as e:
+        log.warning("Could not cancel run %s: %s", run_id, e)
+
+def wait_for_run(client, thread_id, run, timeout=RUN_TIMEOUT, cancel_event=None):
+    """
+    Poll a run with exponential backoff until it reaches a terminal status.
+    Cancels the run and raises RunTimeout on the deadline or when cancel_event is set.
+    """
+    deadline = time.monotonic() + timeout
+    interval = POLL_INITIAL
+    while run.status not in TERMINAL_STATUSES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or (cancel_event is not None and cancel_event.is_set()):
+            _cancel(client, thread_id, run.id)
+            raise RunTimeout(f"Run {run.id} cancelled after {timeout - max(remaining, 0):.1f}s in status {run.status}")
+        if cancel_event is not None:
+            cancel_event.wait(min(interval, remaining))
+        else:
+            time.sleep(min(interval, remaining))
+        interval = min(interval * POLL_BACKOFF, POLL_MAX)
+        run = resilient_call("openai", client.beta.threads.runs.retrieve, thread_id=thread_id, run_id=run.id)
+    return run
+
+@resilient("openai")
+def start_run(client, thread_id, assistant_id, **run_kwargs):
+    """
+    The thread's active run if it has one, else a new run. A failed stream or
+    a retried create may already have started a run on the server, and a
+    thread accepts only one active run at a time.
+    """
+    latest = client.beta.threads.runs.list(thread_id=thread_id, limit=1).data
+    if latest and latest[0].status not in TERMINAL_STATUSES:
+        return latest[0]
+    return client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, timeout=attempt_timeout(),
+                                           **run_kwargs)
+
+def run_to_completion(client, thread_id, assistant_id, timeout=RUN_TIMEOUT, cancel_event=None, **run_kwargs):
+    """
+    Start a run and return it once finished, reading the streaming run events so
+    completion is seen as soon as it happens. Falls back to backoff polling if
+    streaming is unavailable or stalls.
+    """
+    deadline = time.monotonic() + timeout
+    run = None
+    try:
+        with client.beta.threads.runs.stream(thread_id=thread_id, assistant_id=assistant_id,
+                                             timeout=max(min(timeout, STREAM_STALL), MIN_ATTEMPT_TIMEOUT),
+                                             **run_kwargs) as stream:
+            for event in stream:
+                data = getattr(event, "data", None)
+                if getattr(data, "object", None) == "thread.run":
+                    run = data
+                    if run.status in TERMINAL_STATUSES:
+                        return run
+                if time.monotonic() > deadline or (cancel_event is not None and cancel_event.is_set()):
+                    if run is not None:
+                        _cancel(client, thread_id, run.id)
+                    raise RunTimeout(f"Run on thread {thread_id} cancelled after {timeout}s")
+            run = stream.get_final_run()
+    except RunTimeout:
+        raise
+    except Exception as e:
+        log.info("Run streaming unavailable or stalled (%s); polling instead", e)
+        if run is None:
+            run = start_run(client, thread_id, assistant_id, **run_kwargs)
+    remaining = max(deadline - time.monotonic(), 0)
+    return wait_for_run(client, thread_id, run, timeout=remaining, cancel_event=cancel_event)
+
+def delete_thread(client, thread_id):
+    """Delete a finished thread, ignoring failures."""
+    try:
+        resilient_call("openai", client.beta.threads.delete, thread_id)
+    except Exception as e:
+        log.warning("Could not delete thread %s: %s", thread_id, e)
+
+def purge_leaked_assistants(client, names=LEAKED_NAMES):
+    """Delete assistants with the given names that were created without a reuse tag."""
+    deleted = []
+    for assistant in resilient_call("openai", lambda: list(client.beta.assistants.list(limit=100))):
+        if assistant.name in names and METADATA_KEY not in (assistant.metadata or {}):
+            resilient_call("openai", client.beta.assistants.delete, assistant.id)
+            deleted.append(assistant.id)
+    return deleted
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage Galen's OpenAI assistants.")
+    parser.add_argument("--purge", action="store_true", help="delete untagged assistants left behind by older runs")
+    args = parser.parse_args()
+    if not args.purge:
+        parser.print_help()
+        sys.exit(0)
+    from llms.clients import get_openai_client
+    deleted = purge_leaked_assistants(get_openai_client())
+    print(f"Deleted {len(deleted)} assistants")
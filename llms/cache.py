@@ -0,0 +1,253 @@
+"""
+Content-addressed, disk-backed cache for LLM responses.
+
+Entries are keyed on provider, model, system prompt, user input (with any context
+sent ahead of it), temperature and response format, stored in a local SQLite
+file and evicted by TTL and then by least-recent use once the file grows past
+its size cap.
+
+Every decorated llm_call_* function accepts an extra ``cache`` keyword:
+    cache="use"      read from and write to the cache (default)
+    cache="refresh"  skip the lookup but store the fresh response
+    cache="bypass"   neither read nor write
+GALEN_LLM_CACHE=off disables the cache for the whole process; on (the default)
+keeps it in CACHE_PATH, and any other value is the path of the cache file.
+"""
+import os
+import time
+import json
+import pickle
+import hashlib
+import sqlite3
+import inspect
+import threading
+from functools import wraps
+
+from llms.usage import reset_usage, record_usage, update_usage
+
+CACHE_PATH = os.path.join("cache", "llm_cache.sqlite")
+MAX_BYTES = 512 * 1024 * 1024       # size cap for stored responses
+TTL_SECONDS = 30 * 24 * 3600        # entries older than this are dropped
+EVICT_EVERY = 100                   # writes between eviction passes
+
+CACHE_MODES = ("use", "refresh", "bypass")
+
+class ResponseCache:
+    """SQLite-backed response store with TTL and LRU eviction and hit/miss counters."""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES, ttl=TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "bypassed": 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, provider TEXT, model TEXT, value BLOB,"
+                " size INTEGER, created REAL, last_access REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    @staticmethod
+    def make_key(provider, model, system_prompt, user_input, temperature, response_format=None):
+        """Content address of one request."""
+        payload = json.dumps(
+            [provider, model, system_prompt, str(user_input), temperature, response_format],
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return (hit, value) for a key, honouring the TTL."""
+        conn = self._conn()
+        row = conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+            self._count("misses")
+            return False, None
+        with conn:
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return True, pickle.loads(row[0])
+
+    def put(self, key, value, provider=None, model=None):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, blob, len(blob), now, now),
+            )
+        self._count("writes")
+        with self._lock:
+            self._writes_since_evict += 1
+            due = self._writes_since_evict >= EVICT_EVERY
+            if due:
+                self._writes_since_evict = 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least-recently used ones until under the size cap."""
+        conn = self._conn()
+        removed = 0
+        with conn:
+            if self.ttl is not None:
+                removed += conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                keys, freed = [], 0
+                for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                    keys.append((key,))
+                    freed += size
+                    if freed >= excess:
+                        break
+                conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+                removed += len(keys)
+        self._count("evictions", removed)
+        return removed
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM responses")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    Process-wide response cache, or None when disabled with GALEN_LLM_CACHE=off.
+    GALEN_LLM_CACHE may also name the cache file; on (the default) uses CACHE_PATH.
+    """
+    global _cache
+    setting = os.getenv("GALEN_LLM_CACHE", "")
+    if setting.lower() in ("off", "0", "false", "no"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = CACHE_PATH if setting.lower() in ("", "on", "1", "true", "yes") else setting
+                _cache = ResponseCache(path=path)
+    return _cache
+
+def cache_stats():
+    """Hit/miss counters of the process-wide cache."""
+    cache = get_cache()
+    return dict(cache.stats) if cache is not None else {}
+
+def _request_key(store, signature, provider, fields, output, args, kwargs):
+    """Bind a call's arguments and return (model, cache key)."""
+    model_arg, input_arg, system_arg, temperature_arg, context_arg, response_format = fields
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    params = bound.arguments
+    model = params.get(model_arg)
+    user_input = params.get(input_arg)
+    if context_arg is not None and params.get(context_arg) is not None:
+        user_input = [params[context_arg], user_input]
+    key = store.make_key(
+        provider, model, params.get(system_arg), user_input,
+        params.get(temperature_arg), response_format if output == "text" else [response_format, output],
+    )
+    return model, key
+
+def _check_mode(cache):
+    if cache not in CACHE_MODES:
+        raise ValueError(f"cache must be one of {CACHE_MODES}, got {cache!r}")
+
+def cached_llm_call(provider, model_arg, input_arg, system_arg="system_p", temperature_arg="temperature",
+                    context_arg=None, response_format=None, output="text"):
+    """
+    Decorator that serves an llm_call_* function from the response cache.
+    The *_arg names say which parameters of the wrapped function hold each key
+    field; context_arg names one holding prompt context sent ahead of the input.
+    Functions that return something other than the response text set output to
+    a name for it, so their entries are not shared with text-returning calls.
+    """
+    fields = (model_arg, input_arg, system_arg, temperature_arg, context_arg, response_format)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, cache="use", **kwargs):
+            _check_mode(cache)
+            reset_usage()
+            store = get_cache()
+            if store is None or cache == "bypass":
+                if store is not None:
+                    store._count("bypassed")
+                return func(*args, **kwargs)
+
+            model, key = _request_key(store, signature, provider, fields, output, args, kwargs)
+            if cache == "use":
+                hit, value = store.get(key)
+                if hit:
+                    record_usage(0, 0, cache_hit=True)
+                    return value
+            value = func(*args, **kwargs)
+            if value is not None:
+                store.put(key, value, provider=provider, model=model)
+            return value
+
+        return wrapper
+    return decorator
+
+def cached_llm_stream(provider, model_arg, input_arg, system_arg="system_p", temperature_arg="temperature",
+                      context_arg=None, response_format=None):
+    """
+    Streaming counterpart of cached_llm_call for generators of text chunks.
+    A hit yields the whole cached text as one chunk; a miss stores the joined
+    text once the stream has been read to the end. Entries are shared with the
+    matching non-streaming call.
+    """
+    fields = (model_arg, input_arg, system_arg, temperature_arg, context_arg, response_format)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, cache="use", **kwargs):
+            _check_mode(cache)
+            store = get_cache()
+            if store is None or cache == "bypass":
+                if store is not None:
+                    store._count("bypassed")
+                yield from func(*args, **kwargs)
+                return
+
+            model, key = _request_key(store, signature, provider, fields, "text", args, kwargs)
+            if cache == "use":
+                hit, value = store.get(key)
+                if hit:
+                    update_usage(prompt_tokens=0, completion_tokens=0, cache_hit=True)
+                    yield value
+                    return
+            chunks = []
+            for chunk in func(*args, **kwargs):
+                chunks.append(chunk)
+                yield chunk
+            store.put(key, "".join(chunks), provider=provider, model=model)
+
+        return wrapper
+    return decorator
@@ -0,0 +1,130 @@
+"""
+Registry of long-lived provider clients.
+
+Clients are created lazily on first use, once per (provider, api key), and then
+shared across calls and threads so every request reuses pooled keep-alive
+connections instead of paying client construction and a TCP/TLS handshake.
+Inside private_clients() the current context gets its own clients instead,
+closed when the block ends, for measuring what that reuse saves.
+"""
+import os
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Connection-pool settings shared by every provider
+MAX_CONNECTIONS = 64
+MAX_KEEPALIVE_CONNECTIONS = 32
+KEEPALIVE_EXPIRY = 120.0          # seconds an idle connection is kept open
+SDK_MAX_RETRIES = 0               # utils.retry owns retries; SDK retries would multiply them
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://0.0.0.0:11434")
+
+_clients = {}
+_lock = threading.Lock()
+_private = contextvars.ContextVar("galen_private_clients", default=None)
+
+def _httpx_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+def _get_or_create(key, factory):
+    clients, lock = _private.get() or (_clients, _lock)
+    client = clients.get(key)
+    if client is None:
+        with lock:
+            client = clients.get(key)
+            if client is None:
+                client = clients[key] = factory()
+    return client
+
+def _close(clients):
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+@contextmanager
+def private_clients():
+    """
+    Build new clients for the calls made in this block (including threads that
+    copy its context) and close them at the end, leaving the shared ones alone.
+    """
+    clients = {}
+    token = _private.set((clients, threading.Lock()))
+    try:
+        yield
+    finally:
+        _private.reset(token)
+        _close(list(clients.values()))
+
+def get_openai_client(api_key=None):
+    """Shared OpenAI client for the given key (defaults to OPENAI_API_KEY)."""
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+
+    def factory():
+        from openai import OpenAI, DefaultHttpxClient
+        return OpenAI(api_key=api_key, max_retries=SDK_MAX_RETRIES,
+                      http_client=DefaultHttpxClient(limits=_httpx_limits()))
+    return _get_or_create(("openai", api_key), factory)
+
+def get_anthropic_client(api_key=None):
+    """Shared Anthropic client for the given key (defaults to ANTHROPIC_API_KEY)."""
+    api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
+
+    def factory():
+        from anthropic import Anthropic, DefaultHttpxClient
+        return Anthropic(api_key=api_key, max_retries=SDK_MAX_RETRIES,
+                         http_client=DefaultHttpxClient(limits=_httpx_limits()))
+    return _get_or_create(("anthropic", api_key), factory)
+
+def get_groq_client(api_key=None):
+    """Shared Groq client for the given key (defaults to GROQ_API_KEY)."""
+    api_key = api_key or os.getenv("GROQ_API_KEY")
+
+    def factory():
+        from groq import Groq, DefaultHttpxClient
+        return Groq(api_key=api_key, max_retries=SDK_MAX_RETRIES,
+                    http_client=DefaultHttpxClient(limits=_httpx_limits()))
+    return _get_or_create(("groq", api_key), factory)
+
+def get_ollama_session():
+    """Shared requests.Session with a pooled adapter for the Ollama server."""
+    def factory():
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_KEEPALIVE_CONNECTIONS)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+    return _get_or_create(("ollama",), factory)
+
+def register_client(provider, client, api_key=None):
+    """
+    Use client for provider instead of building one, e.g. a stub in benchmarks.
+    provider is "openai", "anthropic", "groq" or "ollama"; api_key defaults as in get_*_client.
+    """
+    if provider == "ollama":
+        key = ("ollama",)
+    else:
+        api_key = api_key or os.getenv(f"{provider.upper()}_API_KEY")
+        key = (provider, api_key)
+    with _lock:
+        _clients[key] = client
+
+def reset_clients(close=True):
+    """
+    Forget every shared client so the next call builds fresh ones.
+    Pass close=False when other threads may still be using the old clients.
+    """
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    if close:
+        _close(clients)
@@ -0,0 +1,244 @@
+"""
+Hedged requests across models to cut tail latency.
+
+hedged_call() streams a prompt from a policy's primary model. If no first
+token has arrived within the hedge delay, the same prompt is also sent to the
+policy's backup model (usually on another provider); if the primary fails
+first, the backup is sent at once. Whichever stream finishes first wins and
+the other is cancelled.
+
+The hedge delay is a percentile (default p95) of the primary model's recent
+time-to-first-token, clamped to the policy's bounds. With p95, about one call
+in twenty is hedged once the model is behaving normally, and far more while it
+is cold-starting or browning out. Until a model has MIN_SAMPLES observations
+the policy's default delay is used; run_evals.py seeds the samples from the
+eval results store.
+
+Policies live under "hedging" in config/info.json, keyed by task type, with a
+"default" entry for the rest; a task type mapped to null is never hedged:
+
+    "hedging": {
+        "default": {"primary": {"provider": "openai", "model": "gpt-4o"},
+                    "backup": {"provider": "anthropic", "model": "claude-3-7-sonnet-latest"},
+                    "delay_percentile": 95, "default_delay_s": 3.0, "min_delay_s": 0.5, "max_delay_s": 20}
+    }
+
+Cancelling is cooperative: a cancelled stream stops and closes its connection
+at its next chunk. A request that has not started answering is abandoned on
+its thread and ends at its retry deadline.
+"""
+import time
+import queue
+import logging
+import threading
+import contextvars
+from collections import deque
+
+from settings import get_info
+from utils.stats import percentile
+from utils.tracing import span
+from llms.usage import last_usage, record_usage
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POLICY = "default"      # policy for task types without their own entry
+DELAY_PERCENTILE = 95           # percentile of the primary's TTFT after which the backup is sent
+DEFAULT_DELAY_S = 3.0           # hedge delay while a model has too few TTFT samples
+MIN_DELAY_S = 0.25              # clamp for the computed hedge delay...
+MAX_DELAY_S = 30.0              # ...on both sides
+MIN_SAMPLES = 20                # TTFT observations needed before the percentile is trusted
+SAMPLE_WINDOW = 500             # most recent TTFT observations kept per model
+
+def hedge_policy(task_type, policies=None):
+    """The hedging policy for a task type (from config/info.json by default), or None if it is not hedged."""
+    policies = (policies if policies is not None else get_info().get("hedging")) or {}
+    policy = policies[task_type] if task_type in policies else policies.get(DEFAULT_POLICY)
+    if not policy or not policy.get("primary") or not policy.get("backup"):
+        return None
+    return policy
+
+class TtftTracker:
+    """Rolling window of time-to-first-token observations per (provider, model)."""
+
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, provider, model, ttft_s):
+        if ttft_s is None:
+            return
+        with self._lock:
+            samples = self._samples.get((provider, model))
+            if samples is None:
+                samples = self._samples[(provider, model)] = deque(maxlen=self.window)
+            samples.append(ttft_s)
+
+    def seed(self, provider, model, ttfts):
+        """Add past observations, e.g. the ttft_s of earlier eval results."""
+        for ttft_s in ttfts:
+            self.add(provider, model, ttft_s)
+
+    def delay(self, target, policy):
+        """Hedge delay for a call to target ({"provider", "model"}) under policy."""
+        with self._lock:
+            samples = list(self._samples.get((target["provider"], target["model"]), ()))
+        if len(samples) < MIN_SAMPLES:
+            return policy.get("default_delay_s", DEFAULT_DELAY_S)
+        delay = percentile(samples, policy.get("delay_percentile", DELAY_PERCENTILE))
+        return min(max(delay, policy.get("min_delay_s", MIN_DELAY_S)), policy.get("max_delay_s", MAX_DELAY_S))
+
+class HedgeStats:
+    """Counts of hedged calls in this process, for the eval summary."""
+
+    def __init__(self):
+        self.counts = {"calls": 0, "hedged": 0, "failovers": 0, "backup_wins": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def record(self, report):
+        with self._lock:
+            self.counts["calls"] += 1
+            self.counts["hedged"] += bool(report.get("hedged"))
+            self.counts["failovers"] += bool(report.get("failover"))
+            self.counts["backup_wins"] += report.get("winner") == "backup"
+            self.counts["failed"] += report.get("winner") is None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        counts["hedge_rate"] = counts["hedged"] / counts["calls"] if counts["calls"] else None
+        return counts
+
+_tracker = None
+_stats = None
+_lock = threading.Lock()
+
+def get_ttft_tracker():
+    global _tracker
+    if _tracker is None:
+        with _lock:
+            if _tracker is None:
+                _tracker = TtftTracker()
+    return _tracker
+
+def get_hedge_stats():
+    global _stats
+    if _stats is None:
+        with _lock:
+            if _stats is None:
+                _stats = HedgeStats()
+    return _stats
+
+def hedge_stats():
+    """Hedged calls, hedge rate, failovers and backup wins in this process."""
+    return get_hedge_stats().stats()
+
+class _Leg:
+    """One stream of a hedged call, read to the end on its own thread."""
+
+    def __init__(self, role, target, prompt, system, cache, finished, context=None):
+        self.role = role
+        self.provider, self.model = target["provider"], target["model"]
+        self.prompt, self.system, self.cache, self.context = prompt, system, cache, context
+        self.finished = finished            # queue the leg puts itself on when it is done
+        self.responding = threading.Event() # set on the first token or when the stream ends
+        self.cancelled = threading.Event()
+        self.chunks = []
+        self.started = None
+        self.error = None
+        self.usage = {}
+        self.ttft_s = None
+        self.wall_s = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._run,), name=f"hedge-{self.role}", daemon=True).start()
+        return self
+
+    def _run(self):
+        from llms.llms import stream_model
+        start = self.started
+        stream = None
+        try:
+            stream = stream_model(self.provider, self.model, self.prompt, self.system, cache=self.cache,
+                                  context=self.context)
+            for chunk in stream:
+                if self.cancelled.is_set():
+                    break
+                if chunk and self.ttft_s is None:
+                    self.ttft_s = time.perf_counter() - start
+                    self.responding.set()
+                self.chunks.append(chunk)
+        except Exception as e:
+            self.error = e
+        finally:
+            if stream is not None:
+                stream.close()  # closes the provider stream of a cancelled leg
+            self.wall_s = time.perf_counter() - start
+            self.usage = last_usage()
+            self.responding.set()
+            self.finished.put(self)
+
+    def cancel(self):
+        self.cancelled.set()
+
+def hedged_call(prompt, policy, system=None, cache="use", tracker=None, context=None):
+    """
+    Answer prompt with the policy's primary model, hedged by its backup model.
+    Returns (text, report); the report names the winner and whether and when
+    the backup was sent. Raises the primary's error if both models fail.
+    context is sent ahead of the prompt, as in llms.llms.stream_model.
+    """
+    from llms.llms import system_message
+    tracker = tracker or get_ttft_tracker()
+    system = system or system_message
+    primary_target, backup_target = policy["primary"], policy["backup"]
+    delay = tracker.delay(primary_target, policy)
+    finished = queue.Queue()
+    report = {"primary": f"{primary_target['provider']}/{primary_target['model']}",
+              "hedge_delay_s": round(delay, 3), "hedged": False, "failover": False, "winner": None}
+
+    with span("llm.hedged", primary=report["primary"], hedge_delay_s=report["hedge_delay_s"]) as s:
+        start = time.perf_counter()
+        primary = _Leg("primary", primary_target, prompt, system, cache, finished, context).start()
+        legs = [primary]
+        if not primary.responding.wait(delay):
+            log.info("No first token from %s after %.2fs; sending the backup request", report["primary"], delay)
+            report["hedged"] = True
+            legs.append(_Leg("backup", backup_target, prompt, system, cache, finished, context).start())
+
+        winner, running = None, len(legs)
+        while running:
+            leg = finished.get()
+            running -= 1
+            if leg.error is None:
+                winner = leg
+                break
+            log.warning("%s request to %s/%s failed: %s", leg.role, leg.provider, leg.model, leg.error)
+            if leg is primary and len(legs) == 1:
+                report["failover"] = True
+                legs.append(_Leg("backup", backup_target, prompt, system, cache, finished, context).start())
+                running += 1
+        now = time.perf_counter()
+        cancelled = [leg for leg in legs if leg is not winner and leg.error is None]
+        for leg in cancelled:
+            leg.cancel()
+        for leg in legs:
+            if leg.error is None:
+                # A cancelled leg's TTFT is at least its time so far; leaving it out would bias the delay low
+                tracker.add(leg.provider, leg.model, leg.ttft_s if leg.ttft_s is not None else now - leg.started)
+
+        wall_s = time.perf_counter() - start
+        if winner is None:
+            get_hedge_stats().record(report)
+            s.set(**report)
+            raise primary.error
+        report.update(winner=winner.role, provider=winner.provider, model=winner.model, wall_s=wall_s,
+                      primary_ttft_s=primary.ttft_s, cancelled=[leg.role for leg in cancelled])
+        if winner.ttft_s is not None:
+            report["ttft_s"] = winner.started - start + winner.ttft_s
+        get_hedge_stats().record(report)
+        s.set(**report)
+    record_usage(**{**winner.usage, **report})
+    return "".join(winner.chunks), report
@@ -1,14 +1,15 @@
-from groq import Groq
-from openai import OpenAI
-from anthropic import Anthropic
 import os
 import json
-import time
-import requests
+import logging
 from dotenv import load_dotenv
 load_dotenv()
-from utils.retry import retry_except
-from tenacity import retry, stop_after_attempt, wait_fixed
+from utils.retry import resilient, resilient_stream, attempt_timeout
+from llms.cache import cached_llm_call, cached_llm_stream
+from llms.clients import get_openai_client, get_anthropic_client, get_groq_client, get_ollama_session, OLLAMA_URL
+from llms.assistants import get_or_create_assistant, wait_for_run, delete_thread, RUN_TIMEOUT
+from llms.usage import record_usage, record_response_usage, update_usage, token_counts, timed_stream, traced_call
+
+log = logging.getLogger(__name__)
 
 system_message = "You are an AI trained to be a brilliant computational biologist and data analyst. You are brilliant and conscientious."
 
@@ -28,37 +29,59 @@ These instructions should comprise of the full pipeline of data analysis. Think
 
 temp = 0.0
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-@retry_except(exceptions_to_catch=(IndexError, ZeroDivisionError), tries=3, delay=2)
-def llm_call_gpt(input, GPT, system_p = system_message, temperature = temp):
-    client = OpenAI()
-    client.api_key = os.getenv('OPENAI_API_KEY')
+RETRY_ON = (IndexError, ZeroDivisionError)      # empty or malformed responses, retried like transient errors
+CACHE_BREAKPOINT = {"type": "ephemeral"}        # Anthropic prompt-cache breakpoint: cache everything up to here
+
+def gpt_messages(input, system_p, context=None):
+    """
+    Chat messages with the static parts first. OpenAI caches prompt prefixes
+    automatically, so context that repeats across calls goes before the input.
+    """
+    messages = [{"role": "system", "content": system_p}]
+    if context is not None:
+        messages.append({"role": "user", "content": context})
+    messages.append({"role": "user", "content": f"{input}"})
+    return messages
+
+def claude_request(input, system_p, context=None):
+    """
+    (system, messages) for Anthropic with cache breakpoints after the system
+    prompt and after the context, so both are read from the prompt cache on
+    later calls that repeat them.
+    """
+    system = [{"type": "text", "text": system_p, "cache_control": CACHE_BREAKPOINT}]
+    if context is None:
+        return system, [{"role": "user", "content": f"{input}"}]
+    content = [{"type": "text", "text": context, "cache_control": CACHE_BREAKPOINT},
+               {"type": "text", "text": f"{input}"}]
+    return system, [{"role": "user", "content": content}]
+
+@traced_call("openai")
+@cached_llm_call(provider="openai", model_arg="GPT", input_arg="input", context_arg="context")
+@resilient("openai", retry_on=RETRY_ON)
+def llm_call_gpt(input, GPT, system_p = system_message, temperature = temp, context = None):
+    client = get_openai_client()
 
     response = client.chat.completions.create(
         model=GPT,
-        messages=[
-            {"role": "system", "content": system_p},
-            {"role": "user", "content": f"{input}"}
-        ]
+        messages=gpt_messages(input, system_p, context),
+        timeout=attempt_timeout(),
     )
+    record_response_usage("openai", response)
     return response.choices[0].message.content
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-@retry_except(exceptions_to_catch=(IndexError, ZeroDivisionError), tries=3, delay=2)
+@traced_call("openai")
+@resilient("openai", retry_on=RETRY_ON, deadline=RUN_TIMEOUT + 60)
 def llm_call_gpt_assistant(input, INSTRUCTION, GPT, temperature = temp):
-    client = OpenAI()
-    client.api_key = os.getenv('OPENAI_API_KEY')
-
-    assistant = client.beta.assistants.create(
-    name="PoY Evaluator to read DB",
-    instructions=INSTRUCTION,
-    model=GPT
-    )
+    client = get_openai_client()
 
-    ASSISTANT_ID = assistant.id
+    ASSISTANT_ID = get_or_create_assistant(client, "PoY Evaluator to read DB", INSTRUCTION, GPT)
 
     run, thread = submit_message_and_create_run(client, ASSISTANT_ID, input)
-    returned_response = wait_on_run_and_get_response(client, run, thread)
+    try:
+        returned_response = wait_on_run_and_get_response(client, run, thread)
+    finally:
+        delete_thread(client, thread.id)
     if isinstance(returned_response, list):
         returned_response = ' '.join(map(str, returned_response))
 
@@ -67,11 +90,11 @@ def llm_call_gpt_assistant(input, INSTRUCTION, GPT, temperature = temp):
 
     return returned_response
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-@retry_except(exceptions_to_catch=(IndexError, ZeroDivisionError), tries=3, delay=2)
+@traced_call("openai")
+@cached_llm_call(provider="openai", model_arg="GPT", input_arg="input", response_format="json_object")
+@resilient("openai", retry_on=RETRY_ON)
 def llm_call_gpt_json(input, GPT, system_p = system_message, temperature = temp):
-    client = OpenAI()
-    client.api_key = os.getenv('OPENAI_API_KEY')
+    client = get_openai_client()
 
     response = client.chat.completions.create(
         model=GPT,
@@ -79,35 +102,43 @@ def llm_call_gpt_json(input, GPT, system_p = system_message, temperature = temp)
             {"role": "system", "content": system_p},
             {"role": "user", "content": f"Respond in JSON. {input}"}
         ],
-        response_format={ "type": "json_object" }
+        response_format={ "type": "json_object" },
+        timeout=attempt_timeout(),
     )
+    record_response_usage("openai", response)
     return response.choices[0].message.content
 
-# @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-@retry_except(exceptions_to_catch=(IndexError, ZeroDivisionError), tries=3, delay=2)
-def llm_call_claude(input, LLM, system_p = system_message, temperature = temp):
-    client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+@traced_call("anthropic")
+@cached_llm_call(provider="anthropic", model_arg="LLM", input_arg="input", context_arg="context")
+@resilient("anthropic", retry_on=RETRY_ON)
+def llm_call_claude(input, LLM, system_p = system_message, temperature = temp, context = None):
+    client = get_anthropic_client()
+    system, messages = claude_request(input, system_p, context)
 
     response = client.messages.create(
         model=LLM,
-        messages=[
-            {"role": "user", "content": f"{input}"}
-        ],
-        system=system_p,
+        messages=messages,
+        system=system,
         max_tokens=4096,
+        timeout=attempt_timeout(),
     )
+    record_response_usage("anthropic", response)
     return response.content[0].text
 
-# @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-@retry_except(exceptions_to_catch=(IndexError, ZeroDivisionError), tries=3, delay=2)
+@traced_call("ollama")
+@cached_llm_call(provider="ollama", model_arg="LLM", input_arg="prompt", response_format="json")
+@resilient("ollama", retry_on=RETRY_ON)
 def llm_call_ollama_json(prompt, system_p = system_message, temperature = temp, LLM = "llama3:8b"):
-    r = requests.post('http://0.0.0.0:11434/api/generate',
-                      json={
-                          'model': LLM, #llama2:7b
-                          'prompt': f"{prompt}. Return this as JSON.",
-                          'format': 'json',
-                      },
-                      stream=False)
+    r = get_ollama_session().post(
+        f'{OLLAMA_URL}/api/generate',
+        json={
+            'model': LLM, #llama2:7b
+            'prompt': f"{prompt}. Return this as JSON.",
+            'format': 'json',
+            'stream': False,
+        },
+        stream=False,
+        timeout=attempt_timeout())
     full_response = ""
     for line in r.iter_lines():
         if line:
@@ -115,19 +146,25 @@ def llm_call_ollama_json(prompt, system_p = system_message, temperature = temp,
             json_line = json.loads(decoded_line)
             full_response += json_line.get("response", "")
             if json_line.get("done"):
+                record_usage(json_line.get("prompt_eval_count"), json_line.get("eval_count"))
                 break
 
-    print(full_response)
+    log.debug("ollama response: %s", full_response)
     return full_response
 
-@retry_except(exceptions_to_catch=(IndexError, ZeroDivisionError), tries=3, delay=2)
+@traced_call("ollama")
+@cached_llm_call(provider="ollama", model_arg="LLM", input_arg="prompt")
+@resilient("ollama", retry_on=RETRY_ON)
 def llm_call_ollama(prompt, system_p = system_message, temperature = temp, LLM = "llama3:8b"):
-    r = requests.post('http://0.0.0.0:11434/api/generate',
-                      json={
-                          'model': LLM, #llama2:7b
-                          'prompt': f"{prompt}"
-                      },
-                      stream=False)
+    r = get_ollama_session().post(
+        f'{OLLAMA_URL}/api/generate',
+        json={
+            'model': LLM, #llama2:7b
+            'prompt': f"{prompt}",
+            'stream': False,
+        },
+        stream=False,
+        timeout=attempt_timeout())
     full_response = ""
     for line in r.iter_lines():
         if line:
@@ -135,15 +172,18 @@ def llm_call_ollama(prompt, system_p = system_message, temperature = temp, LLM =
             json_line = json.loads(decoded_line)
             full_response += json_line.get("response", "")
             if json_line.get("done"):
+                record_usage(json_line.get("prompt_eval_count"), json_line.get("eval_count"))
                 break
 
-    print(full_response)
+    log.debug("ollama response: %s", full_response)
     return full_response
 
-@retry_except(exceptions_to_catch=(IndexError, ZeroDivisionError), tries=3, delay=2)
+@traced_call("groq")
+@cached_llm_call(provider="groq", model_arg="model", input_arg="prompt", output="response")
+@resilient("groq", retry_on=RETRY_ON)
 def llm_call_groq(prompt, system_p = system_message, temperature = temp, model:str="llama3-70b-8192"):
     system_prompt = system_p
-    client = Groq()
+    client = get_groq_client()
     messages = [{
             "role": "system",
             "content": system_prompt
@@ -152,7 +192,120 @@ def llm_call_groq(prompt, system_p = system_message, temperature = temp, model:s
             "role": "user",
             "content": prompt
         }]
-    return client.chat.completions.create(messages=messages, model=model)
+    response = client.chat.completions.create(messages=messages, model=model, timeout=attempt_timeout())
+    return record_response_usage("groq", response)
+
+@timed_stream
+@cached_llm_stream(provider="openai", model_arg="GPT", input_arg="input", context_arg="context")
+@resilient_stream("openai")
+def llm_stream_gpt(input, GPT, system_p = system_message, temperature = temp, context = None):
+    """Streaming llm_call_gpt: yields the completion text as it is generated."""
+    client = get_openai_client()
+    stream = client.chat.completions.create(
+        model=GPT,
+        messages=gpt_messages(input, system_p, context),
+        stream=True,
+        stream_options={"include_usage": True},
+        timeout=attempt_timeout(),
+    )
+    for chunk in stream:
+        if chunk.usage is not None:
+            update_usage(**token_counts("openai", chunk.usage))
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+@timed_stream
+@cached_llm_stream(provider="anthropic", model_arg="LLM", input_arg="input", context_arg="context")
+@resilient_stream("anthropic")
+def llm_stream_claude(input, LLM, system_p = system_message, temperature = temp, context = None):
+    """Streaming llm_call_claude: yields the completion text as it is generated."""
+    client = get_anthropic_client()
+    system, messages = claude_request(input, system_p, context)
+    with client.messages.stream(
+        model=LLM,
+        messages=messages,
+        system=system,
+        max_tokens=4096,
+        timeout=attempt_timeout(),
+    ) as stream:
+        for text in stream.text_stream:
+            yield text
+        update_usage(**token_counts("anthropic", stream.get_final_message().usage))
+
+@timed_stream
+@cached_llm_stream(provider="groq", model_arg="model", input_arg="prompt")
+@resilient_stream("groq")
+def llm_stream_groq(prompt, system_p = system_message, temperature = temp, model:str="llama3-70b-8192"):
+    """Streaming llm_call_groq: yields the completion text rather than a response object."""
+    client = get_groq_client()
+    messages = [
+        {"role": "system", "content": system_p},
+        {"role": "user", "content": prompt},
+    ]
+    stream = client.chat.completions.create(messages=messages, model=model, stream=True, timeout=attempt_timeout())
+    for chunk in stream:
+        usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+        if usage is not None:
+            update_usage(**token_counts("groq", usage))
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+@timed_stream
+@cached_llm_stream(provider="ollama", model_arg="LLM", input_arg="prompt")
+@resilient_stream("ollama")
+def llm_stream_ollama(prompt, system_p = system_message, temperature = temp, LLM = "llama3:8b"):
+    """Streaming llm_call_ollama: yields each generated fragment as the server sends it."""
+    r = get_ollama_session().post(
+        f'{OLLAMA_URL}/api/generate',
+        json={
+            'model': LLM,
+            'prompt': f"{prompt}",
+            'stream': True,
+        },
+        stream=True,
+        timeout=attempt_timeout())
+    with r:
+        for line in r.iter_lines():
+            if not line:
+                continue
+            json_line = json.loads(line.decode('utf-8'))
+            if json_line.get("response"):
+                yield json_line["response"]
+            if json_line.get("done"):
+                update_usage(prompt_tokens=json_line.get("prompt_eval_count"), completion_tokens=json_line.get("eval_count"))
+                break
+
+def _with_context(prompt, context):
+    """Context and prompt as one input, for providers without prompt caching."""
+    return prompt if context is None else f"{context}\n\n{prompt}"
+
+def stream_model(provider, model, prompt, system_p=system_message, cache="use", context=None):
+    """
+    Stream a completion from any provider's model through the matching llm_stream_* function.
+    context is sent ahead of the prompt, where providers that cache prompt prefixes can reuse it.
+    """
+    if provider == "openai":
+        return llm_stream_gpt(prompt, model, system_p=system_p, context=context, cache=cache)
+    if provider == "anthropic":
+        return llm_stream_claude(prompt, model, system_p=system_p, context=context, cache=cache)
+    if provider == "groq":
+        return llm_stream_groq(_with_context(prompt, context), system_p=system_p, model=model, cache=cache)
+    if provider == "ollama":
+        return llm_stream_ollama(_with_context(prompt, context), system_p=system_p, LLM=model, cache=cache)
+    raise ValueError(f"Unknown provider: {provider}")
+
+def call_model(provider, model, prompt, system_p=system_message, cache="use", context=None):
+    """Completion text from any provider's model through the matching llm_call_* function; context as in stream_model."""
+    if provider == "openai":
+        return llm_call_gpt(prompt, model, system_p=system_p, context=context, cache=cache)
+    if provider == "anthropic":
+        return llm_call_claude(prompt, model, system_p=system_p, context=context, cache=cache)
+    if provider == "groq":
+        return llm_call_groq(_with_context(prompt, context), system_p=system_p, model=model,
+                             cache=cache).choices[0].message.content
+    if provider == "ollama":
+        return llm_call_ollama(_with_context(prompt, context), system_p=system_p, LLM=model, cache=cache)
+    raise ValueError(f"Unknown provider: {provider}")
 
 def submit_message_and_create_run(client, assistant_id, prompt):
     """
@@ -162,12 +315,10 @@ def submit_message_and_create_run(client, assistant_id, prompt):
     client.beta.threads.messages.create(thread_id=thread.id, role="user", content=prompt)
     return client.beta.threads.runs.create(thread_id=thread.id, assistant_id=assistant_id, temperature=0.6), thread
 
-def wait_on_run_and_get_response(client, run, thread):
+def wait_on_run_and_get_response(client, run, thread, timeout=RUN_TIMEOUT):
     """
-    Wait on run
+    Wait on run, polling with exponential backoff; cancels it after timeout seconds
     """
-    while run.status in ("queued","in_progress"):
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-        time.sleep(0.5)
+    run = wait_for_run(client, thread.id, run, timeout=timeout)
     messages = client.beta.threads.messages.list(thread_id=thread.id, order="asc")
     return [m.content[0].text.value for m in messages if m.role == 'assistant']
@@ -0,0 +1,96 @@
+"""
+Per-thread record of what the most recent llm_call_* on this thread consumed.
+
+Each provider call stores its prompt/completion token counts here so callers
+such as the eval runner can read them without changing return values. The
+traced_call and timed_stream decorators also copy the record onto a trace span.
+"""
+import time
+import threading
+from functools import wraps
+
+from utils.tracing import span
+
+_local = threading.local()
+
+def reset_usage():
+    _local.usage = {}
+
+def record_usage(prompt_tokens=None, completion_tokens=None, **extra):
+    """Store the usage of the call that just finished on this thread."""
+    _local.usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, **extra}
+
+def update_usage(**fields):
+    """Add fields to the usage record of the current call."""
+    usage = getattr(_local, "usage", None)
+    if usage is None:
+        usage = _local.usage = {}
+    usage.update(fields)
+
+def last_usage():
+    """Usage of the most recent call on this thread, or {} if nothing was recorded."""
+    return dict(getattr(_local, "usage", None) or {})
+
+def token_counts(provider, usage):
+    """
+    Token counts of a provider usage object. prompt_tokens counts every input
+    token; cached_tokens is the part read from the provider's prompt cache and
+    cache_write_tokens the part Anthropic wrote to it.
+    """
+    if provider == "anthropic":
+        cached = getattr(usage, "cache_read_input_tokens", None) or 0
+        written = getattr(usage, "cache_creation_input_tokens", None) or 0
+        return {"prompt_tokens": usage.input_tokens + cached + written, "completion_tokens": usage.output_tokens,
+                "cached_tokens": cached, "cache_write_tokens": written}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens,
+            "cached_tokens": getattr(details, "cached_tokens", None) or 0}
+
+def record_response_usage(provider, response):
+    """Pull token counts out of a provider response object and record them."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        record_usage()
+    else:
+        record_usage(**token_counts(provider, usage))
+    return response
+
+def traced_call(provider):
+    """Run each call of an llm_call_* function in an "llm.<name>" span carrying its usage record."""
+    def decorator(func):
+        name = f"llm.{func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, provider=provider) as s:
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    s.set(**last_usage())
+        return wrapper
+    return decorator
+
+def timed_stream(func):
+    """
+    Wrap a generator of text chunks so that time-to-first-token (ttft_s) and
+    total stream time (wall_s) land in this thread's usage record, and on an
+    "llm.<name>" span covering the whole stream.
+    """
+    name = f"llm.{func.__name__}"
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        reset_usage()
+        with span(name, activate=False, streamed=True) as s:
+            start = time.perf_counter()
+            first = True
+            try:
+                for chunk in func(*args, **kwargs):
+                    if first and chunk:
+                        update_usage(ttft_s=time.perf_counter() - start)
+                        first = False
+                    yield chunk
+                update_usage(wall_s=time.perf_counter() - start)
+            finally:
+                s.set(**last_usage())
+    return wrapper
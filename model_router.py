@@ -0,0 +1,322 @@
+"""
+Pick the model for each LLM call from historical eval results.
+
+config/info.json names one GPT_MODEL, which every call used to get however
+easy the task. The router keeps rolling statistics per task type for each
+candidate model listed under "routing": wall-time percentiles and error rate
+from the eval results store plus this process's own calls, and quality as the
+mean of graders' scores in the store's scores table. Each call goes to the
+cheapest candidate with enough history that meets its task type's quality bar
+and error-rate ceiling, the faster one (p95 wall time) on equal cost. Until
+some candidate qualifies, the task type's default model is used.
+
+    "routing": {
+        "models": [{"provider": "openai", "model": "gpt-4o-mini", "cost_per_mtok": 0.6}, ...],
+        "task_types": {"sql_simple": {"default": "gpt-4o-mini", "min_quality": 0.6}, ...},
+        "overrides": {"visualization": "gpt-4o"},
+        "max_error_rate": 0.1, "min_samples": 10, "window_days": 14
+    }
+
+Overrides, strongest first: a model passed by the caller, model_override()
+around the call, the GALEN_MODEL environment variable, then "overrides" in
+the routing config. Call sites limited to some providers skip overrides for
+other providers' models. Every decision is logged and set on the current span.
+
+The app routes "sql_simple" (the question needs one table), "sql" and
+"visualization"; complete() answers "planning" prompts with
+system_message_plan. Give eval tasks the same task types so their results
+and scores feed the router.
+
+    python model_router.py                          # routing table
+    python model_router.py --import-scores scores.jsonl
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+from settings import get_info
+from eval_results import RESULTS_PATH
+from utils.stats import percentile
+from utils.tracing import current_span
+
+log = logging.getLogger(__name__)
+
+REFRESH_S = 60                  # seconds between re-reads of the results store
+LIVE_WINDOW = 200               # most recent in-process calls kept per (task type, model)
+MIN_SAMPLES = 10                # calls a model needs for a task type before it can be routed to
+MIN_QUALITY = 0.7               # quality bar for task types without their own
+MAX_ERROR_RATE = 0.1            # error-rate ceiling for a routable model
+WINDOW_DAYS = 14                # age of the oldest eval results and scores used
+
+OVERRIDE_ENV = "GALEN_MODEL"
+HISTORY_COLUMNS = ("task_type", "provider", "model", "wall_s", "ok", "cache_hit")
+
+_override = contextvars.ContextVar("galen_model_override", default=None)
+
+@contextmanager
+def model_override(model):
+    """Route every call in this block (and threads started from its context) to model; None routes normally."""
+    token = _override.set(model or None)
+    try:
+        yield
+    finally:
+        _override.reset(token)
+
+def _num(value):
+    return "-" if value is None else f"{value:.2f}"
+
+def routing_config(info=None):
+    """The "routing" section of config/info.json, or None if routing is not configured."""
+    return (info if info is not None else get_info()).get("routing")
+
+class ModelRouter:
+    """Per (task type, provider, model) call statistics and the routing decisions made from them."""
+
+    def __init__(self, results_path=RESULTS_PATH, refresh_s=REFRESH_S):
+        self.results_path = results_path
+        self.refresh_s = refresh_s
+        self._history = {}          # (task_type, provider, model) -> [(wall_s, ok)] from the results store
+        self._quality = {}          # (task_type, provider, model) -> (mean score, scores)
+        self._live = {}             # (task_type, provider, model) -> deque of (wall_s, ok) from this process
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self, config):
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < self.refresh_s:
+            return
+        with self._lock:
+            if self._loaded_at is not None and now - self._loaded_at < self.refresh_s:
+                return
+            history, quality = {}, {}
+            if os.path.exists(self.results_path):
+                from eval_results import ResultsStore
+                since = time.time() - config.get("window_days", WINDOW_DAYS) * 86400
+                store = ResultsStore(self.results_path)
+                try:
+                    for row in store.fetch(since=since, columns=HISTORY_COLUMNS):
+                        if row["cache_hit"]:
+                            continue  # answered from the response cache, says nothing about the model
+                        key = (row["task_type"], row["provider"], row["model"])
+                        history.setdefault(key, []).append((row["wall_s"], bool(row["ok"])))
+                    quality = store.quality(since=since)
+                finally:
+                    store.close()
+            self._history, self._quality = history, quality
+            self._loaded_at = time.monotonic()
+            log.debug("Router loaded %d result groups and %d score groups", len(history), len(quality))
+
+    def reload(self):
+        """Re-read the results store on the next decision."""
+        self._loaded_at = None
+
+    def observe(self, decision, wall_s, ok):
+        """Count the outcome of a call made on a routing decision towards that model's statistics."""
+        key = (decision["task_type"], decision["provider"], decision["model"])
+        with self._lock:
+            live = self._live.get(key)
+            if live is None:
+                live = self._live[key] = deque(maxlen=LIVE_WINDOW)
+            live.append((wall_s, bool(ok)))
+
+    def stats(self, task_type, provider, model):
+        """Calls, error rate, wall-time percentiles and quality of a model on a task type."""
+        key = (task_type, provider, model)
+        with self._lock:
+            outcomes = self._history.get(key, []) + list(self._live.get(key, ()))
+            mean, scored = self._quality.get(key, (None, 0))
+        walls = [wall_s for wall_s, ok in outcomes if ok]
+        return {
+            "calls": len(outcomes),
+            "error_rate": sum(1 for _, ok in outcomes if not ok) / len(outcomes) if outcomes else None,
+            "wall_p50": percentile(walls, 50),
+            "wall_p95": percentile(walls, 95),
+            "quality": mean,
+            "scored": scored,
+        }
+
+    def candidates(self, task_type, config, providers=None):
+        """Each configured model allowed by providers, with its statistics and whether it meets the task type's bars."""
+        rules = config.get("task_types", {}).get(task_type, {})
+        min_quality = rules.get("min_quality", MIN_QUALITY)
+        min_samples = config.get("min_samples", MIN_SAMPLES)
+        max_error_rate = config.get("max_error_rate", MAX_ERROR_RATE)
+        result = []
+        for entry in config.get("models", []):
+            if providers is not None and entry["provider"] not in providers:
+                continue
+            stats = self.stats(task_type, entry["provider"], entry["model"])
+            if stats["calls"] < min_samples:
+                blocked = f"{stats['calls']} of {min_samples} calls"
+            elif stats["error_rate"] > max_error_rate:
+                blocked = f"error rate {stats['error_rate']:.0%}"
+            elif min_quality and (stats["quality"] is None or stats["quality"] < min_quality):
+                blocked = "not scored" if stats["quality"] is None else f"quality {stats['quality']:.2f} < {min_quality}"
+            else:
+                blocked = None
+            result.append({**entry, **stats, "blocked": blocked})
+        return result
+
+    def choose(self, task_type, providers=None, model=None):
+        """
+        The model for a call of task_type, as a dict of task_type, provider,
+        model and reason. providers restricts the choice to models of those
+        providers, for call sites that need provider-specific APIs; an override
+        naming another provider's model is ignored there, with a warning.
+        """
+        info = get_info()
+        config = routing_config(info)
+        override, source = model, "caller"
+        if override is None:
+            override, source = _override.get(), "model_override"
+        if override is None:
+            override, source = os.getenv(OVERRIDE_ENV) or None, OVERRIDE_ENV
+        if override is None and config:
+            override, source = config.get("overrides", {}).get(task_type), "config"
+
+        if override is None:
+            decision = self._route(task_type, info, providers)
+        else:
+            decision = self._decision(task_type, override, info, f"override from {source}")
+            if providers is not None and decision["provider"] not in providers:
+                log.warning("Ignoring %s override %s/%s for %s: this call needs a %s model", source,
+                            decision["provider"], override, task_type, " or ".join(providers))
+                decision = self._route(task_type, info, providers)
+                decision["reason"] += f"; {source} override {override} not allowed here"
+        log.info("Routed %s to %s/%s: %s", task_type, decision["provider"], decision["model"], decision["reason"])
+        current_span().set(route=f"{decision['provider']}/{decision['model']}", route_reason=decision["reason"])
+        return decision
+
+    def _route(self, task_type, info, providers):
+        """The decision without overrides: the cheapest qualifying candidate, else the task type's default."""
+        config = routing_config(info)
+        fallback = info.get("GPT_MODEL")
+        if not config:
+            return self._decision(task_type, fallback, info, "GPT_MODEL, routing not configured")
+        self._refresh(config)
+        eligible = [c for c in self.candidates(task_type, config, providers) if c["blocked"] is None]
+        if eligible:
+            best = min(eligible, key=lambda c: (c.get("cost_per_mtok", float("inf")),
+                                                c["wall_p95"] if c["wall_p95"] is not None else float("inf")))
+            return {"task_type": task_type, "provider": best["provider"], "model": best["model"],
+                    "reason": f"cheapest of {len(eligible)} qualifying (quality {_num(best['quality'])}, "
+                              f"p95 {_num(best['wall_p95'])}s)"}
+        default = config.get("task_types", {}).get(task_type, {}).get("default") or fallback
+        decision = self._decision(task_type, default, info, "default, no model qualifies yet")
+        if providers is not None and decision["provider"] not in providers:
+            decision = self._decision(task_type, fallback, info, "GPT_MODEL, default not allowed here")
+        return decision
+
+    @staticmethod
+    def _decision(task_type, model, info, reason):
+        """A decision for a named model, its provider looked up among the routing and eval models."""
+        models = (routing_config(info) or {}).get("models", []) + info.get("eval_models", [])
+        provider = next((entry["provider"] for entry in models if entry["model"] == model), "openai")
+        return {"task_type": task_type, "provider": provider, "model": model, "reason": reason}
+
+    def table(self):
+        """Routing decision and candidate statistics for every configured task type."""
+        config = routing_config() or {}
+        self._refresh(config)
+        return {task_type: {"decision": self.choose(task_type), "candidates": self.candidates(task_type, config)}
+                for task_type in config.get("task_types", {})}
+
+_router = None
+_lock = threading.Lock()
+
+def get_router():
+    global _router
+    if _router is None:
+        with _lock:
+            if _router is None:
+                _router = ModelRouter()
+    return _router
+
+def route(task_type, providers=None, model=None):
+    """Routing decision for one call of task_type; see ModelRouter.choose."""
+    return get_router().choose(task_type, providers=providers, model=model)
+
+def observe(decision, wall_s, ok):
+    get_router().observe(decision, wall_s, ok)
+
+def complete(task_type, prompt, system_p=None, providers=None, model=None):
+    """Answer prompt with the model routed for task_type; "planning" defaults to system_message_plan."""
+    from llms.llms import call_model, system_message, system_message_plan
+    from llms.usage import reset_usage, last_usage
+    if system_p is None:
+        system_p = system_message_plan if task_type == "planning" else system_message
+    decision = route(task_type, providers=providers, model=model)
+    reset_usage()
+    start = time.perf_counter()
+    try:
+        text = call_model(decision["provider"], decision["model"], prompt, system_p=system_p)
+    except Exception:
+        observe(decision, time.perf_counter() - start, ok=False)
+        raise
+    if not last_usage().get("cache_hit"):
+        observe(decision, time.perf_counter() - start, ok=True)
+    return text
+
+def read_scores(path, info=None):
+    """
+    Scores from a JSONL file, one {"run_id", "task_id", "model", "score"} per
+    line, or "rank" and "of" instead of score (rank 1 of n scores 1.0, rank n
+    scores 0.0). "provider" may be left out for models listed in info.json.
+    """
+    info = info if info is not None else get_info()
+    providers = {entry["model"]: entry["provider"]
+                 for entry in info.get("eval_models", []) + (routing_config(info) or {}).get("models", [])}
+    scores = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            score = json.loads(line)
+            if "score" not in score:
+                of = score["of"]
+                score["score"] = (of - score["rank"]) / (of - 1) if of > 1 else 1.0
+            score.setdefault("provider", providers.get(score["model"]))
+            if score["provider"] is None:
+                raise ValueError(f"No provider given or configured for model {score['model']}")
+            scores.append(score)
+    return scores
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show how LLM calls are routed, or import graders' scores.")
+    parser.add_argument("--import-scores", metavar="JSONL", help="record the scores in this file in the results store")
+    parser.add_argument("--results", default=RESULTS_PATH, help="results store (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.import_scores:
+        from eval_results import ResultsStore
+        scores = read_scores(args.import_scores)
+        store = ResultsStore(args.results)
+        try:
+            store.record_scores(scores)
+        finally:
+            store.close()
+        print(f"Recorded {len(scores)} scores in {args.results}")
+        return 0
+
+    global _router
+    _router = ModelRouter(results_path=args.results)
+    for task_type, entry in _router.table().items():
+        decision = entry["decision"]
+        print(f"{task_type}: {decision['provider']}/{decision['model']} ({decision['reason']})")
+        for c in entry["candidates"]:
+            print(f"    {c['provider']}/{c['model']}: calls={c['calls']} error_rate={_num(c['error_rate'])} "
+                  f"p50={_num(c['wall_p50'])}s p95={_num(c['wall_p95'])}s quality={_num(c['quality'])} ({c['scored']} scored)"
+                  f"{'  -- ' + c['blocked'] if c['blocked'] else ''}")
+    return 0
+
+if __name__ == "__main__":
+    from utils.logs import configure_logging
+    configure_logging()
+    sys.exit(main())
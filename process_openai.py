@@ -1,9 +1,21 @@
-import os
-import json
-import subprocess
-from openai import OpenAI
-from util import read_json, get_schema_and_table_list, execute_function_call, visualise
+import time
+import logging
+from types import SimpleNamespace
+from llms.clients import get_openai_client
+from llms.usage import update_usage, reset_usage, last_usage, token_counts
+from util import execute_function_call, visualise
+from prompt_builder import build_sql_prompt
 from custom_functions import custom_functions
+from run_sql import QueryError
+from utils.tracing import traced, current_span
+from utils.retry import resilient, resilient_stream, attempt_timeout
+from utils.preload import preload
+from model_router import route, observe
+
+log = logging.getLogger(__name__)
+
+MAX_REPAIRS = 1     # rewrites asked of the model after a failed query
+SQL_PROVIDERS = ("openai",)     # the SQL tool call uses OpenAI tool calling
 
 def process_query(query):
     if isinstance(query, list) and all(isinstance(item, dict) and 'role' in item and 'content' in item for item in query):
@@ -11,66 +23,144 @@ def process_query(query):
     else:
         return [{'role': 'user', 'content': query}]
 
-def call_fn(client, query, model, tools, toolchoice=None):
-    if toolchoice is None:
-        response = client.chat.completions.create(
-            model=model,
-            messages=process_query(query),
-            tools=tools,
-            tool_choice='auto',
-        )
-    else:
-        response = client.chat.completions.create(
-            model=model,
-            messages=process_query(query),
-            tools=tools,
-            tool_choice={"type": "function", "function": {"name": toolchoice}},
-        )
-    return response
-
-def main(query):
-    dirname = os.getcwd()
-    config_path = os.path.join(dirname, 'config')
-    info = read_json(os.path.join(config_path, 'info.json'))
-
-    GPT_MODEL = info.get('GPT_MODEL')
-
-    client = OpenAI()
-
-    subprocess.run(['python3', 'get_table_schema.py'])
-    final_schema, tables = get_schema_and_table_list(config_path)
-    query = f"""Extract dependency data for gene EP300, group them by OncotreeLineage and calculate averages. The schema is {final_schema} and {tables}.
-    The databases are already attached as: 
-    ATTACH DATABASE 'db/ProteinNetwork.db' AS ProteinNetwork
-    ATTACH DATABASE 'db/DepMap.db' AS DepMap
-
-    Ensure we use those names. You do not need to attach the DBs again. Make sure you use the right table names. You are writing a SQL query to answer the question from SQLITE."""
-    
-    response = call_fn(client, query, GPT_MODEL, custom_functions)
-
-    # Debugging: Print the entire response object
-    print("Response object:", response)
-
-    # Extract the dataframe
-    df = execute_function_call(response)
+def record_tokens(usage):
+    """Token counts, including those read from OpenAI's prompt cache, on the usage record and the current span."""
+    counts = token_counts("openai", usage)
+    update_usage(**counts)
+    current_span().set(**counts)
+
+@traced("llm.tool_choice")
+def call_fn(client, query, model, tools, toolchoice=None, on_delta=None, cache_key=None):
+    """
+    Ask the model to pick a tool. With on_delta set the response is streamed and
+    on_delta(text_so_far) is called as content or tool arguments arrive.
+    cache_key is sent as OpenAI's prompt_cache_key, so requests sharing a
+    prompt prefix are routed to the same prompt cache.
+    """
+    tool_choice = 'auto' if toolchoice is None else {"type": "function", "function": {"name": toolchoice}}
+    current_span().set(model=model, streamed=on_delta is not None)
+    extra = {"prompt_cache_key": cache_key} if cache_key else {}
+    request = dict(model=model, messages=process_query(query), tools=tools, tool_choice=tool_choice, **extra)
+    if on_delta is None:
+        response = create_completion(client, request)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            record_tokens(usage)
+        return response
+    return collect_stream(stream_completion(client, request), on_delta)
+
+@resilient("openai")
+def create_completion(client, request):
+    return client.chat.completions.create(**request, timeout=attempt_timeout())
+
+@resilient_stream("openai")
+def stream_completion(client, request):
+    """Chunks of a streamed completion; retried only until the first chunk arrives."""
+    yield from client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True},
+                                              timeout=attempt_timeout())
+
+def collect_stream(stream, on_delta):
+    """
+    Assemble a streamed chat completion into the response shape that
+    execute_function_call reads, reporting partial text along the way.
+    Time-to-first-token is recorded in llms.usage.
+    """
+    start = time.perf_counter()
+    text, content, tool_calls = "", "", {}
+    for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            record_tokens(chunk.usage)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        piece = delta.content or ""
+        content += piece
+        for tc in delta.tool_calls or []:
+            entry = tool_calls.setdefault(tc.index, {"id": None, "name": "", "arguments": ""})
+            entry["id"] = tc.id or entry["id"]
+            if tc.function is not None:
+                entry["name"] += tc.function.name or ""
+                entry["arguments"] += tc.function.arguments or ""
+                piece += tc.function.arguments or ""
+        if piece:
+            if not text:
+                update_usage(ttft_s=time.perf_counter() - start)
+                current_span().set(ttft_s=time.perf_counter() - start)
+            text += piece
+            on_delta(text)
+    update_usage(wall_s=time.perf_counter() - start)
+    message = SimpleNamespace(
+        role="assistant",
+        content=content or None,
+        tool_calls=[
+            SimpleNamespace(id=tc["id"], type="function", function=SimpleNamespace(name=tc["name"], arguments=tc["arguments"]))
+            for _, tc in sorted(tool_calls.items())
+        ] or None,
+    )
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+def question_text(query):
+    """Pull the user's question out of a plain string or a list of chat messages."""
+    if isinstance(query, list):
+        parts = [str(m.get('content', '')) for m in query if isinstance(m, dict) and m.get('role', 'user') == 'user']
+        return " ".join(parts) if parts else " ".join(map(str, query))
+    return str(query)
+
+@traced("process_openai")
+def main(query, on_delta=None, make_chart=True):
+    # The results come back as a DataFrame; import pandas while the model is writing the SQL
+    preload("pandas")
+
+    client = get_openai_client()
+
+    prompt = build_sql_prompt(question_text(query))
+    # Questions that need a single table are simple enough for a fast model
+    decision = route("sql_simple" if len(prompt.tables) == 1 else "sql", providers=SQL_PROVIDERS)
+
+    for attempt in range(MAX_REPAIRS + 1):
+        reset_usage()
+        start = time.perf_counter()
+        try:
+            response = call_fn(client, prompt.messages(), decision["model"], custom_functions, on_delta=on_delta,
+                               cache_key=prompt.cache_key)
+        except Exception:
+            observe(decision, time.perf_counter() - start, ok=False)
+            raise
+        wall_s = time.perf_counter() - start
+        # A response served from the cache says nothing new about the model
+        cached = bool(last_usage().get("cache_hit"))
+
+        log.debug("Response object: %s", response)
+
+        try:
+            df = execute_function_call(response)
+            if not cached:
+                observe(decision, wall_s, ok=True)
+            break
+        except QueryError as e:
+            # A query the user cancelled says nothing about the model that wrote it
+            if e.kind != "cancelled" and not cached:
+                observe(decision, wall_s, ok=False)
+            # Give the model one chance to rewrite a query that failed, ran too long or was refused
+            if attempt == MAX_REPAIRS or e.kind == "cancelled":
+                raise
+            log.warning("Query failed (%s), asking for a rewrite: %s", e.kind, e)
+            current_span().incr("repairs")
+            prompt.add_hint(e.repair_hint())
+            if decision["task_type"] == "sql_simple":
+                decision = route("sql", providers=SQL_PROVIDERS)
+
     if df is not None:
-        chart = visualise(df)
+        if make_chart:
+            chart = visualise(df)
         return df
     else:
-        print("Failed to extract dataframe")
+        log.warning("Failed to extract dataframe")
         return None
 
 if __name__ == '__main__':
-    dirname = os.getcwd()
-    config_path = os.path.join(dirname, 'config')
-    subprocess.run(['python3', 'get_table_schema.py'])
-    final_schema, tables = get_schema_and_table_list(config_path)
-    query = f"""Extract dependency data for gene EP300, group them by OncotreeLineage and calculate averages. The schema is {final_schema} and {tables}.
-    The databases are already attached as: 
-    ATTACH DATABASE 'db/ProteinNetwork.db' AS ProteinNetwork
-    ATTACH DATABASE 'db/DepMap.db' AS DepMap
-
-    Ensure we use those names. You do not need to attach the DBs again. Make sure you use the right table names. You are writing a SQL query to answer the question from SQLITE."""
-    
+    from utils.logs import configure_logging
+    configure_logging()
+    query = "Extract dependency data for gene EP300, group them by OncotreeLineage and calculate averages."
     result = main(query)
     print(result)
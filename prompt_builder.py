@@ -0,0 +1,75 @@
+"""
+SQL-generation prompts laid out so providers can reuse their prefix.
+
+OpenAI caches the longest previously seen prefix of a request (tool
+definitions, then messages) once it passes 1024 tokens; Anthropic caches up to
+each cache_control breakpoint. Either way a prefix is only reused if it is
+byte-identical, and the question used to sit in the middle of the prompt with
+the schema after it. SqlPrompt keeps three parts, most stable first:
+
+    system      persona and SQL rules, the same for every question
+    context     schema of the selected tables in a fixed order and the attach
+                lines, the same for every question that needs the same tables
+    question    the question and any repair hints, always last
+
+The tool definitions from custom_functions are sent ahead of all three and do
+not change. Column pruning for wide tables still depends on the question (see
+schema_index.select), so such tables only share a prefix between similar
+questions.
+"""
+import hashlib
+
+from db_connection import db_alias
+from schema_index import get_schema_index, format_schema
+from utils.tracing import traced, current_span
+
+SQL_RULES = (
+    "The databases are already attached under the names given with the schema. Ensure we use those names. "
+    "You do not need to attach the DBs again. Make sure you use the right table names. "
+    "You are writing a SQL query to answer the question from SQLITE."
+)
+
+class SqlPrompt:
+    """The parts of one SQL-generation prompt, rendered for each provider's API."""
+
+    def __init__(self, system, context, question, tables):
+        self.system = system
+        self.context = context
+        self.question = question
+        self.tables = tables
+
+    def add_hint(self, hint):
+        """Append a repair hint after the question, leaving the cached prefix alone."""
+        self.question = f"{self.question}\n\n{hint}"
+
+    @property
+    def cache_key(self):
+        """Short digest of the static parts; OpenAI's prompt_cache_key routes equal prefixes to the same cache."""
+        return hashlib.sha256(f"{self.system}\0{self.context}".encode("utf-8")).hexdigest()[:16]
+
+    def messages(self):
+        """OpenAI chat messages: system, context, then question."""
+        from llms.llms import gpt_messages
+        return gpt_messages(self.question, self.system, self.context)
+
+    def text(self):
+        """The whole prompt as one string, static parts first, for single-input calls."""
+        return f"{self.system}\n\n{self.context}\n\n{self.question}"
+
+def schema_block(subset, join_keys):
+    """Schema and attach lines for a set of tables, in an order that does not depend on the question."""
+    subset = {table_key: subset[table_key] for table_key in sorted(subset)}
+    db_files = sorted({table_key.partition(" in ")[2] for table_key in subset})
+    attach_lines = "\n".join(f"    ATTACH DATABASE '{db_file}' AS {db_alias(db_file)}" for db_file in db_files)
+    return f"""The schema is:
+{format_schema(subset, sorted(join_keys))}
+    The databases are already attached as:
+{attach_lines}"""
+
+@traced("build_sql_prompt")
+def build_sql_prompt(question):
+    """SqlPrompt for a question, carrying only the part of the schema the question needs."""
+    from llms.llms import system_message
+    subset, tables, join_keys = get_schema_index().select(question)
+    current_span().set(tables=len(tables))
+    return SqlPrompt(f"{system_message}\n\n{SQL_RULES}", schema_block(subset, join_keys), question, sorted(tables))
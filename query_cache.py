@@ -0,0 +1,176 @@
+"""
+In-memory cache of SQL query results.
+
+Results are keyed on the normalized SQL text (whitespace collapsed, keywords
+upper-cased, string literals untouched) plus a fingerprint of the attached
+.db files, and stored as compressed per-column blobs under a memory budget
+with least-recently-used eviction. When any database file changes every
+entry is dropped, so a stale result is never served.
+"""
+import os
+import re
+import zlib
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+from db_connection import DB_DIRECTORY, find_db_files
+
+MAX_BYTES = 256 * 1024 * 1024     # budget for stored (compressed) results
+MAX_ENTRY_BYTES = 32 * 1024 * 1024  # larger results are not cached
+
+_LITERAL = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+def normalize_sql(sql_query):
+    """Collapse whitespace and upper-case everything outside quoted literals."""
+    parts = _LITERAL.split(sql_query.strip())
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2:  # quoted literal or identifier
+            normalized.append(part)
+        else:
+            part = re.sub(r"\s+", " ", _COMMENT.sub(" ", part)).upper()
+            normalized.append(re.sub(r"\s*([(),=<>])\s*", r"\1", part))
+    return "".join(normalized).strip().rstrip("; ")
+
+def sql_shape(sql_query):
+    """Normalized SQL with string and number literals replaced by '?'."""
+    parts = _LITERAL.split(normalize_sql(sql_query))
+    shaped = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            shaped.append("?" if part.startswith("'") else part)
+        else:
+            shaped.append(re.sub(r"(?<![\w.])\d+(?:\.\d*)?(?:E[-+]?\d+)?", "?", part))
+    return "".join(shaped)
+
+def db_fingerprint(db_directory=DB_DIRECTORY):
+    """(path, size, mtime_ns) of every attached database file and its write-ahead log."""
+    fingerprint = []
+    for db_file in find_db_files(db_directory):
+        for path in (db_file, db_file + "-wal"):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            fingerprint.append((path, st.st_size, st.st_mtime_ns))
+    return tuple(fingerprint)
+
+def encode_frame(df):
+    """Serialize a DataFrame column by column into one compressed blob."""
+    columns = [df.iloc[:, i].to_numpy() for i in range(df.shape[1])]
+    payload = {"names": list(df.columns), "columns": columns, "attrs": dict(df.attrs)}
+    return zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+def decode_frame(blob):
+    import pandas as pd
+    payload = pickle.loads(zlib.decompress(blob))
+    df = pd.DataFrame({i: column for i, column in enumerate(payload["columns"])})
+    df.columns = payload["names"]
+    df.attrs.update(payload["attrs"])
+    return df
+
+class QueryCache:
+    """LRU cache of encoded query results with hit-rate and bytes-saved counters."""
+
+    def __init__(self, max_bytes=MAX_BYTES, db_directory=DB_DIRECTORY):
+        self.max_bytes = max_bytes
+        self.db_directory = db_directory
+        self._entries = OrderedDict()   # key -> (blob, result_bytes)
+        self._stored_bytes = 0
+        self._fingerprint = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bytes_saved": 0, "evictions": 0, "invalidations": 0}
+
+    def _check_fingerprint(self):
+        fingerprint = db_fingerprint(self.db_directory)
+        if fingerprint != self._fingerprint:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self._stored_bytes = 0
+            self._fingerprint = fingerprint
+        return fingerprint
+
+    @staticmethod
+    def make_key(sql_query, fingerprint, *options):
+        payload = repr((normalize_sql(sql_query), fingerprint, options))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, sql_query, *options):
+        """
+        Return (result_df, fingerprint): a fresh DataFrame for a cached query or
+        None on a miss, plus the database fingerprint to hand back to put().
+        """
+        with self._lock:
+            fingerprint = self._check_fingerprint()
+            key = self.make_key(sql_query, fingerprint, *options)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None, fingerprint
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            self.stats["bytes_saved"] += entry[1]
+        result_df = decode_frame(entry[0])
+        result_df.attrs["cache_hit"] = True
+        return result_df, fingerprint
+
+    def put(self, sql_query, result_df, *options, fingerprint=None):
+        """
+        Store a result. Passing the fingerprint from get() skips the store if a
+        database changed while the query ran.
+        """
+        blob = encode_frame(result_df)
+        if len(blob) > min(MAX_ENTRY_BYTES, self.max_bytes):
+            return False
+        result_bytes = int(result_df.memory_usage(index=False, deep=True).sum())
+        with self._lock:
+            current = self._check_fingerprint()
+            if fingerprint is not None and fingerprint != current:
+                return False
+            key = self.make_key(sql_query, current, *options)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._stored_bytes -= len(old[0])
+            self._entries[key] = (blob, result_bytes)
+            self._stored_bytes += len(blob)
+            while self._stored_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._stored_bytes -= len(evicted)
+                self.stats["evictions"] += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stored_bytes = 0
+
+    def report(self):
+        """Counters plus hit rate, entry count and stored bytes."""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "stored_bytes": self._stored_bytes,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_query_cache():
+    """Process-wide query result cache, created on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = QueryCache()
+    return _cache
+
+def is_cacheable(sql_query):
+    """Only read-only statements are cached."""
+    return normalize_sql(sql_query).startswith(("SELECT", "WITH"))
@@ -0,0 +1,184 @@
+"""
+Append-only, structured log of executed SQL queries.
+
+Callers take the result's shape, a content hash and a copy of its first rows,
+and hand those to a background writer thread, so the queue never holds whole
+result frames (nor ones the caller goes on to change). The writer formats the
+bounded preview and appends batches of JSON lines to logs/query_log.jsonl,
+rotating the file once it passes MAX_BYTES. read_entries() and latency_stats()
+read it back.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import hashlib
+import logging
+import threading
+
+from utils.stats import percentile
+
+log = logging.getLogger(__name__)
+
+LOG_PATH = os.path.join("logs", "query_log.jsonl")
+MAX_BYTES = 10 * 1024 * 1024      # rotate the log past this size
+BACKUP_COUNT = 5                  # rotated files kept: query_log.jsonl.1 ... .5
+BATCH_SIZE = 200                  # entries written per flush at most
+FLUSH_INTERVAL = 0.5              # seconds the writer waits to fill a batch
+PREVIEW_ROWS = 10
+PREVIEW_CHARS = 2000
+
+def result_hash(result_df):
+    """Content hash of a DataFrame's columns and values."""
+    digest = hashlib.sha256(repr(list(result_df.columns)).encode("utf-8"))
+    if len(result_df):
+        import pandas as pd
+        digest.update(pd.util.hash_pandas_object(result_df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:32]
+
+def result_preview(result_df, rows=PREVIEW_ROWS, max_chars=PREVIEW_CHARS):
+    """First rows of a result as JSON-ready records, cut to max_chars of JSON."""
+    records = json.loads(result_df.head(rows).to_json(orient="records", date_format="iso", default_handler=str))
+    while records and len(json.dumps(records, default=str)) > max_chars:
+        records.pop()
+    return records
+
+class QueryLog:
+    """Background JSONL writer for query log entries, with size-based rotation."""
+
+    def __init__(self, path=LOG_PATH, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT,
+                 preview_rows=PREVIEW_ROWS, preview_chars=PREVIEW_CHARS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.preview_rows = preview_rows
+        self.preview_chars = preview_chars
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, sql_query, result_df=None, latency_s=None, error=None, **fields):
+        """Queue one entry; never blocks the caller on disk I/O."""
+        entry = {"ts": time.time(), "sql": sql_query, "latency_ms": None if latency_s is None else latency_s * 1000,
+                 "error": None if error is None else str(error), **fields}
+        head = None
+        if result_df is not None:
+            entry["rows"], entry["columns"] = result_df.shape
+            entry["result_hash"] = result_hash(result_df)
+            if self.preview_rows:
+                head = result_df.head(self.preview_rows).copy()
+        try:
+            self._queue.put_nowait((entry, head))
+        except queue.Full:
+            self.dropped += 1
+
+    def _complete(self, entry, head):
+        if head is not None:
+            entry["preview"] = result_preview(head, self.preview_rows, self.preview_chars)
+        entry["time"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(entry["ts"]))
+        return json.dumps(entry, default=str)
+
+    def _rotate(self):
+        for i in range(self.backup_count, 0, -1):
+            source = self.path if i == 1 else f"{self.path}.{i - 1}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i}")
+
+    def _write(self, lines):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        if os.path.getsize(self.path) > self.max_bytes:
+            self._rotate()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE and item is not None:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                batch.append(item)
+            lines = []
+            for item in batch:
+                if item is None:
+                    stop = True
+                    continue
+                try:
+                    lines.append(self._complete(*item))
+                except Exception as e:
+                    log.warning("Could not log query: %s", e)
+            if lines:
+                try:
+                    self._write(lines)
+                except OSError as e:
+                    log.warning("Could not write query log: %s", e)
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued entry is on disk."""
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+def get_query_log(path=LOG_PATH):
+    """Process-wide query log for a path, started on first use."""
+    query_log = _logs.get(path)
+    if query_log is None:
+        with _logs_lock:
+            query_log = _logs.get(path)
+            if query_log is None:
+                query_log = _logs[path] = QueryLog(path)
+    return query_log
+
+def read_entries(path=LOG_PATH, include_rotated=True):
+    """Yield logged entries, oldest first, including rotated files."""
+    paths = [path]
+    if include_rotated:
+        paths = [f"{path}.{i}" for i in range(BACKUP_COUNT, 0, -1)] + paths
+    for log_path in paths:
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path, "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+def latency_stats(entries=None, since=None):
+    """Count, error rate and latency percentiles (ms) over log entries."""
+    entries = read_entries() if entries is None else entries
+    latencies, count, errors = [], 0, 0
+    for entry in entries:
+        if since is not None and entry["ts"] < since:
+            continue
+        count += 1
+        if entry.get("error"):
+            errors += 1
+        elif entry.get("latency_ms") is not None:
+            latencies.append(entry["latency_ms"])
+    return {
+        "queries": count,
+        "errors": errors,
+        "error_rate": errors / count if count else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else None,
+    }
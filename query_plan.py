@@ -0,0 +1,154 @@
+"""
+Reading SQLite query plans.
+
+EXPLAIN QUERY PLAN steps are matched back to the attached tables they touch,
+and a rough cost (rows visited) is estimated from per-table row counts: nested
+SCANs multiply, SEARCHes through an index add a small fan-out, and automatic
+indexes pay for one pass over their table. Used by run_sql's cost guard and by
+the index advisor.
+"""
+import re
+import sqlite3
+import threading
+
+from db_connection import db_alias
+from schema_catalog import get_catalog
+
+SEARCH_ROWS = 10            # rows assumed per lookup through an index
+
+SQL_KEYWORDS = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "NATURAL", "OUTER", "ON", "USING",
+    "GROUP", "ORDER", "LIMIT", "HAVING", "UNION", "EXCEPT", "INTERSECT", "WINDOW", "AS",
+}
+_FROM_CLAUSE = re.compile(
+    r"\bFROM\s+(.*?)(?=\bWHERE\b|\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|\bHAVING\b"
+    r"|\bUNION\b|\bEXCEPT\b|\bINTERSECT\b|\bWINDOW\b|;|$)", re.IGNORECASE | re.DOTALL)
+_FROM_ITEM_SPLIT = re.compile(r",|\b(?:(?:NATURAL|LEFT|RIGHT|FULL|INNER|CROSS|OUTER)\s+)*JOIN\b", re.IGNORECASE)
+_TABLE_REF = re.compile(r'^\s*((?:"?\w+"?\s*\.\s*)?"?\w+"?)(?:\s+(?:AS\s+)?("?\w+"?))?', re.IGNORECASE)
+PLAN_STEP = re.compile(r"^(SCAN|SEARCH) (\S+)(?: USING (AUTOMATIC (?:PARTIAL )?COVERING INDEX|.*INDEX \S+)(?: \((.*)\))?)?")
+
+def explain(conn, sql_query):
+    """EXPLAIN QUERY PLAN rows as (id, parent, detail)."""
+    return [(row[0], row[1], row[3]) for row in conn.execute(f"EXPLAIN QUERY PLAN {sql_query}").fetchall()]
+
+def _unquote(name):
+    return name.strip().strip('"')
+
+def table_aliases(sql_query):
+    """{alias or table name: (schema or None, table)} for every table in a FROM clause or JOIN."""
+    # Read parenthesised parts (subqueries, function calls) innermost first, then what is left
+    segments, text = [], sql_query
+    while True:
+        inner = re.search(r"\(([^()]*)\)", text)
+        if inner is None:
+            break
+        segments.append(inner.group(1))
+        text = f"{text[:inner.start()]} _subquery_ {text[inner.end():]}"
+    segments.append(text)
+
+    aliases = {}
+    for segment in segments:
+        for clause in _FROM_CLAUSE.findall(segment):
+            for item in _FROM_ITEM_SPLIT.split(clause):
+                match = _TABLE_REF.match(item)
+                if not match:
+                    continue
+                reference, alias = match.groups()
+                schema, _, table = (_unquote(p) for p in reference.rpartition("."))
+                entry = (schema or None, table)
+                aliases[table] = entry
+                if alias and _unquote(alias).upper() not in SQL_KEYWORDS:
+                    aliases[_unquote(alias)] = entry
+    return aliases
+
+def tables_by_db(catalog=None):
+    """{db_file: {table: set of column names}} from the schema catalog."""
+    catalog = catalog or get_catalog()
+    catalog.refresh()
+    tables = {}
+    for table_key, columns in catalog.schema().items():
+        table, _, db_file = table_key.partition(" in ")
+        tables.setdefault(db_file, {})[table] = {c["column_name"] for c in columns}
+    return tables
+
+def resolve_table(schema, table, tables):
+    """db file holding a table: the named schema's file, or the first attached db that has it."""
+    for db_file, db_tables in tables.items():
+        if (schema is None or db_alias(db_file) == schema) and table in db_tables:
+            return db_file
+    return None
+
+_row_counts = {}
+_row_counts_lock = threading.Lock()
+
+def table_rows(conn, db_file, table):
+    """
+    Approximate row count of an attached table: MAX(rowid), which is an index
+    lookup, or COUNT(*) for WITHOUT ROWID tables. Cached until the db file changes.
+    """
+    key = (db_file, table, get_catalog().fingerprints().get(db_file))
+    with _row_counts_lock:
+        if key in _row_counts:
+            return _row_counts[key]
+    target = f'"{db_alias(db_file)}"."{table}"'
+    try:
+        rows = conn.execute(f"SELECT MAX(rowid) FROM {target}").fetchone()[0]
+    except sqlite3.OperationalError:
+        rows = conn.execute(f"SELECT COUNT(*) FROM {target}").fetchone()[0]
+    with _row_counts_lock:
+        _row_counts[key] = rows or 0
+    return rows or 0
+
+def plan_steps(conn, sql_query, plan=None):
+    """
+    Loop steps of a query plan matched to their tables, as dicts with parent,
+    detail, kind (scan / search / automatic), db_file, table, rows and index_columns.
+    Steps on tables that are not in the catalog (CTEs, subqueries) have db_file None.
+    """
+    plan = explain(conn, sql_query) if plan is None else plan
+    aliases = table_aliases(sql_query)
+    tables = tables_by_db()
+    steps = []
+    for _, parent, detail in plan:
+        match = PLAN_STEP.match(detail)
+        if not match:
+            continue
+        step, name, index, index_columns = match.groups()
+        if index and index.startswith("AUTOMATIC"):
+            kind = "automatic"
+        elif step == "SCAN":
+            kind = "scan" if not index or "COVERING" not in index else "index_scan"
+        else:
+            kind = "search"
+        schema, table = aliases.get(name, (None, name))
+        db_file = resolve_table(schema, table, tables)
+        steps.append({
+            "parent": parent, "detail": detail, "kind": kind, "name": name, "table": table, "db_file": db_file,
+            "rows": table_rows(conn, db_file, table) if db_file else None,
+            "index_columns": re.findall(r"(\w+)=\?", index_columns or ""),
+        })
+    return steps
+
+def estimate_cost(conn, sql_query):
+    """
+    Rough number of rows a query visits, and the plan steps it was estimated from.
+    Steps under the same parent are nested loops, so their row counts multiply.
+    """
+    steps = plan_steps(conn, sql_query)
+    loops = {}
+    for step in steps:
+        loops.setdefault(step["parent"], []).append(step)
+    total = 0
+    for group in loops.values():
+        visited, build = 1, 0
+        for step in group:
+            rows = step["rows"] if step["rows"] is not None else SEARCH_ROWS
+            if step["kind"] in ("scan", "index_scan"):
+                visited *= max(rows, 1)
+            elif step["kind"] == "automatic":
+                build += rows
+                visited *= SEARCH_ROWS
+            else:
+                visited *= SEARCH_ROWS
+        total += visited + build
+    return total, steps
@@ -0,0 +1,252 @@
+"""
+Run an evaluation task file against every configured model concurrently.
+
+Each task is fanned out to all models listed under "eval_models" in
+config/info.json. Calls run on a thread pool with a concurrency limit and a
+requests-per-minute rate limit per provider, and every call's wall time,
+time-to-first-token, token counts and retries are written to the eval results store.
+
+    python run_evals.py --tasks requests.jsonl
+    python run_evals.py --tasks requests.jsonl --hedge    # one hedged call per task, see llms/hedging.py
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from eval_results import ResultsStore, RESULTS_PATH, summarize, summarize_hedging
+from utils import configure_logging, resilience_stats
+from settings import get_info
+
+TASKS_PATH = "requests.jsonl"
+
+# Used when config/info.json has no eval_concurrency / eval_rate_limits entry for a provider
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RATE_LIMIT = 60      # requests per minute
+
+# What utils.retry noted about a call; kept in the results' extra column
+RESILIENCE_FIELDS = ("retries", "retry_wait_s", "circuit_open", "deadline_exceeded", "retry_budget_exhausted")
+# Input tokens read from and written to the provider's prompt cache
+PROMPT_CACHE_FIELDS = ("cached_tokens", "cache_write_tokens")
+# What llms.hedging reported about a hedged call
+HEDGE_FIELDS = ("hedged", "failover", "winner", "hedge_delay_s", "primary_ttft_s", "cancelled")
+
+def load_tasks(path=TASKS_PATH):
+    """
+    Read a JSONL task file. Each line needs an id (task_id/request_id/id) and a
+    prompt (prompt/question/body); type/task_type and system are optional, and
+    so is context, sent ahead of the prompt where the provider can cache it.
+    """
+    tasks = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            prompt = record.get("prompt") or record.get("question") or record.get("body")
+            if prompt is None:
+                raise ValueError(f"{path}:{line_number}: task has no prompt/question/body field")
+            if record.get("title") and record.get("body") and not record.get("prompt"):
+                prompt = f"{record['title']}\n\n{prompt}"
+            tasks.append({
+                "task_id": str(record.get("task_id") or record.get("request_id") or record.get("id") or line_number),
+                "task_type": record.get("task_type") or record.get("type") or "general",
+                "prompt": prompt,
+                "system": record.get("system"),
+                "context": record.get("context"),
+            })
+    return tasks
+
+class RateLimiter:
+    """Token bucket allowing `rate_per_minute` calls with bursts up to `burst`."""
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or max(1, int(rate_per_minute // 10))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def call_model(provider, model, prompt, system=None, cache="use", context=None):
+    """
+    Call one provider through the streaming llms.llms functions and return the
+    full response text; time-to-first-token is left in llms.usage.last_usage().
+    """
+    from llms import llms
+    return "".join(llms.stream_model(provider, model, prompt, system or llms.system_message, cache=cache,
+                                     context=context))
+
+def seed_hedge_delays(store, hedging):
+    """
+    Feed the TTFTs of earlier unhedged calls to each policy's primary model into
+    the hedge-delay tracker; returns those calls, the baseline hedged calls are
+    compared against.
+    """
+    from llms.hedging import hedge_policy, get_ttft_tracker
+    primaries = {(p["primary"]["provider"], p["primary"]["model"])
+                 for p in (hedge_policy(t, hedging) for t in hedging) if p}
+    baseline = []
+    for provider, model in sorted(primaries):
+        rows = [r for r in store.fetch(model=model) if r["provider"] == provider and r["mode"] == "interactive"]
+        get_ttft_tracker().seed(provider, model, [r["ttft_s"] for r in rows if r["ok"]])
+        baseline.extend(rows)
+    return baseline
+
+class EvalRunner:
+    """
+    Fans tasks out to models with per-provider concurrency and rate limits.
+    Given the hedging policies from config/info.json, each task is instead
+    answered once through its task type's policy (see llms/hedging.py).
+    """
+
+    def __init__(self, models, store, concurrency=None, rate_limits=None, cache="use", fresh_clients=False,
+                 hedging=None):
+        self.models = models
+        self.store = store
+        self.cache = cache
+        self.fresh_clients = fresh_clients
+        self.hedging = hedging
+        if hedging is not None:
+            from llms.hedging import hedge_policy
+            models = [policy["primary"] for policy in (hedge_policy(t, hedging) for t in hedging) if policy]
+        concurrency = concurrency or {}
+        rate_limits = rate_limits or {}
+        providers = {m["provider"] for m in models}
+        self.slots = {p: threading.BoundedSemaphore(concurrency.get(p, DEFAULT_CONCURRENCY)) for p in providers}
+        self.limiters = {p: RateLimiter(rate_limits.get(p, DEFAULT_RATE_LIMIT)) for p in providers}
+        self.max_workers = sum(concurrency.get(p, DEFAULT_CONCURRENCY) for p in providers)
+
+    def run_one(self, run_id, task, model_cfg, policy=None):
+        from llms.usage import last_usage, reset_usage
+        from llms.clients import private_clients
+        provider, model = model_cfg["provider"], model_cfg["model"]
+        with self.slots[provider]:
+            self.limiters[provider].acquire()
+            reset_usage()
+            started_at = time.time()
+            start = time.perf_counter()
+            result = {"run_id": run_id, "task_id": task["task_id"], "task_type": task["task_type"],
+                      "provider": provider, "model": model, "mode": "hedged" if policy else "interactive",
+                      "started_at": started_at, "fresh_clients": self.fresh_clients}
+            clients = private_clients() if self.fresh_clients else contextlib.nullcontext()
+            try:
+                with clients:
+                    if policy:
+                        from llms.hedging import hedged_call
+                        response, report = hedged_call(task["prompt"], policy, task.get("system"), cache=self.cache,
+                                                       context=task.get("context"))
+                        result.update(provider=report["provider"], model=report["model"])
+                    else:
+                        response = call_model(provider, model, task["prompt"], task.get("system"), cache=self.cache,
+                                              context=task.get("context"))
+                result.update(ok=1, response=response)
+            except Exception as e:
+                result.update(ok=0, error=f"{type(e).__name__}: {e}")
+            result["wall_s"] = time.perf_counter() - start
+            usage = last_usage()
+        result.update(
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            ttft_s=usage.get("ttft_s"),
+            cache_hit=int(bool(usage.get("cache_hit"))),
+        )
+        result.update({key: usage[key] for key in RESILIENCE_FIELDS + PROMPT_CACHE_FIELDS if usage.get(key)})
+        if policy:
+            result.update({key: usage.get(key) for key in HEDGE_FIELDS})
+            result["primary"] = f"{provider}/{model}"
+        self.store.record(result)
+        return result
+
+    def run(self, tasks, run_id=None, resume=False):
+        """Run every task on every model; returns the list of result dicts."""
+        run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+        done = self.store.completed_tasks(run_id) if resume else set()
+        if self.hedging is not None:
+            from llms.hedging import hedge_policy
+            answered = {task_id for task_id, _, _ in done}
+            jobs = [(task, policy["primary"], policy) for task in tasks if task["task_id"] not in answered
+                    for policy in [hedge_policy(task["task_type"], self.hedging)] if policy]
+        else:
+            jobs = [(task, m, None) for task in tasks for m in self.models
+                    if (task["task_id"], m["provider"], m["model"]) not in done]
+        results = []
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            futures = [executor.submit(self.run_one, run_id, task, m, policy) for task, m, policy in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                status = "ok" if result["ok"] else result["error"]
+                print(f"[{result['model']}] {result['task_id']}: {result['wall_s']:.2f}s {status}")
+                results.append(result)
+        return run_id, results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an eval task file against all configured models.")
+    parser.add_argument("--tasks", default=TASKS_PATH, help="JSONL task file")
+    parser.add_argument("--models", nargs="*", help="only run these model names")
+    parser.add_argument("--limit", type=int, help="only run the first N tasks")
+    parser.add_argument("--run-id", help="name of the run; reuse with --resume to finish a partial run")
+    parser.add_argument("--resume", action="store_true", help="skip calls that already succeeded in --run-id")
+    parser.add_argument("--cache", choices=("use", "refresh", "bypass"), default="use", help="LLM response cache mode")
+    parser.add_argument("--results", default=RESULTS_PATH, help="results store path")
+    parser.add_argument("--fresh-clients", action="store_true",
+                        help="give every call its own provider clients, closed after it, to measure what client reuse saves")
+    parser.add_argument("--hedge", action="store_true",
+                        help="answer each task once through its task type's hedging policy instead of every model")
+    args = parser.parse_args(argv)
+
+    info = get_info()
+    models = info.get("eval_models", [])
+    if args.models:
+        models = [m for m in models if m["model"] in args.models]
+    hedging = None
+    if args.hedge:
+        hedging = info.get("hedging") or {}
+        if not hedging:
+            print("No policies configured under hedging in config/info.json")
+            return 1
+    elif not models:
+        print("No models configured under eval_models in config/info.json")
+        return 1
+
+    tasks = load_tasks(args.tasks)[:args.limit]
+    store = ResultsStore(args.results)
+    runner = EvalRunner(models, store, info.get("eval_concurrency"), info.get("eval_rate_limits"),
+                        cache=args.cache, fresh_clients=args.fresh_clients, hedging=hedging)
+    if hedging is not None:
+        baseline = seed_hedge_delays(store, hedging)
+    start = time.perf_counter()
+    run_id, results = runner.run(tasks, run_id=args.run_id, resume=args.resume)
+    elapsed = time.perf_counter() - start
+    fan_out = "hedged" if hedging is not None else f"x {len(models)} models"
+    print(f"Run {run_id}: {len(results)} calls over {len(tasks)} tasks {fan_out} in {elapsed:.1f}s "
+          f"(sum of call times {sum(r['wall_s'] for r in results):.1f}s)")
+    rows = store.fetch(run_id=run_id)
+    for row in summarize(rows):
+        print(json.dumps(row, default=str))
+    if hedging is not None:
+        from llms.hedging import hedge_stats
+        for row in summarize_hedging(rows, baseline):
+            print(json.dumps(row, default=str))
+        print(json.dumps({"hedging": hedge_stats()}))
+    print(json.dumps(resilience_stats()))
+    store.close()
+    return 0
+
+if __name__ == "__main__":
+    configure_logging()
+    sys.exit(main())
@@ -1,9 +1,100 @@
-import os
-import pandas as pd
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
 import json
-from db_connection import connect_sqlite
+import logging
+from db_connection import pooled_connection
+from schema_catalog import get_catalog
+from query_cache import get_query_cache, is_cacheable, sql_shape
+from query_log import get_query_log, LOG_PATH
+from query_plan import estimate_cost
+from utils.tracing import span, traced, current_span
 
-log_filename = 'logs/query_log.csv'
+log = logging.getLogger(__name__)
+log_filename = LOG_PATH
+
+CHUNK_SIZE = 10000                 # rows pulled per fetchmany
+MAX_ROWS = 100000                  # default row cap for interactive callers
+MAX_BYTES = 256 * 1024 * 1024      # default in-memory size cap for interactive callers
+QUERY_TIMEOUT = 30.0               # seconds a query may run before it is interrupted
+PROGRESS_STEPS = 20000             # SQLite VM instructions between deadline checks
+WARN_QUERY_COST = 1e8              # estimated rows visited before a plan is flagged
+MAX_QUERY_COST = 1e10              # estimated rows visited before a plan is refused
+VERIFY_BACKENDS = True             # check backend answers against SQLite (see _run_backends)
+VERIFY_SAMPLE = 20                 # after its first check, one in this many answers to a query shape is checked
+
+class QueryError(Exception):
+    """
+    A query that failed, timed out, was cancelled or was refused by the cost guard.
+    kind is one of "error", "timeout", "cancelled" or "cost"; repair_hint() turns
+    it into an instruction the LLM can use to rewrite the query.
+    """
+
+    def __init__(self, kind, message, sql_query, elapsed_s=None, cost=None, plan=None):
+        super().__init__(message)
+        self.kind = kind
+        self.sql_query = sql_query
+        self.elapsed_s = elapsed_s
+        self.cost = cost
+        self.plan = plan or []
+
+    def to_dict(self):
+        return {"kind": self.kind, "message": str(self), "sql": self.sql_query,
+                "elapsed_s": self.elapsed_s, "cost": self.cost, "plan": self.plan}
+
+    def repair_hint(self):
+        plan = "\n".join(f"    {step}" for step in self.plan)
+        if self.kind in ("timeout", "cost"):
+            advice = ("Rewrite it so it reads far fewer rows: join tables only on matching key columns, "
+                      "never as a cross join, and filter with WHERE before joining or aggregating.")
+        else:
+            advice = "Rewrite it so it runs correctly against the schema."
+        return (f"The previous SQL query failed ({self.kind}): {self}\n"
+                f"Query: {self.sql_query}\n" + (f"Plan:\n{plan}\n" if plan else "") + advice)
+
+class CancelToken:
+    """Cancels the queries running under it; cancel() may be called from any thread."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._connections = set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            for conn in self._connections:
+                conn.interrupt()
+
+    def _attach(self, conn):
+        with self._lock:
+            self._connections.add(conn)
+        if self.cancelled:
+            conn.interrupt()
+
+    def _detach(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+
+_scope = threading.local()
+
+@contextmanager
+def cancel_scope(token):
+    """Run every query issued by this thread inside the block under token."""
+    previous = getattr(_scope, "token", None)
+    _scope.token = token
+    try:
+        yield token
+    finally:
+        _scope.token = previous
+
+def current_cancel_token():
+    return getattr(_scope, "token", None)
 
 def read_json(file_path):
     """
@@ -12,49 +103,344 @@ def read_json(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
         return json.load(file)
 
-def execute_query(sql_query):
+def _affinity_dtype(declared_type):
+    """Map a declared SQLite column type to a pandas dtype using SQLite's affinity rules."""
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type:
+        return "int64"
+    if any(t in declared_type for t in ("CHAR", "CLOB", "TEXT")):
+        return "object"
+    if any(t in declared_type for t in ("REAL", "FLOA", "DOUB")):
+        return "float64"
+    return None
+
+_column_types_cache = {}
+
+def schema_column_types():
+    """
+    Return {column_name: pandas dtype} for every column of every attached table,
+    taken from the declared types in the schema catalog. Names declared with
+    conflicting types are left out. Rebuilt only when the catalog version changes.
+    """
+    catalog = get_catalog()
+    version = catalog.refresh()
+    if _column_types_cache.get("version") == version:
+        return _column_types_cache["types"]
+    types, conflicts = {}, set()
+    for columns in catalog.schema().values():
+        for column in columns:
+            col_name, dtype = column["column_name"], _affinity_dtype(column["data_type"])
+            if types.setdefault(col_name, dtype) != dtype:
+                conflicts.add(col_name)
+    for col_name in conflicts:
+        types.pop(col_name)
+    _column_types_cache.update(version=version, types=types)
+    return types
+
+def _column_array(values, dtype):
+    """
+    Build one column from fetched values with a known dtype, falling back to
+    inference. SQLite does not enforce declared types and an aliased
+    expression can share a column's name, so the dtype is only applied when
+    every value fits it without loss.
+    """
+    import numpy as np
+    import pandas as pd
+    types = set(map(type, values))
+    has_null = type(None) in types
+    types.discard(type(None))
+    if dtype == "int64" and types <= {int}:
+        return pd.array(values, dtype="Int64") if has_null else np.array(values, dtype=np.int64)
+    if dtype == "float64" and types <= {int, float}:
+        return np.array([np.nan if v is None else v for v in values] if has_null else values, dtype=np.float64)
+    if dtype == "object" and types <= {str, bytes}:
+        return np.array(values, dtype=object)
+    return pd.Series(values).to_numpy()
+
+def _frame_from_rows(rows, column_names, dtypes):
+    """Build a DataFrame column by column instead of inferring dtypes per object row."""
+    import pandas as pd
+    columns = list(zip(*rows)) if rows else [()] * len(column_names)
+    result_df = pd.DataFrame({i: _column_array(values, dtype) for i, (values, dtype) in enumerate(zip(columns, dtypes))})
+    result_df.columns = column_names
+    return result_df
+
+def iter_query(sql_query, chunk_size=CHUNK_SIZE, deadline=None, cancel_token=None):
+    """
+    Execute a SQL query and yield the results as DataFrame chunks of at most chunk_size rows.
+    Rows are pulled with fetchmany, so stopping iteration stops reading from SQLite.
+    SQLite is interrupted once time.monotonic() passes deadline or cancel_token is cancelled,
+    which raises sqlite3.OperationalError("interrupted").
+    """
+    with pooled_connection() as conn:
+        known_types = schema_column_types()
+        if deadline is not None or cancel_token is not None:
+            conn.set_progress_handler(
+                lambda: (deadline is not None and time.monotonic() > deadline)
+                        or (cancel_token is not None and cancel_token.cancelled),
+                PROGRESS_STEPS)
+        if cancel_token is not None:
+            cancel_token._attach(conn)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql_query)
+            if cursor.description is None:
+                return
+            column_names = [desc[0] for desc in cursor.description]
+            dtypes = [known_types.get(name) for name in column_names]
+            rows = cursor.fetchmany(chunk_size)
+            yield _frame_from_rows(rows, column_names, dtypes)  # always one chunk, so empty results keep their columns
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield _frame_from_rows(rows, column_names, dtypes)
+        finally:
+            cursor.close()
+            if cancel_token is not None:
+                cancel_token._detach(conn)
+            conn.set_progress_handler(None, 0)
+
+@traced("sqlite.fetch")
+def fetch_bounded(sql_query, max_rows=None, max_bytes=None, chunk_size=CHUNK_SIZE, deadline=None, cancel_token=None):
+    """
+    Execute a SQL query, stopping once max_rows rows or max_bytes bytes of results are held.
+    Returns (result_df, truncated) where truncated says whether rows were left unread.
+    """
+    if max_rows is not None:
+        chunk_size = max(1, min(chunk_size, max_rows))
+    chunks, n_rows, n_bytes, truncated = [], 0, 0, False
+    stream = iter_query(sql_query, chunk_size=chunk_size, deadline=deadline, cancel_token=cancel_token)
+    try:
+        for chunk in stream:
+            if max_rows is not None and n_rows + len(chunk) > max_rows:
+                chunk = chunk.iloc[:max_rows - n_rows]
+                truncated = True
+            chunks.append(chunk)
+            n_rows += len(chunk)
+            if max_bytes is not None:
+                n_bytes += int(chunk.memory_usage(index=False, deep=True).sum())
+                if n_bytes >= max_bytes:
+                    truncated = True
+            if truncated:
+                break
+    finally:
+        stream.close()
+    if not chunks:
+        import pandas as pd
+        result_df = pd.DataFrame()
+    elif len(chunks) == 1:
+        result_df = chunks[0]
+    else:
+        import pandas as pd
+        result_df = pd.concat(chunks, ignore_index=True)
+    result_df.attrs["truncated"] = truncated
+    current_span().set(rows=len(result_df), truncated=truncated)
+    return result_df, truncated
+
+@traced("query.cost_check")
+def check_cost(sql_query, max_cost=MAX_QUERY_COST, warn_cost=WARN_QUERY_COST):
+    """
+    Estimate how many rows a query will visit from its plan. Raises QueryError
+    above max_cost; returns a warning message above warn_cost, else None.
+    """
+    with pooled_connection() as conn:
+        cost, steps = estimate_cost(conn, sql_query)
+    plan = [step["detail"] for step in steps]
+    current_span().set(cost=cost)
+    if max_cost is not None and cost > max_cost:
+        raise QueryError("cost", f"Query plan would visit about {cost:.2g} rows (limit {max_cost:.2g}).",
+                         sql_query, cost=cost, plan=plan)
+    if warn_cost is not None and cost > warn_cost:
+        return f"Query plan will visit about {cost:.2g} rows: " + "; ".join(plan)
+    return None
+
+def get_backends():
+    """
+    Execution backends tried before SQLite, in order. Each has a name, an
+    execute(sql_query, max_rows, max_bytes, deadline, cancel_token) that returns
+    a DataFrame or None to decline and raises sqlite3.OperationalError("interrupted")
+    past the deadline or once cancelled, and a reject(sql_query) that sends a
+    query back to SQLite for good.
+    """
+    from columnar import get_column_store
+    store = get_column_store()
+    return [store] if store is not None else []
+
+_sqlite_timings = {}    # query shape -> seconds SQLite last took, to report backend speedups
+_answers = {}           # (backend name, query shape) -> answers the backend has given
+MAX_TRACKED_QUERIES = 10000
+
+def _record_sqlite_time(key, elapsed):
+    if len(_sqlite_timings) >= MAX_TRACKED_QUERIES:
+        _sqlite_timings.clear()
+    _sqlite_timings[key] = elapsed
+
+def _frames_match(a, b):
+    import numpy as np
+    import pandas as pd
+    if list(a.columns) != list(b.columns) or a.shape != b.shape:
+        return False
+    for name in range(a.shape[1]):
+        left, right = a.iloc[:, name], b.iloc[:, name]
+        if pd.api.types.is_numeric_dtype(left) and pd.api.types.is_numeric_dtype(right):
+            if not np.allclose(left.to_numpy(dtype=float), right.to_numpy(dtype=float), rtol=1e-9, equal_nan=True):
+                return False
+        elif left.tolist() != right.tolist():
+            return False
+    return True
+
+def _interrupted(deadline, cancel_token):
+    return (deadline is not None and time.monotonic() > deadline) or (cancel_token is not None and cancel_token.cancelled)
+
+def _run_backends(sql_query, max_rows, max_bytes, run_sqlite, deadline=None, cancel_token=None):
+    """
+    Try each backend; returns its result with attrs backend/speedup set, or None.
+    A backend that fails falls back to SQLite, unless the query was past its
+    deadline or cancelled. The check against SQLite is sampled: SQLite also runs
+    the first query of each shape (the query with its literals taken out) a
+    backend answers and one in VERIFY_SAMPLE after that. The results must match,
+    otherwise the backend is told to reject the shape, and the SQLite time
+    becomes the baseline for the speedup reported for that shape.
+    """
+    key = sql_shape(sql_query)
+    for backend in get_backends():
+        start = time.perf_counter()
+        with span(f"backend.{backend.name}") as backend_span:
+            try:
+                result_df = backend.execute(sql_query, max_rows=max_rows, max_bytes=max_bytes,
+                                            deadline=deadline, cancel_token=cancel_token)
+            except Exception as e:
+                if _interrupted(deadline, cancel_token):
+                    raise sqlite3.OperationalError("interrupted") from e
+                log.warning("%s backend failed, using SQLite: %s", backend.name, e)
+                backend_span.set(error=type(e).__name__)
+                result_df = None
+            backend_span.set(answered=result_df is not None)
+        elapsed = time.perf_counter() - start
+        if result_df is None:
+            continue
+        answers = _answers.get((backend.name, key), 0)
+        if len(_answers) >= MAX_TRACKED_QUERIES:
+            _answers.clear()
+        _answers[(backend.name, key)] = answers + 1
+        if VERIFY_BACKENDS and answers % VERIFY_SAMPLE == 0:
+            start = time.perf_counter()
+            sqlite_df = run_sqlite()
+            _record_sqlite_time(key, time.perf_counter() - start)
+            if not _frames_match(result_df, sqlite_df):
+                log.warning("%s result differs from SQLite, using SQLite for this query from now on", backend.name)
+                backend.reject(sql_query)
+                sqlite_df.attrs["backend"] = "sqlite"
+                return sqlite_df
+        baseline = _sqlite_timings.get(key)
+        result_df.attrs["backend"] = backend.name
+        result_df.attrs["speedup"] = baseline / elapsed if baseline and elapsed else None
+        return result_df
+    return None
+
+def execute_query(sql_query, max_rows=None, max_bytes=None, chunk_size=CHUNK_SIZE, use_cache=True,
+                  timeout=QUERY_TIMEOUT, max_cost=MAX_QUERY_COST, warn_cost=WARN_QUERY_COST, cancel_token=None,
+                  use_backends=True):
     """
     Execute a provided SQL query using the SQLite connection and return the results as a DataFrame.
+    Optional max_rows/max_bytes caps truncate the result; result_df.attrs['truncated'] flags it.
+    Read-only queries are served from the query result cache when the databases are unchanged.
+    Queries a faster backend (see get_backends) can answer run there; attrs['backend'] names
+    the engine used and attrs['speedup'] its gain over SQLite once known.
+    Before running in SQLite, the plan's estimated cost is checked against max_cost/warn_cost;
+    a warning lands in result_df.attrs['cost_warning']. The query is interrupted after timeout
+    seconds or when cancel_token (default: the one from cancel_scope) is cancelled.
+    Every failure is raised as a QueryError.
     """
+    cancel_token = cancel_token or current_cancel_token()
+    start = time.monotonic()
     try:
-        conn, cursor = connect_sqlite()
-        cursor.execute(sql_query)
-        rows_fetched = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        result_df = pd.DataFrame(rows_fetched, columns=column_names)
-        cursor.close()
+        cache = get_query_cache() if use_cache and is_cacheable(sql_query) else None
+        if cache is not None:
+            result_df, fingerprint = cache.get(sql_query, max_rows, max_bytes)
+            if result_df is not None:
+                return result_df
+        deadline = start + timeout if timeout else None
+
+        def run_sqlite():
+            cost_warning = None
+            if max_cost is not None or warn_cost is not None:
+                cost_warning = check_cost(sql_query, max_cost, warn_cost)
+            if cost_warning:
+                log.warning(cost_warning)
+            result_df, _ = fetch_bounded(sql_query, max_rows=max_rows, max_bytes=max_bytes, chunk_size=chunk_size,
+                                         deadline=deadline, cancel_token=cancel_token)
+            if cost_warning:
+                result_df.attrs["cost_warning"] = cost_warning
+            return result_df
+
+        result_df = _run_backends(sql_query, max_rows, max_bytes, run_sqlite, deadline, cancel_token) \
+            if use_backends else None
+        if result_df is None:
+            sqlite_start = time.perf_counter()
+            result_df = run_sqlite()
+            _record_sqlite_time(sql_shape(sql_query), time.perf_counter() - sqlite_start)
+            result_df.attrs["backend"] = "sqlite"
+        if cache is not None:
+            cache.put(sql_query, result_df, max_rows, max_bytes, fingerprint=fingerprint)
         return result_df
+    except QueryError:
+        raise
     except Exception as e:
-        print(f"Error executing query: {e}")
-        return None
+        elapsed_s = time.monotonic() - start
+        if isinstance(e, sqlite3.OperationalError) and "interrupt" in str(e):
+            if cancel_token is not None and cancel_token.cancelled:
+                raise QueryError("cancelled", "Query was cancelled.", sql_query, elapsed_s=elapsed_s) from e
+            raise QueryError("timeout", f"Query did not finish within {timeout:g}s.", sql_query,
+                             elapsed_s=elapsed_s) from e
+        log.warning("Error executing query: %s", e)
+        raise QueryError("error", str(e), sql_query, elapsed_s=elapsed_s) from e
 
-def log_query_results(sql_query, result_df, log_filename):
+def log_query_results(sql_query, result_df, log_filename, latency_s=None, error=None, **fields):
     """
-    Log the executed query and its results to a CSV file.
+    Log the executed query to the structured query log. The entry is written by a
+    background thread with the result's shape, content hash and a short preview.
     """
-    log_dir = os.path.dirname(log_filename)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    log_data = pd.DataFrame({'Query': [sql_query], 'Result': [result_df.to_string(index=False)]})
-    log_data.to_csv(log_filename, mode='a', header=not os.path.exists(log_filename), index=False)
+    get_query_log(log_filename).log(sql_query, result_df, latency_s=latency_s, error=error, **fields)
 
-def main(sql_query, filepath = log_filename):
+@traced("run_sql")
+def main(sql_query, filepath = log_filename, max_rows=None, max_bytes=None, timeout=QUERY_TIMEOUT):
     """
     Process the SQL query: validate, execute, and log the results.
+    Failures are logged and re-raised as QueryError for the caller to repair or report.
     """
-    print(f"SQL query is: {sql_query}")
-    result_df = execute_query(sql_query)
-    print(f"Results df is: {result_df}")
-    if result_df is not None:
-        log_query_results(sql_query, result_df, filepath)
-        return result_df
-    else:
-        return "Failed to execute the query."
+    log.info("SQL query is: %s", sql_query)
+    start = time.perf_counter()
+    try:
+        result_df = execute_query(sql_query, max_rows=max_rows, max_bytes=max_bytes, timeout=timeout)
+    except QueryError as e:
+        log_query_results(sql_query, None, filepath, latency_s=time.perf_counter() - start,
+                          error=e, error_kind=e.kind, plan_cost=e.cost)
+        current_span().set(error_kind=e.kind)
+        raise
+    latency_s = time.perf_counter() - start
+    log.debug("Results df is:\n%s", result_df)
+    cache_hit = bool(result_df.attrs.get("cache_hit"))
+    if cache_hit:
+        report = get_query_cache().report()
+        log.info("Served from query cache (hit rate %.0f%%, %s bytes saved)",
+                 report["hit_rate"] * 100, f"{report['bytes_saved']:,}")
+    backend = result_df.attrs.get("backend", "sqlite")
+    speedup = result_df.attrs.get("speedup")
+    if backend != "sqlite" and not cache_hit:
+        log.info("Answered by the %s backend%s", backend, f" ({speedup:.1f}x faster than SQLite)" if speedup else "")
+    current_span().set(rows=len(result_df), cache_hit=cache_hit, backend=backend, speedup=speedup,
+                       truncated=bool(result_df.attrs.get("truncated")))
+    log_query_results(sql_query, result_df, filepath, latency_s=latency_s, cache_hit=cache_hit,
+                      truncated=bool(result_df.attrs.get("truncated")), backend=backend, speedup=speedup)
+    return result_df
 
 if __name__ == '__main__':
+    from utils.logs import configure_logging
+    configure_logging()
     sql_query = input("Please enter your SQL query: \n")
-    result = main(sql_query)
-    if isinstance(result, pd.DataFrame):
-        print(result)
-    else:
-        print(result)
+    try:
+        print(main(sql_query))
+    except QueryError as e:
+        print(f"Failed to execute the query: {e}")
@@ -1,27 +1,21 @@
 import os
-import time
-import json
-import pandas as pd
-import matplotlib.pyplot as plt
-from openai import OpenAI
+import logging
+from llms.clients import get_openai_client
+from llms.assistants import get_or_create_assistant, run_to_completion, delete_thread, RunTimeout, RUN_TIMEOUT
+from utils import span, traced, current_span, configure_logging, resilient_call
+from model_router import route
 
-def read_json(file_path):
-    """
-    Read JSON file from the given path and return the data.
-    """
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
+log = logging.getLogger(__name__)
 
-dirname = os.getcwd()
-config_path = os.path.join(dirname, 'config')
-log_path = os.path.join(dirname, 'logs')
 output_directory = "output"
+DATA_FILE_NAME = "results.csv"
 
-info = read_json(os.path.join(config_path, 'info.json'))
-GPT_MODEL = info.get('GPT_MODEL')
-
+@traced("code_interpreter")
 def visualize(results_df):
-    client = OpenAI()
+    client = get_openai_client()
+    # Code Interpreter runs on the Assistants API, so only OpenAI models can draw the chart
+    GPT_MODEL = route("visualization", providers=("openai",))["model"]
+    from frame_summary import summarize_frame, frame_file
 
     # Define assistant settings
     assistant_name = "Chart Generator"
@@ -35,77 +29,84 @@ def visualize(results_df):
         .format(output_file_name)
     )
 
-    # Serialize DataFrame to CSV for message passing
-    # results_df_csv = results_df.to_csv(index=False)
-
-    # Update prompt to include DataFrame usage
+    # The model sees a budgeted summary; Code Interpreter reads the full table from an uploaded file
+    data_name, data_bytes = frame_file(results_df, DATA_FILE_NAME)
     prompt_user = (
-        "Create a perfectly understandable, clear, chart. Here is the data you need to visualize:\n" + results_df.to_string()
+        "Create a perfectly understandable, clear, chart. The data you need to visualize is in the attached "
+        f"file {data_name}; load all of it from there. Here is a summary of it:\n"
+        + summarize_frame(results_df, data_name=data_name)
     )
 
-    # Create an assistant
-    assistant = client.beta.assistants.create(
-        name=assistant_name,
-        instructions=assistant_instruction,
-        tools=[{"type": "code_interpreter"}],
-        model=GPT_MODEL)
-
-    # Create a thread
-    thread = client.beta.threads.create()
-
-    # Create a message
-    message = client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content=prompt_user)
-
-    # Start the run
-    run = client.beta.threads.runs.create(
-      thread_id=thread.id,
-      assistant_id=assistant.id)
-
-    # Wait for the run to complete
-    timeout = 560
-    interval_time = 5
-    time_taken = 0
-    while time_taken < timeout:
-        run = client.beta.threads.runs.retrieve(
+    # Reuse the chart assistant, creating it only the first time
+    assistant_id = get_or_create_assistant(
+        client, assistant_name, assistant_instruction, GPT_MODEL, tools=[{"type": "code_interpreter"}])
+
+    data_file = thread = None
+    try:
+        # Upload the data and create a thread
+        with span("code_interpreter.upload", bytes=len(data_bytes)):
+            data_file = resilient_call("openai", client.files.create, file=(data_name, data_bytes),
+                                       purpose="assistants")
+        thread = resilient_call("openai", client.beta.threads.create)
+
+        # Create a message with the data attached for Code Interpreter
+        resilient_call(
+            "openai", client.beta.threads.messages.create,
             thread_id=thread.id,
-            run_id=run.id)
-
-        if run.status == 'completed':
-            break
-        elif run.status == 'failed':
-            print("Run failed.")
+            role="user",
+            content=prompt_user,
+            attachments=[{"file_id": data_file.id, "tools": [{"type": "code_interpreter"}]}])
+
+        # Run it, returning as soon as the run finishes
+        try:
+            with span("code_interpreter.run") as s:
+                run = run_to_completion(client, thread.id, assistant_id, timeout=RUN_TIMEOUT)
+                s.set(status=run.status)
+        except RunTimeout as e:
+            log.warning("%s", e)
+            return
+        if run.status != 'completed':
+            log.warning("Run %s.", run.status)
             return
-        else:
-            print(run.status)
-            time.sleep(interval_time)
-            time_taken += interval_time
-
-    # Retrieve messages
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
-
-    for message in messages.data:
-        print(f"message so far is: {message}")
-        file_id = get_file_id_from_message(message)
-        if not file_id:
-            continue
-        file_content = client.files.content(file_id)
-        file_data_bytes = file_content.read()
-        with open(output_file_name, "wb") as file:
-            file.write(file_data_bytes)
-        print(f"File saved as {output_file_name}")
-        
-        # Load the saved image and create a matplotlib figure from it
-        from matplotlib import image as mpimg
-        img = mpimg.imread(output_file_name)
-        fig, ax = plt.subplots(figsize=(10, 6))
-        ax.imshow(img)
-        ax.axis("off")
-        return fig
 
-    print("No files were generated or saved.")
+        # Retrieve messages
+        messages = resilient_call("openai", client.beta.threads.messages.list, thread_id=thread.id)
+
+        for message in messages.data:
+            file_id = get_file_id_from_message(message)
+            if not file_id or file_id == data_file.id:
+                continue
+            with span("code_interpreter.download") as s:
+                file_data_bytes = resilient_call("openai", lambda: client.files.content(file_id).read())
+                with open(output_file_name, "wb") as file:
+                    file.write(file_data_bytes)
+                s.set(bytes=len(file_data_bytes))
+            log.info("File saved as %s", output_file_name)
+            try:
+                resilient_call("openai", client.files.delete, file_id)
+            except Exception as e:
+                log.warning("Could not delete file %s: %s", file_id, e)
+
+            # Load the saved image and create a matplotlib figure from it
+            import matplotlib.pyplot as plt
+            from matplotlib import image as mpimg
+            img = mpimg.imread(output_file_name)
+            fig, ax = plt.subplots(figsize=(10, 6))
+            ax.imshow(img)
+            ax.axis("off")
+            return fig
+
+        current_span().set(fallback="no_file")
+        log.warning("No files were generated or saved.")
+    finally:
+        # The uploaded copy of the query results must not outlive the call
+        if thread is not None:
+            delete_thread(client, thread.id)
+        if data_file is not None:
+            try:
+                resilient_call("openai", client.files.delete, data_file.id)
+            except Exception as e:
+                log.warning("Could not delete file %s: %s", data_file.id, e)
 
 def get_file_id_from_message(message):
     if message.content and hasattr(message.content[0], 'image_file'):
@@ -116,6 +117,8 @@ def get_file_id_from_message(message):
         return None
 
 if __name__ == "__main__":
+    import pandas as pd
+    configure_logging()
     # Example DataFrame
     results_df = pd.DataFrame({
         'Epoch': [1, 2, 3, 4, 5],
@@ -0,0 +1,111 @@
+"""
+In-process catalog of the schemas of the databases in db/.
+
+Each .db file is fingerprinted by path, size, mtime and PRAGMA schema_version.
+Only databases whose fingerprint changed are re-introspected, and the combined
+schema is kept in memory so repeated lookups cost a dictionary access.
+"""
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+from db_connection import DB_DIRECTORY, RESCAN_INTERVAL, find_db_files
+from get_table_schema import introspect_database, save_schema_to_json
+
+SCHEMA_FILE = os.path.join("config", "combined_schema.json")
+
+class SchemaCatalog:
+    """Fingerprinted, incrementally refreshed schema of every attached database."""
+
+    def __init__(self, db_directory=DB_DIRECTORY, schema_file=SCHEMA_FILE):
+        self.db_directory = db_directory
+        self.schema_file = schema_file
+        self.version = 0            # bumped whenever the combined schema changes
+        self._lock = threading.Lock()
+        self._entries = {}          # db_file -> {"stat": (size, mtime_ns), "schema_version": int, "schema": dict}
+        self._combined = {}
+        self._tables = []
+        self._last_scan = None
+
+    @staticmethod
+    def _read_schema_version(conn):
+        return conn.execute("PRAGMA schema_version").fetchone()[0]
+
+    def _refresh_entry(self, db_file):
+        """Re-read one database if its file changed. Returns True if its schema changed."""
+        st = os.stat(db_file)
+        stat_key = (st.st_size, st.st_mtime_ns)
+        entry = self._entries.get(db_file)
+        if entry is not None and entry["stat"] == stat_key:
+            return False
+        conn = sqlite3.connect(Path(db_file).resolve().as_uri() + "?mode=ro", uri=True)
+        try:
+            schema_version = self._read_schema_version(conn)
+            if entry is not None and entry["schema_version"] == schema_version:
+                entry["stat"] = stat_key  # data changed, schema did not
+                return False
+            schema = introspect_database(db_file, conn=conn)
+        finally:
+            conn.close()
+        self._entries[db_file] = {"stat": stat_key, "schema_version": schema_version, "schema": schema}
+        return True
+
+    def refresh(self, force=False):
+        """Re-introspect databases whose fingerprint changed since the last scan."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._last_scan is not None and now - self._last_scan < RESCAN_INTERVAL:
+                return self.version
+            self._last_scan = now
+            db_files = find_db_files(self.db_directory)
+            changed = False
+            for db_file in set(self._entries) - set(db_files):
+                del self._entries[db_file]
+                changed = True
+            for db_file in db_files:
+                changed = self._refresh_entry(db_file) or changed
+            if changed or self.version == 0:
+                combined = {}
+                for db_file in db_files:
+                    combined.update(self._entries[db_file]["schema"])
+                self._combined = combined
+                self._tables = list(combined)
+                self.version += 1
+                if self.schema_file and combined:
+                    save_schema_to_json(combined, self.schema_file)
+            return self.version
+
+    def schema(self):
+        """Combined schema: {"<table> in <db_file>": [{"column_name", "data_type"}, ...]}."""
+        self.refresh()
+        return self._combined
+
+    def tables(self):
+        """Table keys of the combined schema."""
+        self.refresh()
+        return self._tables
+
+    def fingerprints(self):
+        """{db_file: (size, mtime_ns, schema_version)} as of the last refresh."""
+        self.refresh()
+        with self._lock:
+            return {db_file: (*entry["stat"], entry["schema_version"]) for db_file, entry in self._entries.items()}
+
+    def schema_and_tables(self):
+        """(schema, tables) from a single refresh."""
+        self.refresh()
+        return self._combined, self._tables
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog():
+    """Process-wide schema catalog, created on first use."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = SchemaCatalog()
+    return _catalog
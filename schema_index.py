@@ -0,0 +1,189 @@
+"""
+Relevance index over the schema catalog, used to keep prompts small.
+
+Every table becomes a BM25 document made of its name, its column names and a
+few sample values from its text columns. For a question the index returns the
+top-k tables, their most relevant columns and any join keys they share, cut
+to a token budget, so prompt size stays flat as databases are added to db/.
+The index is rebuilt per database, only for files whose fingerprint changed.
+"""
+import re
+import math
+import sqlite3
+import threading
+from pathlib import Path
+from collections import Counter
+
+from schema_catalog import get_catalog
+
+TOP_K = 5                   # tables sent per question
+TOKEN_BUDGET = 1500         # approximate prompt tokens for the schema block
+MAX_COLUMNS = 40            # columns listed per table before pruning by relevance
+SAMPLE_ROWS = 200           # rows read per table for sample values
+SAMPLE_VALUES = 25          # distinct sample values kept per text column
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def tokenize(text):
+    """Lower-case word pieces, splitting snake_case and CamelCase and keeping the whole word too."""
+    tokens = []
+    for word in re.findall(r"[A-Za-z0-9]+", str(text)):
+        pieces = re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+", word)
+        tokens.append(word.lower())
+        if len(pieces) > 1:
+            tokens.extend(piece.lower() for piece in pieces)
+    return tokens
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+def _split_key(table_key):
+    """'DepMap in db/DepMap.db' -> ('DepMap', 'db/DepMap.db')"""
+    table_name, _, db_file = table_key.partition(" in ")
+    return table_name, db_file
+
+def _sample_values(db_file, table_name, columns):
+    """A few distinct values from each text column, read from the first SAMPLE_ROWS rows."""
+    text_columns = [c["column_name"] for c in columns
+                    if any(t in (c["data_type"] or "").upper() for t in ("CHAR", "CLOB", "TEXT"))]
+    if not text_columns:
+        return {}
+    conn = sqlite3.connect(Path(db_file).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        select = ", ".join(f'"{c}"' for c in text_columns)
+        rows = conn.execute(f'SELECT {select} FROM "{table_name}" LIMIT {SAMPLE_ROWS}').fetchall()
+    except sqlite3.Error:
+        return {}
+    finally:
+        conn.close()
+    samples = {}
+    for i, column in enumerate(text_columns):
+        values = list(dict.fromkeys(row[i] for row in rows if row[i] is not None))
+        samples[column] = [str(v)[:40] for v in values[:SAMPLE_VALUES]]
+    return samples
+
+class SchemaIndex:
+    """BM25 index of tables and columns built incrementally from the schema catalog."""
+
+    def __init__(self, catalog=None):
+        self.catalog = catalog or get_catalog()
+        self._lock = threading.Lock()
+        self._db_fingerprints = {}
+        self._docs = {}         # table_key -> {"tf": Counter, "length": int, "columns": {name: set(tokens)}}
+        self._df = Counter()    # document frequency per token
+        self._avg_length = 1.0
+        self._version = None
+
+    def _index_database(self, db_file, schema):
+        for table_key, columns in schema.items():
+            table_name, _ = _split_key(table_key)
+            samples = _sample_values(db_file, table_name, columns)
+            column_tokens = {}
+            tokens = tokenize(table_name) * 3  # table names weigh more than any one column
+            for column in columns:
+                name = column["column_name"]
+                col_tokens = tokenize(name) + [t for v in samples.get(name, []) for t in tokenize(v)]
+                column_tokens[name] = set(col_tokens)
+                tokens.extend(col_tokens)
+            self._docs[table_key] = {"tf": Counter(tokens), "length": len(tokens), "columns": column_tokens}
+
+    def refresh(self):
+        """Re-index only the databases whose fingerprint changed."""
+        version = self.catalog.refresh()
+        with self._lock:
+            if version == self._version:
+                return
+            fingerprints = self.catalog.fingerprints()
+            schema = self.catalog.schema()
+            by_db = {}
+            for table_key, columns in schema.items():
+                by_db.setdefault(_split_key(table_key)[1], {})[table_key] = columns
+            for db_file in set(self._db_fingerprints) - set(fingerprints):
+                del self._db_fingerprints[db_file]
+            for table_key in [k for k in self._docs if _split_key(k)[1] not in fingerprints or k not in schema]:
+                del self._docs[table_key]
+            for db_file, fingerprint in fingerprints.items():
+                if self._db_fingerprints.get(db_file) != fingerprint:
+                    self._index_database(db_file, by_db.get(db_file, {}))
+                    self._db_fingerprints[db_file] = fingerprint
+            self._df = Counter(token for doc in self._docs.values() for token in doc["tf"])
+            self._avg_length = sum(d["length"] for d in self._docs.values()) / max(len(self._docs), 1)
+            self._version = version
+
+    def score_tables(self, question):
+        """BM25 score of every table for the question, highest first."""
+        self.refresh()
+        terms = set(tokenize(question))
+        n_docs = len(self._docs)
+        scores = []
+        for table_key, doc in self._docs.items():
+            score = 0.0
+            for term in terms:
+                tf = doc["tf"].get(term)
+                if not tf:
+                    continue
+                idf = math.log(1 + (n_docs - self._df[term] + 0.5) / (self._df[term] + 0.5))
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc["length"] / self._avg_length)
+                score += idf * tf * (BM25_K1 + 1) / norm
+            scores.append((score, table_key))
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        return scores
+
+    def select(self, question, top_k=TOP_K, token_budget=TOKEN_BUDGET, max_columns=MAX_COLUMNS):
+        """
+        Pick the schema for a question. Returns (schema_subset, tables, join_keys)
+        where schema_subset has the same shape as the catalog schema.
+        """
+        scores = self.score_tables(question)
+        schema = self.catalog.schema()
+        chosen = [key for score, key in scores if score > 0][:top_k] or [key for _, key in scores[:top_k]]
+
+        column_sets = {key: {c["column_name"] for c in schema[key]} for key in chosen}
+        join_keys = sorted({name for a in chosen for b in chosen if a < b for name in column_sets[a] & column_sets[b]})
+
+        terms = set(tokenize(question))
+        subset, used = {}, 0
+        for key in chosen:
+            columns = schema[key]
+            if len(columns) > max_columns:
+                doc = self._docs[key]
+                ranked = sorted(columns, key=lambda c: (c["column_name"] not in join_keys,
+                                                        -len(doc["columns"][c["column_name"]] & terms)))
+                keep = {c["column_name"] for c in ranked[:max_columns]}
+                columns = [c for c in columns if c["column_name"] in keep]
+            cost = estimate_tokens(format_schema({key: columns}))
+            if subset and used + cost > token_budget:
+                break
+            subset[key] = columns
+            used += cost
+        return subset, list(subset), join_keys
+
+def format_schema(schema, join_keys=()):
+    """Compact text form of a schema: one line per table."""
+    lines = []
+    for table_key, columns in schema.items():
+        table_name, db_file = _split_key(table_key)
+        cols = ", ".join(f"{c['column_name']} {c['data_type']}" for c in columns)
+        lines.append(f"{table_name} (in {db_file}): {cols}")
+    if join_keys:
+        lines.append(f"Shared join keys: {', '.join(join_keys)}")
+    return "\n".join(lines)
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_schema_index():
+    """Process-wide schema index, built on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SchemaIndex()
+    return _index
+
+def schema_context(question, top_k=TOP_K, token_budget=TOKEN_BUDGET):
+    """Schema block for a prompt, restricted to what the question needs."""
+    subset, _, join_keys = get_schema_index().select(question, top_k=top_k, token_budget=token_budget)
+    return format_schema(subset, join_keys)
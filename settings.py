@@ -0,0 +1,45 @@
+"""
+Process-wide access to config/info.json.
+
+Modules used to read info.json at import time or on every call. get_info()
+reads it once per config directory and serves the parsed dict from memory,
+re-reading only when the file's modification time changes, so edits still
+take effect without a restart.
+"""
+import os
+import json
+import threading
+
+CONFIG_DIRECTORY = "config"
+INFO_FILE = "info.json"
+
+_info = {}                  # absolute path -> (mtime_ns, parsed dict)
+_info_lock = threading.Lock()
+
+def read_json(file_path):
+    """Read JSON file from the given path and return the data."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def info_path(config_dir=None):
+    """Absolute path of info.json in config_dir, default config/ under the working directory."""
+    return os.path.abspath(os.path.join(config_dir or CONFIG_DIRECTORY, INFO_FILE))
+
+def get_info(config_dir=None):
+    """
+    The parsed info.json of config_dir, cached until the file changes.
+    Callers must not modify the returned dict.
+    """
+    path = info_path(config_dir)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _info.get(path)
+    if cached is None or cached[0] != mtime:
+        with _info_lock:
+            cached = _info.get(path)
+            if cached is None or cached[0] != mtime:
+                cached = _info[path] = (mtime, read_json(path))
+    return cached[1]
+
+def clear_info_cache():
+    with _info_lock:
+        _info.clear()
@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+
+from llms import assistants
+
+class FakeRuns:
+    """threads.runs whose stream fails after the server has already started a run."""
+
+    def __init__(self):
+        self.created = 0
+        self.stream_timeout = None
+        self.active = SimpleNamespace(id="run_1", object="thread.run", status="in_progress")
+
+    def stream(self, thread_id, assistant_id, timeout=None, **kwargs):
+        self.stream_timeout = timeout
+        raise ConnectionResetError("stream dropped")
+
+    def list(self, thread_id, limit=20):
+        return SimpleNamespace(data=[self.active])
+
+    def create(self, **kwargs):
+        self.created += 1
+        raise AssertionError("thread already has an active run")
+
+    def retrieve(self, thread_id=None, run_id=None):
+        return SimpleNamespace(id=run_id, object="thread.run", status="completed")
+
+def test_failed_stream_adopts_the_run_it_started(monkeypatch):
+    monkeypatch.setattr(assistants, "POLL_INITIAL", 0)
+    runs = FakeRuns()
+    client = SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=runs)))
+    run = assistants.run_to_completion(client, "thread_1", "asst_1", timeout=100)
+    assert run.status == "completed"
+    assert runs.created == 0
+    assert runs.stream_timeout == assistants.STREAM_STALL
@@ -0,0 +1,12 @@
+from batch_evals import chat_request, anthropic_request
+
+def test_chat_request_sends_context_before_the_prompt():
+    body = chat_request("req-1", "m", "question", "system", 0, context="schema")["body"]
+    assert [m["content"] for m in body["messages"]] == ["system", "schema", "question"]
+
+def test_anthropic_request_caches_system_and_context():
+    params = anthropic_request("req-1", "m", "question", "system", 0, context="schema")["params"]
+    assert params["system"][0]["cache_control"] == {"type": "ephemeral"}
+    context, question = params["messages"][0]["content"]
+    assert context == {"type": "text", "text": "schema", "cache_control": {"type": "ephemeral"}}
+    assert question["text"] == "question"
@@ -0,0 +1,30 @@
+import threading
+
+from llms import clients
+
+class Client:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def test_private_clients_are_closed_and_leave_the_shared_ones_alone(monkeypatch):
+    monkeypatch.setattr(clients, "_clients", {})
+    shared = clients._get_or_create(("p", None), Client)
+    with clients.private_clients():
+        private = clients._get_or_create(("p", None), Client)
+        assert clients._get_or_create(("p", None), Client) is private
+    assert private is not shared and private.closed
+    assert not shared.closed
+    assert clients._get_or_create(("p", None), Client) is shared
+
+def test_private_clients_are_per_context(monkeypatch):
+    monkeypatch.setattr(clients, "_clients", {})
+    seen = []
+    with clients.private_clients():
+        private = clients._get_or_create(("p", None), Client)
+        thread = threading.Thread(target=lambda: seen.append(clients._get_or_create(("p", None), Client)))
+        thread.start()
+        thread.join()
+    assert seen[0] is not private and not seen[0].closed
@@ -0,0 +1,112 @@
+import math
+import shutil
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import db_connection
+import run_sql
+import schema_catalog
+from columnar import ColumnStore, _numeric_view
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+ROWS = [
+    # grp, name, val, n, score (numeric text, as in the VARCHAR DepMap tables), k (integers with a NULL)
+    ("b", "kras", 1.5, 3, "-0.25", 1),
+    ("a", "ep300", -2.0, 7, "1.5", 2),
+    (None, "tp53", 0.25, 1, "2", None),
+    ("c", "brca1", None, 4, None, 4),
+    ("a", "myc", 3.0, 6, "-3e-1", 5),
+    ("b", "egfr", 4.5, 12, "0.75", 6),
+    (None, "pten", -1.0, 5, "10", 7),
+    ("c", "apc", 2.0, 8, " 4 ", 8),
+    ("a", "Kras", 0.5, 9, "0", 9),
+]
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A columnar store over a temp db/Genes.db, with the catalog and pool pointed at it."""
+    (tmp_path / "db").mkdir()
+    (tmp_path / "config").mkdir()
+    shutil.copy(REPO_ROOT / "config" / "info.json", tmp_path / "config" / "info.json")
+    conn = sqlite3.connect(tmp_path / "db" / "Genes.db")
+    conn.execute("CREATE TABLE genes (grp TEXT, name TEXT, val REAL, n INTEGER, score VARCHAR, k INTEGER)")
+    conn.executemany("INSERT INTO genes VALUES (?, ?, ?, ?, ?, ?)", ROWS)
+    conn.commit()
+    conn.close()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(schema_catalog, "_catalog", None)
+    monkeypatch.setattr(db_connection, "_pool", None)
+    store = ColumnStore(directory=str(tmp_path / "columnar"))
+    assert store.warm("SELECT COUNT(*) FROM genes")
+    yield store
+    if db_connection._pool is not None:
+        db_connection._pool.close_all()
+
+def _rows(df):
+    def value(v):
+        if v is None or (isinstance(v, float) and math.isnan(v)):
+            return None
+        if isinstance(v, (float, np.floating)):
+            return round(float(v), 9)
+        return v.item() if isinstance(v, np.generic) else v
+    return [tuple(value(v) for v in row) for row in df.itertuples(index=False)]
+
+def assert_same_as_sqlite(store, sql_query):
+    result_df = store.execute(sql_query)
+    assert result_df is not None, f"columnar declined {sql_query}"
+    sqlite_df, _ = run_sql.fetch_bounded(sql_query)
+    assert list(result_df.columns) == list(sqlite_df.columns)
+    assert _rows(result_df) == _rows(sqlite_df)
+
+@pytest.mark.parametrize("sql_query", [
+    # NULL group keys form their own group, sorted first as in SQLite
+    "SELECT grp, COUNT(*) AS n, COUNT(val), AVG(val), MIN(name), MAX(n) FROM genes GROUP BY grp",
+    "SELECT grp, SUM(n) AS total FROM genes WHERE grp IS NOT NULL GROUP BY grp",
+    # text comparisons are BINARY: case-sensitive and by code point
+    "SELECT name FROM genes WHERE name > 'egfr' ORDER BY name",
+    "SELECT name, grp FROM genes WHERE name = 'kras'",
+    "SELECT COUNT(*) FROM genes WHERE name IN ('kras', 'Kras', 'nope') AND grp <> 'b'",
+    "SELECT name FROM genes WHERE grp IS NULL ORDER BY name DESC",
+    # ORDER BY an aggregate, an alias or a column, with LIMIT and OFFSET
+    "SELECT grp, SUM(n) AS total FROM genes GROUP BY grp ORDER BY total DESC",
+    "SELECT grp, COUNT(*) FROM genes GROUP BY grp ORDER BY COUNT(*) DESC, grp LIMIT 2",
+    "SELECT name, val FROM genes WHERE val >= 0 ORDER BY val DESC LIMIT 3 OFFSET 1",
+    "SELECT name FROM genes ORDER BY n LIMIT 4",
+    # numeric text is summed and averaged the way SQLite coerces it
+    "SELECT grp, AVG(score) AS mean_score, SUM(score) FROM genes GROUP BY grp",
+])
+def test_results_match_sqlite(store, sql_query):
+    assert_same_as_sqlite(store, sql_query)
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT grp, COUNT(*) FROM genes GROUP BY grp HAVING COUNT(*) > 1",
+    "SELECT name FROM genes WHERE grp = 'a' OR grp = 'b'",
+    "SELECT * FROM genes",
+    "SELECT name FROM genes JOIN genes AS g2 ON genes.name = g2.name",
+    "SELECT SUM(name) FROM genes",
+    "SELECT SUM(k) FROM genes",  # integers with NULLs are not materialized
+])
+def test_unsupported_queries_are_declined(store, sql_query):
+    assert store.execute(sql_query) is None
+
+def test_cancelled_query_is_interrupted(store):
+    class Cancelled:
+        cancelled = True
+    with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+        store.execute("SELECT COUNT(*) FROM genes", cancel_token=Cancelled())
+
+def test_numeric_text_gets_a_numeric_view():
+    kind, data = _numeric_view(["-0.5", " 2 ", None, "1e3"])
+    assert kind == "float"
+    assert np.isnan(data[2])
+    assert data[[0, 1, 3]].tolist() == [-0.5, 2.0, 1000.0]
+
+def test_integer_text_is_summed_as_integers():
+    assert _numeric_view(["1", "-20", None])[0] == "int"
+
+def test_text_with_words_has_no_numeric_view():
+    assert _numeric_view(["1.5", "n/a"]) is None
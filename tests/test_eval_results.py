@@ -0,0 +1,12 @@
+from eval_results import summarize
+
+def _row(wall_s, cache_hit, ok=1):
+    return {"provider": "openai", "model": "m", "wall_s": wall_s, "ttft_s": wall_s / 2, "ok": ok,
+            "cache_hit": cache_hit, "prompt_tokens": 10, "completion_tokens": 5, "extra": None}
+
+def test_latency_percentiles_leave_out_cache_hits():
+    summary, = summarize([_row(2.0, 0), _row(4.0, 0)] + [_row(0.001, 1)] * 5)
+    assert summary["calls"] == 7
+    assert summary["cache_hits"] == 5
+    assert summary["wall_p50"] >= 2.0
+    assert summary["ttft_p50"] >= 1.0
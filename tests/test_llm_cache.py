@@ -0,0 +1,24 @@
+import pytest
+
+from llms import cache
+
+@pytest.fixture
+def fresh_cache(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cache, "_cache", None)
+    yield
+    if cache._cache is not None:
+        cache._cache.clear()
+
+@pytest.mark.parametrize("setting", ["on", "1", "TRUE", "yes", ""])
+def test_switch_values_use_the_default_path(fresh_cache, monkeypatch, setting):
+    monkeypatch.setenv("GALEN_LLM_CACHE", setting)
+    assert cache.get_cache().path == cache.CACHE_PATH
+
+def test_other_values_name_the_cache_file(fresh_cache, monkeypatch, tmp_path):
+    monkeypatch.setenv("GALEN_LLM_CACHE", str(tmp_path / "responses.sqlite"))
+    assert cache.get_cache().path == str(tmp_path / "responses.sqlite")
+
+def test_off_disables_the_cache(fresh_cache, monkeypatch):
+    monkeypatch.setenv("GALEN_LLM_CACHE", "off")
+    assert cache.get_cache() is None
@@ -0,0 +1,40 @@
+from eval_results import ResultsStore
+import model_router
+from model_router import ModelRouter
+
+def test_cached_results_are_not_history(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    store = ResultsStore(path)
+    for wall_s, cache_hit in ((2.0, 0), (3.0, 0), (0.001, 1)):
+        store.record({"task_type": "sql", "provider": "openai", "model": "m", "wall_s": wall_s, "ok": 1,
+                      "cache_hit": cache_hit})
+    store.close()
+    router = ModelRouter(results_path=path)
+    router._refresh({})
+    stats = router.stats("sql", "openai", "m")
+    assert stats["calls"] == 2
+    assert stats["wall_p50"] >= 2.0
+
+INFO = {
+    "GPT_MODEL": "gpt-4o",
+    "eval_models": [{"provider": "anthropic", "model": "claude-3-7-sonnet-latest"}],
+    "routing": {"models": [{"provider": "openai", "model": "gpt-4o-mini", "cost_per_mtok": 0.6}],
+                "task_types": {"visualization": {"default": "gpt-4o-mini"}},
+                "overrides": {"visualization": "claude-3-7-sonnet-latest"}},
+}
+
+def test_override_from_another_provider_is_ignored_where_not_allowed(monkeypatch, tmp_path):
+    monkeypatch.setattr(model_router, "get_info", lambda: INFO)
+    monkeypatch.delenv(model_router.OVERRIDE_ENV, raising=False)
+    router = ModelRouter(results_path=str(tmp_path / "missing.sqlite"))
+    decision = router.choose("visualization", providers=("openai",))
+    assert (decision["provider"], decision["model"]) == ("openai", "gpt-4o-mini")
+    assert "not allowed here" in decision["reason"]
+    assert router.choose("visualization")["model"] == "claude-3-7-sonnet-latest"
+
+def test_environment_override_is_checked_against_providers(monkeypatch, tmp_path):
+    monkeypatch.setattr(model_router, "get_info", lambda: INFO)
+    monkeypatch.setenv(model_router.OVERRIDE_ENV, "claude-3-7-sonnet-latest")
+    router = ModelRouter(results_path=str(tmp_path / "missing.sqlite"))
+    assert router.choose("sql", providers=("openai",))["provider"] == "openai"
+    assert router.choose("sql")["provider"] == "anthropic"
@@ -0,0 +1,13 @@
+from query_cache import normalize_sql, sql_shape
+
+def test_spacing_inside_literals_is_kept():
+    spaced = "SELECT COUNT(*) FROM DepMap WHERE gene_name = 'EP300' OR 'a,b' = 'a , b'"
+    tight = "SELECT COUNT(*) FROM DepMap WHERE gene_name = 'EP300' OR 'a,b' = 'a,b'"
+    assert normalize_sql(spaced) != normalize_sql(tight)
+    assert "'a , b'" in normalize_sql(spaced)
+
+def test_spacing_outside_literals_is_collapsed():
+    assert normalize_sql("select a , b from t where c = 'x y' ;") == normalize_sql("SELECT a,b FROM t WHERE c='x y'")
+
+def test_shape_replaces_literals():
+    assert sql_shape("SELECT * FROM t WHERE x = 1 AND y = 'a , b'") == "SELECT * FROM T WHERE X=? AND Y=?"
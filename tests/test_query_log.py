@@ -0,0 +1,31 @@
+import pandas as pd
+
+from query_log import QueryLog, read_entries, result_hash
+
+def test_entry_describes_the_result_as_logged(tmp_path):
+    path = str(tmp_path / "query_log.jsonl")
+    query_log = QueryLog(path, preview_rows=2)
+    result_df = pd.DataFrame({"a": [1, 2, 3]})
+    logged_hash = result_hash(result_df)
+    query_log.log("SELECT a FROM t", result_df, latency_s=0.01)
+    result_df["a"] = 0  # the caller changes its frame after logging
+    query_log.flush()
+    query_log.close()
+    entry, = read_entries(path, include_rotated=False)
+    assert (entry["rows"], entry["columns"]) == (3, 1)
+    assert entry["result_hash"] == logged_hash
+    assert entry["preview"] == [{"a": 1}, {"a": 2}]
+
+def test_writer_gets_only_the_preview_rows(tmp_path):
+    heads = []
+
+    class RecordingLog(QueryLog):
+        def _complete(self, entry, head):
+            heads.append(head)
+            return super()._complete(entry, head)
+
+    query_log = RecordingLog(str(tmp_path / "query_log.jsonl"), preview_rows=2)
+    query_log.log("SELECT a FROM t", pd.DataFrame({"a": range(1000)}))
+    query_log.flush()
+    query_log.close()
+    assert len(heads[0]) == 2
@@ -0,0 +1,164 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import retry
+from utils.retry import CircuitBreaker, CircuitOpenError, RetryBudget, resilient, resilient_stream
+
+class APIError(Exception):
+    """Stand-in for a provider SDK error: a status code and the response headers."""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+class Clock:
+    """Replaces the time module in utils.retry; sleeping advances the clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry, "time", clock)
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    retry.reset_resilience()
+    yield clock
+    retry.reset_resilience()
+
+def test_retry_after_seconds_milliseconds_and_dates(clock):
+    assert retry.retry_after(APIError(429, {"retry-after": "3"})) == 3.0
+    assert retry.retry_after(APIError(429, {"retry-after-ms": "250", "retry-after": "3"})) == 0.25
+    clock.now = 1_700_000_000.0
+    assert retry.retry_after(APIError(503, {"retry-after": "Tue, 14 Nov 2023 22:13:30 GMT"})) == 10.0
+    assert retry.retry_after(APIError(503, {"retry-after": "soon"})) is None
+    assert retry.retry_after(APIError(503)) is None
+
+def test_transient_failures():
+    assert retry.is_transient(APIError(429))
+    assert retry.is_transient(APIError(502))
+    assert not retry.is_transient(APIError(400))
+    assert retry.is_transient(ConnectionError("reset"))
+    assert not retry.is_transient(ValueError("bad"))
+
+def test_budget_spends_its_reserve_then_refills(clock):
+    budget = RetryBudget(ratio=0.5, reserve=2, refill_per_s=1, ceiling=10)
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    budget.deposit()
+    budget.deposit()
+    assert budget.try_spend()
+    clock.now += 1.5
+    assert budget.try_spend()
+    assert budget.stats() == {"tokens": 0.5, "retries": 4, "denied": 1}
+
+def _open(breaker, calls=4):
+    for _ in range(calls):
+        breaker.allow()
+        breaker.record(False)
+
+def test_breaker_opens_on_the_failure_rate_and_rejects_until_the_cooldown(clock):
+    breaker = CircuitBreaker("p", min_calls=4, failure_rate=0.5, cooldown=30)
+    breaker.allow()
+    breaker.record(True)
+    _open(breaker, 3)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    clock.now += 30
+    breaker.allow()
+    assert breaker.state == "half_open"
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("p", min_calls=4, failure_rate=0.5, cooldown=30)
+    _open(breaker)
+    clock.now += 30
+    breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()  # the probe has not reported back yet
+    breaker.record(True)
+    assert breaker.state == "closed"
+    breaker.allow()
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker("p", min_calls=4, failure_rate=0.5, cooldown=30)
+    _open(breaker)
+    clock.now += 30
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.stats()["opened"] == 2
+
+def test_lost_probe_stops_blocking_after_a_cooldown(clock):
+    breaker = CircuitBreaker("p", min_calls=4, failure_rate=0.5, cooldown=30)
+    _open(breaker)
+    clock.now += 30
+    breaker.allow()  # this probe never records an outcome
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    clock.now += 1
+    breaker.allow()
+
+def test_resilient_retries_transient_failures_after_retry_after(clock):
+    outcomes = [APIError(429, {"retry-after": "2"}), APIError(503), "ok"]
+
+    @resilient("p")
+    def call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert call() == "ok"
+    assert clock.sleeps == [2.0, retry.BACKOFF_BASE * 4]
+
+def test_resilient_does_not_retry_client_errors_or_long_retry_after(clock):
+    calls = []
+
+    @resilient("p")
+    def call(error):
+        calls.append(error)
+        raise error
+
+    with pytest.raises(APIError):
+        call(APIError(400))
+    with pytest.raises(APIError):
+        call(APIError(429, {"retry-after": str(retry.RETRY_AFTER_MAX + 1)}))
+    assert len(calls) == 2 and clock.sleeps == []
+
+def test_stream_is_retried_only_before_the_first_chunk(clock):
+    attempts = []
+
+    @resilient_stream("p")
+    def stream(fail_before_first):
+        attempts.append(1)
+        if len(attempts) == 1 and fail_before_first:
+            raise APIError(503)
+        yield "a"
+        if not fail_before_first:
+            raise APIError(503)
+        yield "b"
+
+    assert list(stream(True)) == ["a", "b"]
+    assert len(attempts) == 2
+
+    attempts.clear()
+    chunks = []
+    with pytest.raises(APIError):
+        for chunk in stream(False):
+            chunks.append(chunk)
+    assert chunks == ["a"] and len(attempts) == 1
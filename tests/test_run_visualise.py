@@ -0,0 +1,18 @@
+import pandas as pd
+import pytest
+
+import run_visualise
+from benchmarks.stub_llms import stubbed_llms
+from llms.clients import get_openai_client
+
+def test_upload_is_deleted_when_the_thread_cannot_be_created(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_visualise, "output_directory", str(tmp_path))
+    with stubbed_llms():
+        client = get_openai_client()
+
+        def fail():
+            raise ValueError("no thread")
+        monkeypatch.setattr(client.beta.threads, "create", fail)
+        with pytest.raises(ValueError):
+            run_visualise.visualize(pd.DataFrame({"x": [1, 2], "y": [3, 4]}))
+        assert client.files._files == {}
@@ -0,0 +1,19 @@
+import json
+from types import SimpleNamespace
+
+from util import execute_function_call
+
+def _response(name=None, arguments=None):
+    tool_calls = None
+    if name is not None:
+        function = SimpleNamespace(name=name, arguments=json.dumps(arguments))
+        tool_calls = [SimpleNamespace(id="call_1", type="function", function=function)]
+    message = SimpleNamespace(role="assistant", content="hi", tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+def test_dispatch_does_not_depend_on_the_caller():
+    assert execute_function_call(_response("qna", {"question": "why?"})).startswith("QnA function executed")
+    assert execute_function_call(_response("nope", {})) == "Error: function nope does not exist"
+
+def test_response_without_tool_calls_runs_nothing():
+    assert execute_function_call(_response()) is None
@@ -1,7 +1,9 @@
 import os
 import json
-import inspect
-import pandas as pd
+import logging
+from utils.tracing import traced, current_span
+
+log = logging.getLogger(__name__)
 
 def read_json(file_path):
     """Read JSON file from the given path and return the data."""
@@ -9,30 +11,34 @@ def read_json(file_path):
         return json.load(file)
 
 def get_schema_and_table_list(folder_path):
-    """Get the schema for all the tables and the table list."""
+    """
+    Get the schema for all the tables and the table list.
+    Served from the in-memory schema catalog, which only re-reads databases whose
+    files changed; falls back to combined_schema.json when no databases are present.
+    """
+    from schema_catalog import get_catalog
+    all_schema, tables_list = get_catalog().schema_and_tables()
+    if all_schema:
+        return all_schema, tables_list
+
     schema_file_path = os.path.join(folder_path, 'combined_schema.json')
     all_schema = read_json(schema_file_path)
-
-    tables_list = []
-    for row in all_schema:
-        for key in row:
-            tables_list.append(key)
+    tables_list = list(all_schema)
 
     return all_schema, tables_list
 
-def extract_SQL(query, recursion_depth=0, max_depth=1):
-    """Extract SQL from a query or run one directly."""
-    from run_sql import main
-    
-    # Debugging 
-    print(f"extract_SQL: Input query type: {type(query)}")
-    if isinstance(query, list) and query:
-        print(f"extract_SQL: Query list content: {query}")
-    elif isinstance(query, str):
-        print(f"extract_SQL: Query string content: {query[:100]}")
-    else:
-        print(f"extract_SQL: Query is {query}")
-    
+@traced("extract_SQL")
+def extract_SQL(query, recursion_depth=0, max_depth=1, on_delta=None):
+    """
+    Extract SQL from a query or run one directly.
+    on_delta, if given, receives the model's partial output while SQL is generated.
+    The caller is expected to chart the returned DataFrame itself.
+    """
+    import pandas as pd
+    from run_sql import main, MAX_ROWS, MAX_BYTES
+
+    log.debug("extract_SQL: query %r", query)
+
     # Handle list input - convert to string
     if isinstance(query, list):
         if not query:  # Empty list
@@ -44,25 +50,24 @@ def extract_SQL(query, recursion_depth=0, max_depth=1):
         # This is a natural language query - forward to process_openai
         if recursion_depth >= max_depth:
             raise Exception("Maximum recursion depth reached in extract_SQL")
-        print(f"extract_SQL: Query is not SQL, forwarding to process_openai: {query}")
+        log.info("extract_SQL: query is not SQL, forwarding to process_openai: %.200s", query)
+        current_span().set(kind="question")
         from process_openai import main as process_query
-        return process_query([{'role': 'user', 'content': query}])
+        return process_query([{'role': 'user', 'content': query}], on_delta=on_delta, make_chart=False)
     
     # For SQL queries
-    print(f"extract_SQL: Executing SQL query: {query}")
+    log.info("extract_SQL: executing SQL query: %s", query)
+    current_span().set(kind="sql")
     try:
-        df = main(query)
-        # Print debug information
-        print(f"extract_SQL: Type of df returned: {type(df)}")
+        df = main(query, max_rows=MAX_ROWS, max_bytes=MAX_BYTES)
         if isinstance(df, pd.DataFrame):
-            print(f"extract_SQL: DataFrame shape: {df.shape}")
-            print(f"extract_SQL: DataFrame head:\n{df.head()}")
+            log.debug("extract_SQL: result shape %s, head:\n%s", df.shape, df.head())
         else:
-            print(f"extract_SQL: Non-DataFrame result: {df}")
+            log.debug("extract_SQL: non-DataFrame result: %s", df)
         return df
         
     except Exception as e:
-        print(f"extract_SQL ERROR: SQL query execution failed: {e}")
+        log.warning("extract_SQL: SQL query execution failed: %s", e)
         # Check if it's a table name issue in the query
         error_str = str(e).lower()
         if "no such table" in error_str:
@@ -71,22 +76,22 @@ def extract_SQL(query, recursion_depth=0, max_depth=1):
             match = re.search(r"no such table:\s*(\w+)", error_str)
             if match:
                 bad_table = match.group(1)
-                print(f"extract_SQL: Detected invalid table name: {bad_table}")
+                log.info("extract_SQL: detected invalid table name: %s", bad_table)
                 
                 # Fix the query by replacing the bad table with the appropriate one
                 if "gene" in bad_table or "dependency" in bad_table:
                     fixed_query = query.replace(bad_table, "DepMap")
-                    print(f"extract_SQL: Fixed query: {fixed_query}")
+                    log.info("extract_SQL: fixed query: %s", fixed_query)
                     
                     # Try again with the fixed query
                     try:
-                        print("extract_SQL: Retrying with fixed query...")
-                        df = main(fixed_query)
+                        current_span().incr("retries")
+                        df = main(fixed_query, max_rows=MAX_ROWS, max_bytes=MAX_BYTES)
                         if isinstance(df, pd.DataFrame):
-                            print(f"extract_SQL: Query successful after fixing table name! Shape: {df.shape}")
+                            log.info("extract_SQL: query succeeded after fixing the table name, shape %s", df.shape)
                             return df
                     except Exception as retry_error:
-                        print(f"extract_SQL: Retry failed: {retry_error}")
+                        log.warning("extract_SQL: retry failed: %s", retry_error)
         
         # If we get here, all attempts have failed
         raise
@@ -103,29 +108,40 @@ def execute_vis_code(code_str, df=None):
     try:
         exec(code_str, globals(), local_vars)
     except Exception as e:
-        print(f"Error executing visualization code: {e}")
+        log.warning("Error executing visualization code: %s", e)
         return None
     return local_vars.get('fig')
 
-def visualise(df):
+@traced("visualise")
+def visualise(df, request=None):
     """
     Simple wrapper for the visualization function.
     Will always try to return a matplotlib figure.
+    Charts are drawn locally from an LLM-chosen chart spec; the Code Interpreter
+    assistant in run_visualise is only used if local rendering fails.
     """
+    import pandas as pd
     try:
+        if isinstance(df, pd.DataFrame):
+            log.debug("visualise: DataFrame shape %s", df.shape)
+            current_span().set(rows=len(df))
+            try:
+                from chart_renderer import choose_spec, render_chart
+                spec = choose_spec(df, request)
+                log.info("visualise: rendering chart spec locally: %s", spec)
+                return render_chart(df, spec)
+            except Exception as e:
+                log.warning("visualise: local rendering failed, falling back to Code Interpreter: %s", e)
+                current_span().set(fallback="code_interpreter")
+
         # Call the visualize function from run_visualise module
         from run_visualise import visualize
-        
-        # Print debug info
-        print(f"visualise: Calling visualization with dataframe of type: {type(df)}")
-        if isinstance(df, pd.DataFrame):
-            print(f"visualise: DataFrame shape: {df.shape}")
-        
+
         # Pass the dataframe to visualize and return the result
         return visualize(df)
     except Exception as e:
         # If visualization fails for any reason, create a simple message figure
-        print(f"Visualization error in util.py: {e}")
+        log.error("Visualization error: %s", e)
         
         try:
             # Create a basic figure with error message
@@ -139,83 +155,55 @@ def visualise(df):
             # If even that fails, return None and let the caller handle it
             return None
 
+@traced("execute_function_call")
 def execute_function_call(response):
-    """Execute function calls from LLM responses."""
-    # Determine the caller file
-    stack = inspect.stack()
-    caller_file = stack[1].filename
-    
-    # Debugging: Print the caller file
-    print("Called from:", caller_file)
-
-    # Process based on the caller
-    if 'process_openai.py' in caller_file:
-        # Handle the response structure for process_openai.py
-        try:
-            # Check if there are any tool calls
-            if not hasattr(response.choices[0].message, 'tool_calls') or not response.choices[0].message.tool_calls:
-                print("No tool calls in the response")
-                return None                
-            # Get the first tool call
-            tool_call = response.choices[0].message.tool_calls[0]
-            # Print tool call ID for tracking
-            print(f"Processing tool call ID: {tool_call.id}")
-            
-            # Extract function name and arguments
-            function_name = tool_call.function.name
-            print(f"Processing function_name: {function_name}")
-            arguments = json.loads(tool_call.function.arguments)
-            print(f"Processing arguments: {arguments}")
-        except (AttributeError, json.JSONDecodeError) as e:
-            print("Error processing tool_calls:", e)
-            print("Response structure:", response)
+    """
+    Execute the first tool call of a chat completion such as process_openai.call_fn
+    returns. A plain string is run as SQL.
+    """
+    if isinstance(response, str):
+        return extract_SQL(response)
+    try:
+        # Check if there are any tool calls
+        message = response.choices[0].message
+        if not getattr(message, 'tool_calls', None):
+            log.warning("No tool calls in the response")
             return None
+        # Get the first tool call
+        tool_call = message.tool_calls[0]
 
-        # Execute the appropriate function based on name
-        if function_name == "extract_SQL":
-            query = arguments["query"]
-            result = extract_SQL(query)
-        elif function_name == "visualise":
-            code = arguments["vis_code"]
-            result = execute_vis_code(code, df if 'df' in globals() else None)
-        elif function_name == "data_analysis":
-            code = arguments["code"]
-            # Call appropriate function for data analysis
-            # This would need to be implemented
-            result = f"Data analysis function executed with code: {code[:50]}..."
-        elif function_name == "write_report":
-            report_request = arguments["report_request"]
-            # Call appropriate function for report writing
-            # This would need to be implemented
-            result = f"Report writing function executed with request: {report_request[:50]}..."
-        elif function_name == "qna":
-            question = arguments["question"]
-            # Call appropriate function for QnA
-            # This would need to be implemented
-            result = f"QnA function executed with question: {question[:50]}..."
-        else:
-            result = f"Error: function {function_name} does not exist"
-    
+        # Extract function name and arguments
+        function_name = tool_call.function.name
+        arguments = json.loads(tool_call.function.arguments)
+        log.info("Processing tool call %s: %s(%s)", tool_call.id, function_name, arguments)
+        current_span().set(function=function_name)
+    except (AttributeError, IndexError, TypeError, json.JSONDecodeError) as e:
+        log.error("Error processing tool_calls: %s", e)
+        log.debug("Response structure: %s", response)
+        return None
+
+    # Execute the appropriate function based on name
+    if function_name == "extract_SQL":
+        query = arguments["query"]
+        result = extract_SQL(query)
+    elif function_name == "visualise":
+        code = arguments["vis_code"]
+        result = execute_vis_code(code, df if 'df' in globals() else None)
+    elif function_name == "data_analysis":
+        code = arguments["code"]
+        # Call appropriate function for data analysis
+        # This would need to be implemented
+        result = f"Data analysis function executed with code: {code[:50]}..."
+    elif function_name == "write_report":
+        report_request = arguments["report_request"]
+        # Call appropriate function for report writing
+        # This would need to be implemented
+        result = f"Report writing function executed with request: {report_request[:50]}..."
+    elif function_name == "qna":
+        question = arguments["question"]
+        # Call appropriate function for QnA
+        # This would need to be implemented
+        result = f"QnA function executed with question: {question[:50]}..."
     else:
-        # For other callers, attempt to handle in a reasonable way
-        print(f"Warning: Called from unexpected file: {caller_file}")
-        try:
-            # Try to handle as OpenAI response if it has the right structure
-            if hasattr(response, 'choices') and hasattr(response.choices[0].message, 'tool_calls'):
-                tool_call = response.choices[0].message.tool_calls[0]
-                function_name = tool_call.function.name
-                arguments = json.loads(tool_call.function.arguments)
-                
-                if function_name == "extract_SQL":
-                    query = arguments["query"]
-                    result = extract_SQL(query)
-                else:
-                    result = None
-            else:
-                # Just try to run it as SQL
-                result = extract_SQL(response)
-        except Exception as e:
-            print(f"Error handling response from unknown caller: {e}")
-            result = None
-    
+        result = f"Error: function {function_name} does not exist"
     return result
\ No newline at end of file
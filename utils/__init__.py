@@ -1,6 +1,10 @@
 """
 Utilities package for Galen LLM evaluation framework.
-Contains helper functions for retry mechanisms and other utilities.
+Contains helper functions for retries and circuit breakers, statistics, tracing, logging, background imports and other utilities.
 """
 
-from .retry import retry_except
\ No newline at end of file
+from .retry import resilient, resilient_call, resilient_stream, CircuitOpenError, resilience_stats
+from .stats import percentile
+from .tracing import span, traced, current_span, capture
+from .logs import configure_logging
+from .preload import preload
@@ -0,0 +1,16 @@
+"""
+Logging setup for the entry points (the front end and the command-line scripts).
+
+Library modules only call logging.getLogger(__name__) and log large objects
+(DataFrames, responses) at DEBUG with lazy %s arguments, so they are never
+formatted unless DEBUG is on.
+"""
+import os
+import logging
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+def configure_logging(level=None):
+    """Log to stderr at level, default GALEN_LOG_LEVEL or INFO."""
+    level = (level or os.getenv("GALEN_LOG_LEVEL", "INFO")).upper()
+    logging.basicConfig(level=level, format=LOG_FORMAT)
@@ -0,0 +1,34 @@
+"""
+Background imports for heavy modules that are imported lazily.
+
+pandas, matplotlib and the provider SDKs are imported on first use so that the
+CLIs and the Streamlit script start quickly. Where the first use is
+predictable but a wait comes first (a network call, the user typing), preload()
+imports them on a daemon thread in the meantime. Python's per-module import lock
+makes a later import of the same module wait for the background one instead of
+running twice.
+"""
+import sys
+import logging
+import importlib
+import threading
+
+log = logging.getLogger(__name__)
+
+_started = set()
+_lock = threading.Lock()
+
+def _load(names):
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            log.debug("Preloading %s failed: %s", name, e)
+
+def preload(*module_names):
+    """Import the named modules on a background thread, once per process."""
+    with _lock:
+        names = [n for n in module_names if n not in _started and n not in sys.modules]
+        _started.update(names)
+    if names:
+        threading.Thread(target=_load, args=(names,), name="galen-preload", daemon=True).start()
@@ -1,28 +1,390 @@
+"""
+Retries, retry budget, call deadlines and per-provider circuit breakers for LLM calls.
+
+resilient(provider) wraps one provider call (resilient_stream the generator
+behind a streamed one, resilient_call a single SDK request made in place) and
+is the only retry layer: the provider SDK clients are built with their own
+retries switched off, so every request on a shared client must go through one
+of the three.
+
+- Transient failures (connection errors, timeouts, 408/409/425/429 and 5xx
+  responses, plus any retry_on exception types) are retried with exponential
+  backoff and full jitter, or after the server's Retry-After when it sends one.
+- Every call gets a deadline. No retry starts that could not finish before it,
+  and attempt_timeout() hands the SDK call the time that is left.
+- Retries draw from one process-wide budget that refills with successful
+  traffic, so a brownout cannot multiply the request rate by the retry count.
+- Each provider has a circuit breaker. When too many recent calls fail it
+  opens and calls fail fast with CircuitOpenError for a cool-down, after which
+  a single probe call decides whether it closes again.
+
+Retries, backoff time and rejections are added to the current trace span and
+to the llms.usage record, so they show up in trace waterfalls and eval rows;
+resilience_stats() reports the budget and breaker counters for the process.
+"""
 import time
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
 from functools import wraps
+from email.utils import parsedate_to_datetime
+
+from .tracing import current_span
+
+log = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 4                # attempts per call, the first one included
+BACKOFF_BASE = 0.5              # seconds; attempt n waits up to BACKOFF_BASE * 2**n
+BACKOFF_MAX = 20.0              # ceiling for one backoff wait, seconds
+RETRY_AFTER_MAX = 60.0          # longest server-requested wait honoured; longer ones fail the call
+CALL_DEADLINE = 180.0           # seconds a call may take across all its attempts
+MIN_ATTEMPT_TIMEOUT = 1.0       # smallest timeout handed to a provider request
+
+BUDGET_RATIO = 0.2              # retry tokens earned per first attempt (20% extra load at most)
+BUDGET_RESERVE = 10.0           # retry tokens available at start, refilled over time up to this level...
+BUDGET_REFILL_PER_S = 0.5       # ...at this rate, even without traffic
+BUDGET_MAX = 50.0               # most retry tokens that can be saved up
+
+BREAKER_WINDOW = 60.0           # seconds of outcomes the failure rate is computed over
+BREAKER_MIN_CALLS = 8           # no opening on fewer outcomes than this in the window
+BREAKER_FAILURE_RATE = 0.5      # failure share that opens the breaker
+BREAKER_COOLDOWN = 30.0         # seconds an open breaker rejects calls before letting a probe through
+
+RETRYABLE_STATUS = (408, 409, 425, 429)
+# Exception classes (matched by name anywhere in the class hierarchy, so no SDK
+# has to be imported here) that mean the request may not have reached the model
+TRANSIENT_ERRORS = ("APIConnectionError", "APITimeoutError", "TransportError", "ConnectionError",
+                    "Timeout", "TimeoutError", "RemoteProtocolError", "ChunkedEncodingError")
+
+_deadline = contextvars.ContextVar("galen_call_deadline", default=None)
+
+class CircuitOpenError(Exception):
+    """A provider's circuit breaker is open; the call was not attempted."""
+
+    def __init__(self, provider, retry_in):
+        super().__init__(f"{provider} circuit breaker is open; retry in {retry_in:.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+def status_code(exc):
+    """HTTP status of a provider SDK or requests exception, or None."""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
 
-def retry_except(exceptions_to_catch=(Exception,), tries=4, delay=1):
+def is_transient(exc):
+    """True for failures worth retrying: lost connections, timeouts, throttling and server errors."""
+    status = status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(exc).__mro__)
+
+def retry_after(exc):
+    """Seconds the server asked us to wait (Retry-After or retry-after-ms), or None."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base=BACKOFF_BASE, ceiling=BACKOFF_MAX):
+    """Full-jitter exponential backoff before retry number `attempt` (1 for the first retry)."""
+    return random.uniform(0, min(ceiling, base * 2 ** attempt))
+
+def attempt_timeout(default=CALL_DEADLINE):
+    """Seconds left before the current call's deadline, for the timeout of the next provider request."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return max(MIN_ATTEMPT_TIMEOUT, deadline - time.monotonic())
+
+class RetryBudget:
+    """
+    Token bucket shared by all retries. First attempts earn `ratio` tokens, a
+    retry spends one, and a small reserve refills over time, so retries stay a
+    bounded fraction of traffic however many calls are failing.
     """
-    Retry decorator with customizable parameters.
 
-    Args:
-        exceptions_to_catch: A tuple of exceptions to catch and retry on.
-                             Defaults to catching all Exceptions.
-        tries: The maximum number of attempts.
-        delay: The delay in seconds between retries.
+    def __init__(self, ratio=BUDGET_RATIO, reserve=BUDGET_RESERVE, refill_per_s=BUDGET_REFILL_PER_S,
+                 ceiling=BUDGET_MAX):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.refill_per_s = refill_per_s
+        self.ceiling = ceiling
+        self.tokens = reserve
+        self.updated = time.monotonic()
+        self.spent = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.tokens < self.reserve:
+            self.tokens = min(self.reserve, self.tokens + (now - self.updated) * self.refill_per_s)
+        self.updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens + self.ratio, self.ceiling)
+
+    def try_spend(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.spent += 1
+                return True
+            self.denied += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {"tokens": round(self.tokens, 2), "retries": self.spent, "denied": self.denied}
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over the failure rate of a provider's recent calls."""
+
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_rate=BREAKER_FAILURE_RATE, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_at = None
+        self._probe_started = None      # when the half-open probe was let through
+        self._outcomes = deque()        # (monotonic time, ok) within the window
+        self.counts = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Reserve an attempt, or raise CircuitOpenError if the breaker is shedding load."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open":
+                if now - self.opened_at < self.cooldown:
+                    self.counts["rejected"] += 1
+                    raise CircuitOpenError(self.name, self.cooldown - (now - self.opened_at))
+                self.state, self._probe_started = "half_open", None
+                log.info("%s circuit breaker half-open, letting a probe call through", self.name)
+            if self.state == "half_open":
+                # A probe that never reported back (its thread died) stops blocking after a cool-down
+                if self._probe_started is not None and now - self._probe_started < self.cooldown:
+                    self.counts["rejected"] += 1
+                    raise CircuitOpenError(self.name, self.cooldown - (now - self._probe_started))
+                self._probe_started = now
+            self.counts["calls"] += 1
+
+    def record(self, ok):
+        """Report the outcome of an allowed attempt; ok is False only for transient failures."""
+        with self._lock:
+            now = time.monotonic()
+            if not ok:
+                self.counts["failures"] += 1
+            if self.state == "half_open":
+                self._probe_started = None
+                if ok:
+                    self.state = "closed"
+                    self._outcomes.clear()
+                    log.info("%s circuit breaker closed", self.name)
+                else:
+                    self._open(now)
+                return
+            self._outcomes.append((now, ok))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            if self.state == "closed" and not ok and len(self._outcomes) >= self.min_calls:
+                failures = sum(1 for _, outcome in self._outcomes if not outcome)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._open(now)
+
+    def _open(self, now):
+        self.state, self.opened_at = "open", now
+        self.counts["opened"] += 1
+        self._outcomes.clear()
+        log.warning("%s circuit breaker opened; failing calls fast for %.0fs", self.name, self.cooldown)
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, **self.counts}
+
+_budget = None
+_breakers = {}
+_lock = threading.Lock()
+
+def get_retry_budget():
+    """The process-wide retry budget."""
+    global _budget
+    if _budget is None:
+        with _lock:
+            if _budget is None:
+                _budget = RetryBudget()
+    return _budget
+
+def get_breaker(provider):
+    """The shared circuit breaker of a provider."""
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(provider)
+            if breaker is None:
+                breaker = _breakers[provider] = CircuitBreaker(provider)
+    return breaker
+
+def reset_resilience():
+    """Forget the retry budget and every breaker, e.g. between benchmark runs."""
+    global _budget
+    with _lock:
+        _budget = None
+        _breakers.clear()
+
+def resilience_stats():
+    """Retry budget and per-provider breaker counters of this process."""
+    with _lock:
+        breakers = dict(_breakers)
+    return {"retry_budget": get_retry_budget().stats(),
+            "breakers": {name: breaker.stats() for name, breaker in sorted(breakers.items())}}
+
+class _Attempts:
+    """Retry bookkeeping for one resilient call."""
+
+    def __init__(self, provider, retry_on, max_attempts, deadline):
+        self.provider = provider
+        self.retry_on = retry_on
+        self.max_attempts = max_attempts
+        self.deadline = time.monotonic() + deadline
+        self.breaker = get_breaker(provider)
+        self.budget = get_retry_budget()
+        self.attempt = 0
+        self.notes = {}             # why the call stopped retrying, and what the retries cost
+
+    def start(self):
+        """Check the breaker before an attempt; the first attempt also earns retry budget."""
+        self.attempt += 1
+        if self.attempt == 1:
+            self.budget.deposit()
+        try:
+            self.breaker.allow()
+        except CircuitOpenError:
+            self.notes["circuit_open"] = True
+            self.report()
+            raise
+
+    def succeeded(self):
+        self.breaker.record(True)
+        self.report()
+
+    def failed(self, exc):
+        """Record a failed attempt and sleep before the next one; False when the call should give up."""
+        transient = is_transient(exc) or isinstance(exc, self.retry_on)
+        self.breaker.record(not transient)
+        if transient and self.attempt < self.max_attempts:
+            requested = retry_after(exc)
+            delay = requested if requested is not None else backoff_delay(self.attempt)
+            if requested is not None and requested > RETRY_AFTER_MAX:
+                log.warning("%s asked to retry after %.0fs; giving up", self.provider, requested)
+                self.notes["retry_after_s"] = requested
+            elif time.monotonic() + delay + MIN_ATTEMPT_TIMEOUT > self.deadline:
+                self.notes["deadline_exceeded"] = True
+            elif not self.budget.try_spend():
+                log.warning("Retry budget exhausted; not retrying %s call after %s", self.provider, exc)
+                self.notes["retry_budget_exhausted"] = True
+            else:
+                log.warning("%s call failed: %s. Retrying in %.1fs (attempt %d/%d)",
+                            self.provider, exc, delay, self.attempt, self.max_attempts)
+                time.sleep(delay)
+                self.notes["retry_wait_s"] = round(self.notes.get("retry_wait_s", 0) + delay, 3)
+                return True
+        self.report()
+        return False
+
+    def report(self):
+        """Put the retry count and notes on the current span and the call's usage record."""
+        if self.attempt > 1:
+            self.notes["retries"] = self.attempt - 1
+        if self.notes:
+            from llms.usage import update_usage
+            update_usage(**self.notes)
+            current_span().set(**self.notes)
+
+def resilient(provider, retry_on=(), max_attempts=MAX_ATTEMPTS, deadline=CALL_DEADLINE):
+    """
+    Retry a provider call on transient failures, within the retry budget, the
+    call deadline and the provider's circuit breaker. retry_on adds exception
+    types (such as an empty response) that should be retried too.
     """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            attempts = _Attempts(provider, retry_on, max_attempts, deadline)
+            token = _deadline.set(attempts.deadline)
+            try:
+                while True:
+                    attempts.start()
+                    try:
+                        result = func(*args, **kwargs)
+                    except Exception as e:
+                        if not attempts.failed(e):
+                            raise
+                        continue
+                    attempts.succeeded()
+                    return result
+            finally:
+                _deadline.reset(token)
+        return wrapper
+    return decorator
+
+def resilient_call(provider, func, *args, **kwargs):
+    """func(*args, **kwargs) under resilient(provider), for SDK requests made directly on a client."""
+    return resilient(provider)(func)(*args, **kwargs)
 
+def resilient_stream(provider, retry_on=(), max_attempts=MAX_ATTEMPTS, deadline=CALL_DEADLINE):
+    """
+    resilient() for a generator of chunks. A failure before the first chunk is
+    retried like a call; once a chunk has been yielded the error is raised, since
+    the caller has already seen part of the answer.
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            for attempt in range(1, tries + 1):
+            attempts = _Attempts(provider, retry_on, max_attempts, deadline)
+            while True:
+                attempts.start()
+                started = False
+                token = _deadline.set(attempts.deadline)
                 try:
-                    return func(*args, **kwargs)
-                except exceptions_to_catch as e:
-                    print(f"Exception caught: {e}. Retrying in {delay} seconds (attempt {attempt}/{tries})")
-                    time.sleep(delay)
-            else:  # No exception in the final attempt
-                return func(*args, **kwargs) 
-
+                    for chunk in func(*args, **kwargs):
+                        if not started:
+                            _deadline.reset(token)
+                            token, started = None, True
+                        yield chunk
+                except Exception as e:
+                    if token is not None:
+                        _deadline.reset(token)
+                    if started:
+                        attempts.breaker.record(not is_transient(e))
+                        attempts.report()
+                        raise
+                    if not attempts.failed(e):
+                        raise
+                    continue
+                if token is not None:
+                    _deadline.reset(token)
+                attempts.succeeded()
+                return
         return wrapper
     return decorator
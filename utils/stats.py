@@ -0,0 +1,9 @@
+def percentile(values, q):
+    """Linear-interpolated percentile of a list of numbers (q in 0..100); None values are ignored."""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
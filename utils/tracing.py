@@ -0,0 +1,242 @@
+"""
+Lightweight nested spans showing where a request's time goes.
+
+    with span("run_sql", sql=sql_query) as s:
+        ...
+        s.set(rows=len(df), cache_hit=False)
+
+Each span records wall and CPU time (of its own thread) and free-form
+attributes such as token counts, row counts, cache hits and retries. Spans nest
+through a ContextVar; when the outermost span of a trace ends, the whole trace
+is appended to logs/trace.jsonl (one span per line) if tracing is on, and
+handed to any capture() block that is collecting spans for display.
+
+Tracing is off unless GALEN_TRACE is set (to "on" or a file path) or
+enable_tracing() is called. While it is off and nothing is capturing, span()
+returns a shared no-op object, so instrumented code pays one ContextVar lookup.
+"""
+import os
+import json
+import time
+import uuid
+import inspect
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TRACE_PATH = os.path.join("logs", "trace.jsonl")
+MAX_ATTR_CHARS = 300        # string attributes are cut to this length
+
+_current = ContextVar("galen_span", default=None)
+_collector = ContextVar("galen_trace_collector", default=None)
+_write_lock = threading.Lock()
+
+def _initial_path():
+    setting = os.getenv("GALEN_TRACE", "")
+    if setting.lower() in ("", "off", "0", "false", "no"):
+        return None
+    return TRACE_PATH if setting.lower() in ("on", "1", "true", "yes") else setting
+
+_trace_path = _initial_path()
+
+def enable_tracing(path=TRACE_PATH):
+    """Write every finished trace to path (JSONL)."""
+    global _trace_path
+    _trace_path = path
+
+def disable_tracing():
+    global _trace_path
+    _trace_path = None
+
+def tracing_enabled():
+    return _trace_path is not None
+
+def _clean(value):
+    if isinstance(value, str) and len(value) > MAX_ATTR_CHARS:
+        return value[:MAX_ATTR_CHARS] + "..."
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return _clean(str(value))
+
+class Span:
+    """One timed step of a trace. Use as a context manager."""
+
+    __slots__ = ("name", "attrs", "parent", "trace_id", "span_id", "start", "wall_s", "cpu_s",
+                 "error", "_spans", "_collector", "_activate", "_token", "_t0", "_cpu0")
+
+    def __init__(self, name, parent=None, collector=None, activate=True, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.wall_s = self.cpu_s = self.error = None
+        self._spans = parent._spans if parent is not None else []
+        self._collector = collector
+        self._activate = activate
+        self._token = None
+
+    def set(self, **attrs):
+        """Add or overwrite attributes."""
+        self.attrs.update(attrs)
+        return self
+
+    def incr(self, key, n=1):
+        """Add n to a counter attribute such as retries."""
+        self.attrs[key] = self.attrs.get(key, 0) + n
+        return self
+
+    def __enter__(self):
+        if self._activate:
+            self._token = _current.set(self)
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._cpu0 = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall_s = time.perf_counter() - self._t0
+        self.cpu_s = time.thread_time() - self._cpu0
+        if exc is not None:
+            self.error = f"{type(exc).__name__}: {exc}"
+        if self._token is not None:
+            _current.reset(self._token)
+        self._spans.append(self.to_dict())
+        if self.parent is None:
+            _finish(self._spans, self._collector)
+        return False
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "name": self.name, "start": self.start, "wall_s": self.wall_s, "cpu_s": self.cpu_s,
+            "error": self.error, "attrs": {k: _clean(v) for k, v in self.attrs.items()},
+        }
+
+class _NoopSpan:
+    """Stands in for a span when nothing is recorded."""
+
+    trace_id = span_id = None
+
+    def set(self, **attrs):
+        return self
+
+    def incr(self, key, n=1):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP = _NoopSpan()
+
+def _finish(spans, collector):
+    """A trace is complete: export it and hand it to the collector, if any."""
+    spans.sort(key=lambda s: s["start"])
+    if collector is not None:
+        collector.extend(spans)
+    path = _trace_path
+    if path is None:
+        return
+    lines = "".join(json.dumps(s, default=str) + "\n" for s in spans)
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with _write_lock, open(path, "a", encoding="utf-8") as file:
+            file.write(lines)
+    except OSError:
+        pass
+
+def span(name, activate=True, **attrs):
+    """
+    Start a span named name under the current one. With activate=False it does
+    not become the parent of spans opened while it runs (used for generators,
+    whose consumer runs between their steps).
+    """
+    parent = _current.get()
+    collector = _collector.get()
+    if parent is None and collector is None and _trace_path is None:
+        return NOOP
+    return Span(name, parent=parent, collector=collector, activate=activate, **attrs)
+
+def current_span():
+    """The innermost open span, or the no-op span."""
+    return _current.get() or NOOP
+
+def traced(name=None, **attrs):
+    """Decorator running each call of a function (or each full iteration of a generator) in a span."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                with span(span_name, activate=False, **attrs):
+                    yield from func(*args, **kwargs)
+            return generator_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attrs):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def capture():
+    """Collect the spans of every trace started inside the block into the yielded list."""
+    spans = []
+    token = _collector.set(spans)
+    try:
+        yield spans
+    finally:
+        _collector.reset(token)
+
+def read_traces(path=TRACE_PATH):
+    """Spans from a trace file, grouped as {trace_id: [span, ...]} in file order."""
+    traces = {}
+    if not os.path.exists(path):
+        return traces
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                traces.setdefault(record["trace_id"], []).append(record)
+    return traces
+
+def waterfall_rows(spans):
+    """(depth, name, offset_s, wall_s, cpu_s, attrs) per span, in start order, for display."""
+    if not spans:
+        return []
+    by_id = {s["span_id"]: s for s in spans}
+    origin = min(s["start"] for s in spans)
+
+    def depth(s):
+        d = 0
+        while s["parent_id"] in by_id:
+            s, d = by_id[s["parent_id"]], d + 1
+        return d
+
+    return [(depth(s), s["name"], s["start"] - origin, s["wall_s"], s["cpu_s"], s["attrs"])
+            for s in sorted(spans, key=lambda s: s["start"])]
+
+def waterfall_figure(spans, width=10):
+    """Matplotlib Figure with one bar per span, offset by its start time and indented by depth."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    rows = waterfall_rows(spans)
+    fig = Figure(figsize=(width, 0.35 * len(rows) + 1))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    for i, (d, name, offset, wall, cpu, _) in enumerate(rows):
+        ax.barh(i, wall, left=offset, color="tab:blue", alpha=0.35)
+        ax.barh(i, cpu, left=offset, color="tab:blue", height=0.4)
+    ax.set_yticks(range(len(rows)))
+    ax.set_yticklabels(["  " * d + name for d, name, *_ in rows])
+    ax.invert_yaxis()
+    ax.set_xlabel("seconds (dark: CPU time)")
+    fig.tight_layout()
+    return fig